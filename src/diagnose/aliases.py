@@ -0,0 +1,128 @@
+"""
+find categorical variables that are relabelings of each other (aliases, e.g. a strain name and a strain id) or nested
+in each other, so the analyses test one representative of each set of aliases
+
+variables are compared by their canonical codes: the values numbered in order of first appearance, within each group.
+two variables are aliases exactly when their canonical codes are the same, so aliases are found by hashing the codes.
+
+:created: 2021
+:copyright: (c) 2021, GDA
+:license: see LICENSE for more details
+"""
+
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import diagnose.make_record as rec
+
+
+def canonical_codes(values, group_codes=None):
+    """
+    number the values in order of first appearance (within each group), missing values included
+
+    :param values: array of values
+    :param group_codes: array with the integer group code of each sample, None for no groups
+    :return: array of int64 codes
+    """
+
+    codes = pd.factorize(values)[0].astype('int64') + 1  # missing values are -1
+    if group_codes is not None:
+        codes = pd.factorize(group_codes.astype('int64') * (codes.max() + 1) + codes)[0].astype('int64')
+    else:
+        codes = pd.factorize(codes)[0].astype('int64')
+
+    return codes
+
+
+def _group_codes(data_df, group_col):
+    if group_col is None:
+        return None
+    return pd.factorize(data_df[group_col])[0]
+
+
+def find_aliases(data_df, variables, group_col=None):
+    """
+    sets of variables that are relabelings of each other within each group
+
+    :param data_df: dataframe
+    :param variables: categorical variables
+    :param group_col: column the data is grouped by, None to compare over all samples
+    :return: list of alias classes, lists of variables in the order of variables, the first one is the representative
+    """
+
+    group_codes = _group_codes(data_df, group_col)
+
+    classes = dict()
+    for var in variables:
+        key = hashlib.sha1(canonical_codes(data_df[var].values, group_codes).tobytes()).hexdigest()
+        classes.setdefault(key, list()).append(var)
+
+    return list(classes.values())
+
+
+def representatives(alias_classes):
+    """
+    :param alias_classes: list of alias classes from find_aliases
+    :return: list with the representative of each class
+    """
+
+    return [x[0] for x in alias_classes]
+
+
+def find_nested(data_df, variables, group_col=None):
+    """
+    pairs of variables where each value of the first goes with a single value of the second within each group, e.g. a
+    strain nested in a species. variables that are constant (within each group) and aliases are not reported
+
+    :param data_df: dataframe
+    :param variables: categorical variables, e.g. the representatives from find_aliases
+    :param group_col: column the data is grouped by, None to compare over all samples
+    :return: list of (nested variable, outer variable)
+    """
+
+    group_codes = _group_codes(data_df, group_col)
+    num_groups = 1 if group_codes is None else len(np.unique(group_codes))
+
+    codes = np.column_stack([canonical_codes(data_df[var].values, group_codes) for var in variables])
+    num_levels = codes.max(axis=0) + 1
+    varying = num_levels > num_groups
+
+    nested = list()
+    for i, var in enumerate(variables):
+        # the other variables are constant within each value of var if their min and max are the same
+        order = np.argsort(codes[:, i], kind='mergesort')
+        starts = np.flatnonzero(np.r_[True, np.diff(codes[order, i]) != 0])
+        sorted_codes = codes[order]
+        constant = (np.minimum.reduceat(sorted_codes, starts, axis=0) ==
+                    np.maximum.reduceat(sorted_codes, starts, axis=0)).all(axis=0)
+        for j in np.flatnonzero(constant & varying & (num_levels < num_levels[i])):
+            nested.append((var, variables[j]))
+
+    return nested
+
+
+def save_aliases(alias_classes, nested, group_col, output_dir, writer=None):
+    """
+    save the aliases and nested variables found for a group column
+
+    :param alias_classes: list of alias classes from find_aliases
+    :param nested: list of pairs from find_nested
+    :param group_col: column the data is grouped by
+    :param output_dir: output directory
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
+    :return: path to the file
+    """
+
+    rows = [(x, aliases[0], 'alias_of') for aliases in alias_classes for x in aliases[1:]]
+    rows += [(inner, outer, 'nested_in') for inner, outer in nested]
+    aliases_df = pd.DataFrame(rows, columns=['variable', 'related_variable', 'relation'])
+
+    out_path = os.path.join(output_dir, "aliases__" + group_col + ".tsv")
+    print("saving to: " + out_path)
+    with rec.open_output(out_path, writer=writer) as out_file:
+        aliases_df.to_csv(out_file, sep='\t', index=False)
+
+    return out_path
@@ -16,14 +16,311 @@ if platform.system() == "Darwin":
 import matplotlib.pyplot as plt
 import seaborn as sns
 import scipy.stats as stats
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
 import pandas as pd
 import itertools
 import numpy as np
-import statsmodels.stats.multitest as stat
 import os
+from concurrent.futures import ProcessPoolExecutor
+import diagnose.make_record as rec
+import diagnose.multiple_testing as mt
+import diagnose.rank_tests as rt
+import diagnose.cardinality as cardinality
 
 
-def chi2_test(cat_vars, data_df, group):
+def contingency_table(codes_1, codes_2):
+    """
+    contingency table of two categorical variables from their integer codes, with one bincount instead of a crosstab
+
+    :param codes_1: array of the codes (0 to the number of levels - 1) of the first variable
+    :param codes_2: array of the codes of the second variable
+    :return: array of counts (levels of the first variable x levels of the second)
+    """
+
+    num_1, num_2 = codes_1.max() + 1, codes_2.max() + 1
+
+    return np.bincount(codes_1 * num_2 + codes_2, minlength=num_1 * num_2).reshape(num_1, num_2)
+
+
+def cramers_v(observed):
+    """
+    bias-corrected Cramér's V (Bergsma, 2013) of a contingency table: the strength of the dependence from 0 to 1, which
+    unlike the p-value doesn't grow with the number of samples
+
+    :param observed: array of counts from contingency_table
+    :return: Cramér's V, NaN if a variable has a single level
+    """
+
+    n = observed.sum()
+    if n < 2:
+        return np.nan
+
+    expected = np.outer(observed.sum(axis=1), observed.sum(axis=0)) / n
+
+    return cramers_v_from_chi2(((observed - expected) ** 2 / expected).sum(), n, *observed.shape)
+
+
+def cramers_v_from_chi2(statistic, n, num_rows, num_cols):
+    """
+    bias-corrected Cramér's V from the pearson chi^2 statistic (without continuity correction) of a table
+
+    :param statistic: chi^2 statistic
+    :param n: number of samples
+    :param num_rows: number of rows of the table
+    :param num_cols: number of columns of the table
+    :return: Cramér's V, NaN if a variable has a single level
+    """
+
+    if n < 2:
+        return np.nan
+
+    phi2_corrected = max(0.0, statistic / n - (num_rows - 1) * (num_cols - 1) / (n - 1))
+    rows_corrected = num_rows - (num_rows - 1) ** 2 / (n - 1)
+    cols_corrected = num_cols - (num_cols - 1) ** 2 / (n - 1)
+    denominator = min(rows_corrected - 1, cols_corrected - 1)
+
+    return np.sqrt(phi2_corrected / denominator) if denominator > 0 else np.nan
+
+
+def theils_u(observed):
+    """
+    Theil's U (uncertainty coefficient) of a contingency table in both directions: the fraction of the entropy of one
+    variable that is explained by the other, from 0 (independent) to 1 (determined by the other variable)
+
+    :param observed: array of counts from contingency_table
+    :return: (U of the rows given the columns, U of the columns given the rows), NaN for a variable with a single level
+    """
+
+    return theils_u_from_counts(observed.ravel(), observed.sum(axis=1), observed.sum(axis=0))
+
+
+def theils_u_from_counts(counts, row_sums, col_sums):
+    """
+    Theil's U from the counts of the cells of a table, which only need to include the nonzero cells
+
+    :param counts: counts of the cells
+    :param row_sums: counts of each row
+    :param col_sums: counts of each column
+    :return: (U of the rows given the columns, U of the columns given the rows)
+    """
+
+    n = row_sums.sum()
+
+    def entropy(x):
+        p = x[x > 0] / n
+        return -(p * np.log(p)).sum()
+
+    h_rows, h_cols = entropy(row_sums), entropy(col_sums)
+    mutual_info = h_rows + h_cols - entropy(counts)
+
+    return (mutual_info / h_rows if h_rows > 0 else np.nan,
+            mutual_info / h_cols if h_cols > 0 else np.nan)
+
+
+def fails_expected_count_rule(expected):
+    """
+    Cochran's rule for the chi^2 approximation: every expected count at least 1 and at most 20% of them below 5
+
+    :param expected: array of expected counts
+    :return: True if the chi^2 p-value is unreliable
+    """
+
+    return bool((expected < 1).any() or (expected < 5).mean() > 0.2)
+
+
+def random_tables(row_sums, col_sums, num_tables, rng):
+    """
+    random contingency tables with the given margins (from the multivariate hypergeometric distribution), drawn for all
+    tables at once one cell at a time: each cell is a hypergeometric draw of the samples left in its row from the
+    samples left in its column and the columns after it, so the cost doesn't depend on the number of samples
+
+    :param row_sums: array of the counts of each row
+    :param col_sums: array of the counts of each column
+    :param num_tables: number of tables
+    :param rng: numpy random generator
+    :return: array (tables x rows x columns) of counts
+    """
+
+    num_rows, num_cols = len(row_sums), len(col_sums)
+    tables = np.zeros((num_tables, num_rows, num_cols), dtype='int64')
+    cols_left = np.tile(np.asarray(col_sums, dtype='int64'), (num_tables, 1))
+
+    for i in range(num_rows - 1):
+        row_left = np.full(num_tables, row_sums[i], dtype='int64')
+        others_left = cols_left.sum(axis=1)
+        for j in range(num_cols - 1):
+            others_left -= cols_left[:, j]
+            tables[:, i, j] = rng.hypergeometric(cols_left[:, j], others_left, row_left)
+            row_left -= tables[:, i, j]
+            cols_left[:, j] -= tables[:, i, j]
+        tables[:, i, -1] = row_left
+        cols_left[:, -1] -= row_left
+    tables[:, -1, :] = cols_left
+
+    return tables
+
+
+def monte_carlo_pvalue(observed, replicates=10000, max_batch_elements=2 ** 22):
+    """
+    monte carlo exact test of independence: the fraction of random tables with the same margins whose pearson chi^2
+    statistic is at least the observed one (counting the observed table, so the p-value is never 0). the random tables
+    only depend on the margins, and are seeded by them, so the p-value of a table is the same whatever the order of its
+    levels or the process it is computed in
+
+    :param observed: array of counts
+    :param replicates: number of random tables
+    :param max_batch_elements: the random tables are drawn in batches of at most this many cells
+    :return: p-value
+    """
+
+    observed = np.asarray(observed)
+    row_sums, col_sums = np.sort(observed.sum(axis=1)), np.sort(observed.sum(axis=0))
+    rng = np.random.default_rng(np.random.SeedSequence([int(x) for x in np.r_[row_sums, 0, col_sums]]))
+
+    expected = np.outer(observed.sum(axis=1), observed.sum(axis=0)) / observed.sum()
+    statistic = ((observed - expected) ** 2 / expected).sum()
+    expected = np.outer(row_sums, col_sums) / observed.sum()
+
+    batch_size = max(1, min(replicates, max_batch_elements // observed.size))
+    num_extreme = 0
+    for start in range(0, replicates, batch_size):
+        tables = random_tables(row_sums, col_sums, min(batch_size, replicates - start), rng)
+        stats_sim = ((tables - expected[None]) ** 2 / expected[None]).sum(axis=(1, 2))
+        # small tolerance so tables with the same statistic as the observed one count despite rounding
+        num_extreme += np.count_nonzero(stats_sim >= statistic * (1 - 1e-7))
+
+    return (1 + num_extreme) / (1 + replicates)
+
+
+def monte_carlo_tests(results, sparse_tables, replicates=10000, n_jobs=1):
+    """
+    replace the chi^2 p-values of the tables that fail the expected count rule with monte carlo exact p-values
+
+    :param results: dictionary of arrays from _empty_chi2_results
+    :param sparse_tables: dictionary of row: contingency table, from _fill_chi2_tests
+    :param replicates: number of random tables per pair, 0 to keep the chi^2 approximation
+    :param n_jobs: number of processes to spread the pairs over
+    """
+
+    if replicates <= 0 or len(sparse_tables) == 0:
+        return
+
+    rows = sorted(sparse_tables)
+    tables = [sparse_tables[x] for x in rows]
+
+    if n_jobs is not None and n_jobs > 1 and len(rows) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            pvals = list(executor.map(monte_carlo_pvalue, tables, [replicates] * len(rows)))
+    else:
+        pvals = [monte_carlo_pvalue(table, replicates) for table in tables]
+
+    results['p_values'][rows] = pvals
+    results['p_value_method'][rows] = 'monte_carlo'
+
+
+def _fill_chi2_tests(results, start, cat_vars, data_df, group, sparse_tables=None, max_table_cells=10 ** 6,
+                     decisions=None):
+    """
+    run the chi^2 test for every pair of categorical variables and write the results, with the effect sizes from the
+    same contingency table, into preallocated arrays
+
+    :param results: dictionary of arrays with the columns of the output of chi2_test
+    :param start: first row to write to
+    :param cat_vars: categorical variables
+    :param data_df: data set of the experiments performed
+    :param group: group the data belongs to
+    :param sparse_tables: dictionary the contingency tables that fail the expected count rule are added to, by row,
+    for monte_carlo_tests
+    :param max_table_cells: contingency tables with more cells than this are counted sparsely, without monte carlo test
+    :param decisions: list the sparse tables are added to, for the record (None to only print them)
+    :return: row after the last one written
+    """
+
+    # each variable is coded once, the contingency tables of its pairs are counted from the codes
+    codes = {var: pd.factorize(data_df[var].astype('str'))[0] for var in cat_vars}
+
+    row = start
+    for var_1, var_2 in itertools.combinations(cat_vars, 2):
+
+        # tables too large to count densely only keep their observed cells
+        num_cells = (codes[var_1].max() + 1) * (codes[var_2].max() + 1)
+        if num_cells > max_table_cells:
+            _fill_sparse_chi2_test(results, row, var_1, var_2, codes[var_1], codes[var_2], group)
+            cardinality.log_decision('dependence', group, [var_1, var_2], 'sparse_table',
+                                     "{0:d} cells, chi-squared approximation without monte carlo test"
+                                     .format(int(num_cells)), decisions)
+            row += 1
+            continue
+
+        # complete chi^2 test
+        ct = contingency_table(codes[var_1], codes[var_2])
+        chi2_t = stats.chi2_contingency(ct)
+
+        # record pertinent variables
+        results['group'][row] = group
+        results['cat_var_1'][row] = var_1
+        results['cat_var_2'][row] = var_2
+        results['chi_squared_val'][row] = chi2_t[0]
+        results['p_values'][row] = chi2_t[1]
+        results['deg_of_fr'][row] = chi2_t[2]
+        results['p_value_method'][row] = 'chi_squared'
+        if sparse_tables is not None and chi2_t[2] > 0 and fails_expected_count_rule(chi2_t[3]):
+            sparse_tables[row] = ct
+        results['cramers_v'][row] = cramers_v(ct)
+        results['theils_u_1_2'][row], results['theils_u_2_1'][row] = theils_u(ct)
+        row += 1
+
+    return row
+
+
+def _fill_sparse_chi2_test(results, row, var_1, var_2, codes_1, codes_2, group):
+    """
+    chi^2 test and effect sizes of a pair of variables from the observed cells of their contingency table, for pairs
+    with too many levels to count the full table
+
+    :param results: dictionary of arrays with the columns of the output of chi2_test
+    :param row: row to write to
+    :param var_1: first variable
+    :param var_2: second variable
+    :param codes_1: codes of the first variable
+    :param codes_2: codes of the second variable
+    :param group: group the data belongs to
+    """
+
+    counts, row_sums, col_sums, rows, cols = cardinality.sparse_contingency(codes_1, codes_2)
+    statistic, dof = cardinality.sparse_chi2(counts, row_sums, col_sums, rows, cols)
+
+    results['group'][row] = group
+    results['cat_var_1'][row] = var_1
+    results['cat_var_2'][row] = var_2
+    results['chi_squared_val'][row] = statistic
+    results['p_values'][row] = stats.chi2.sf(statistic, dof) if dof > 0 else 1.0
+    results['deg_of_fr'][row] = dof
+    results['p_value_method'][row] = 'chi_squared_sparse'
+    results['cramers_v'][row] = cramers_v_from_chi2(statistic, row_sums.sum(), len(row_sums), len(col_sums))
+    results['theils_u_1_2'][row], results['theils_u_2_1'][row] = theils_u_from_counts(counts, row_sums, col_sums)
+
+
+def _empty_chi2_results(num_tests):
+    """
+    :param num_tests: number of tests
+    :return: dictionary of arrays for the columns of the output of chi2_test
+    """
+
+    return {'group': np.empty(num_tests, dtype=object),
+            'cat_var_1': np.empty(num_tests, dtype=object),
+            'cat_var_2': np.empty(num_tests, dtype=object),
+            'chi_squared_val': np.empty(num_tests),
+            'p_values': np.empty(num_tests),
+            'deg_of_fr': np.empty(num_tests, dtype='int64'),
+            'p_value_method': np.empty(num_tests, dtype=object),
+            'cramers_v': np.empty(num_tests),
+            'theils_u_1_2': np.empty(num_tests),
+            'theils_u_2_1': np.empty(num_tests)}
+
+
+def chi2_test(cat_vars, data_df, group, mc_replicates=10000, n_jobs=1, max_table_cells=10 ** 6, decisions=None):
     """
     function to perform the chi^2 test for independence on a given data set - every combination of categorical
     variables is tested for dependence (with the idea that dependence indicates a lack of randomization in the
@@ -33,47 +330,72 @@ def chi2_test(cat_vars, data_df, group):
     continuous variables/variables that aren't being analyzed for one reason or another
     :param data_df: data set of the experiments performed
     :param group: categorical variable by which to group and then analyze the data
-    :return: df: dataframe with the group, combinations of the categorical variables, chi^2 values, p-values, and
-    degrees of freedom
+    :param mc_replicates: number of random tables for the monte carlo exact tests, 0 to always use the chi^2
+    approximation
+    :param n_jobs: number of processes to spread the monte carlo tests over
+    :param max_table_cells: contingency tables with more cells than this are counted sparsely, without monte carlo test
+    :param decisions: list the sparse tables are added to, for the record (None to only print them)
+    :return: df: dataframe with the group, combinations of the categorical variables, chi^2 values, p-values,
+    degrees of freedom, how the p-value was computed (p_value_method: chi_squared, monte_carlo for tables that fail
+    the expected count rule, or chi_squared_sparse for tables too large to count densely), and the effect sizes:
+    Cramér's V, and Theil's U of cat_var_1 given cat_var_2 (theils_u_1_2) and of cat_var_2 given cat_var_1
+    (theils_u_2_1)
     """
 
-    # function to get chi-squared test statistics and p-values 
-    p_val = []
-    chi2 = []
-    df = []
-    cat_var_1 = []
-    cat_var_2 = []
+    num_vars = len(cat_vars)
+    results = _empty_chi2_results(num_vars * (num_vars - 1) // 2)
+    sparse_tables = dict()
+    _fill_chi2_tests(results, 0, cat_vars, data_df, group, sparse_tables, max_table_cells, decisions)
+    monte_carlo_tests(results, sparse_tables, mc_replicates, n_jobs)
 
-    # loop through combinations of categorical variables
-    for i in list(itertools.combinations(cat_vars, 2)):
+    return pd.DataFrame(results)
 
-        # complete chi^2 test
-        ct = pd.crosstab(data_df[i[0]].astype('str'), data_df[i[1]].astype('str'))
-        chi2_t = stats.chi2_contingency(ct)
 
-        # record pertinent variables
-        chi2.append(chi2_t[0])
-        p_val.append(chi2_t[1])
-        df.append(chi2_t[2])
-        cat_var_1.append(i[0])
-        cat_var_2.append(i[1])
-
-    # populate data frame with information from lists
-    df = pd.DataFrame({'group': [group] * len(p_val),
-                       'cat_var_1': cat_var_1,
-                       'cat_var_2': cat_var_2,
-                       'chi_squared_val': chi2,
-                       'p_values': p_val,
-                       'deg_of_fr': df})
+def kruskal_test(cat_vars, cont_vars, data_df, group):
+    """
+    Kruskal-Wallis test of every continuous variable across the values of every categorical variable, to find
+    continuous variables that depend on categorical ones (e.g. an incubation temperature that differs between labs).
+    all pairs are computed at once from the ranks of the continuous variables and the level codes of the categorical
+    ones. missing continuous values are left out
 
-    return df
+    :param cat_vars: categorical variables
+    :param cont_vars: continuous variables
+    :param data_df: data set of the experiments performed
+    :param group: group the data belongs to
+    :return: df: dataframe in the format of chi2_test, the h-stat in chi_squared_val (it follows a chi^2 distribution
+    with deg_of_fr degrees of freedom) and the categorical and continuous variable in cat_var_1 and cat_var_2, with the
+    effect size epsilon_squared = h / (n - 1) added
+    """
+
+    values = np.vstack([pd.to_numeric(data_df[var], errors='coerce').values.astype(float) for var in cont_vars])
+    ranks = rt.rank_rows(values)
+    indicator, starts = rt.one_hot([pd.factorize(data_df[var].astype('str'))[0] for var in cat_vars])
 
+    h_stat, dof, n = rt.kruskal_h_pairs(ranks, indicator, starts, rt.tie_correction(ranks))
 
-def multiple_testing_correction(df):
+    # one row per pair, categorical variable first, skipping pairs that can't be tested
+    cont_index, cat_index = np.meshgrid(np.arange(len(cont_vars)), np.arange(len(cat_vars)), indexing='ij')
+    keep = np.isfinite(h_stat) & (dof >= 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        epsilon_squared = h_stat / (n[:, None] - 1)
+
+    df = pd.DataFrame({'group': group,
+                       'cat_var_1': np.array(cat_vars, dtype=object)[cat_index[keep]],
+                       'cat_var_2': np.array(cont_vars, dtype=object)[cont_index[keep]],
+                       'chi_squared_val': h_stat[keep],
+                       'p_values': stats.chi2.sf(h_stat[keep], dof[keep]),
+                       'deg_of_fr': dof[keep],
+                       'epsilon_squared': epsilon_squared[keep]})
+
+    return df.sort_values(by=['cat_var_1', 'cat_var_2'], kind='mergesort').reset_index(drop=True)
+
+
+def multiple_testing_correction(df, correction='fdr_bh'):
     """
     due to the quantity of tests being conducted, it is appropriate to utilize a multiple testing correction
 
     :param df: dataframe with original uncorrected values
+    :param correction: multiple testing correction, one of multiple_testing.METHODS
     :return: df: dataframe with corrected values appended onto the end of it
     """
 
@@ -81,70 +403,195 @@ def multiple_testing_correction(df):
 
     df = df.reset_index()
 
-    # calculate correction - Benjamini & Hochberg/Yekutieli false discovery rate control procedure 
-    fdr = stat.multipletests(df.p_values, alpha=0.01, method='fdr_bh')
+    fdr = mt.correct(df.p_values.values, alpha=0.01, groups=df.group.values, method=correction)
 
     # record statistics/hypothesis test decision
     df['reject'] = fdr[0]
     df['corrected_p_value'] = fdr[1]
 
     # get new chi-squared values based on corrected p-value (for some values of p, the inverse cdf of the chi-squared
-    # returns infinity rather than an exact value)
-    corrected_chi_squared = []
+    # returns infinity rather than an exact value). if the corrected p-value is the same as the original p-value, the
+    # chi-squared value is kept
+    df['corrected_chi_squared'] = mt.corrected_statistic(df.chi_squared_val.values, df.p_values.values, fdr[1],
+                                                         stats.chi2, df=df.deg_of_fr.values)
 
-    for i in range(len(df)):
-        # if the corrected p-value is the same as the original p-value, don't recalculate the chi-squared value
-        if df.p_values[i] == df.corrected_p_value[i]:
-            corrected_chi_squared.append(df.chi_squared_val[i])
-        else:
-            # use inverse cdf of chi-squared distribution to get corrected chi-squared value, i.e. the value that
-            # corresponds to the corrected p-value
-            corrected_chi_squared.append(stats.chi2.ppf(q=df.corrected_p_value[i], df=df.deg_of_fr[i]))
+    return df
 
-    df['corrected_chi_squared'] = corrected_chi_squared
 
-    return df
+def pair_matrix(cat_vars, df, col, col_transposed=None):
+    """
+    square matrix of a value of the variable pairs, e.g. the corrected p-values. the matrix is filled directly from the
+    pairs, both ways, the diagonal is NaN
+
+    :param cat_vars: categorical variables, in the order of the rows/columns
+    :param df: data frame with the results of the pairs of one group
+    :param col: column of df to put in the matrix, in row cat_var_1 and column cat_var_2
+    :param col_transposed: column for row cat_var_2 and column cat_var_1, for values that aren't symmetric (e.g.
+    Theil's U), None to use col
+    :return: dataframe (variables x variables)
+    """
+
+    index = {var: i for i, var in enumerate(cat_vars)}
+    rows = df['cat_var_1'].map(index).values
+    cols = df['cat_var_2'].map(index).values
+
+    matrix = np.full((len(cat_vars), len(cat_vars)), np.nan)
+    matrix[rows, cols] = df[col].values
+    matrix[cols, rows] = df[col if col_transposed is None else col_transposed].values
+
+    return pd.DataFrame(matrix, index=cat_vars, columns=cat_vars)
+
+
+def cluster_order(pval_matrix):
+    """
+    order of the variables from hierarchical clustering (average linkage) with the p-values as distances, so
+    dependent variables end up next to each other
+
+    :param pval_matrix: dataframe from pair_matrix with p-values
+    :return: list of variables
+    """
+
+    if len(pval_matrix) < 3:
+        return list(pval_matrix.index)
+
+    dist = np.nan_to_num(pval_matrix.values.astype(float), nan=1.0)
+    np.fill_diagonal(dist, 0)
+    linkage = hierarchy.linkage(squareform(dist, checks=False), method='average')
 
+    return list(pval_matrix.index[hierarchy.leaves_list(linkage)])
 
-def plot_heatmap(cat_vars, df, output_dir, group=" "):
+
+def plot_heatmap(cat_vars, df, output_dir, group=" ", group_col=None, max_annotated=20,
+                 columns=('corrected_p_value', 'cramers_v', 'theils_u'), report=None, writer=None):
     """
-    function to plot the heatmaps of the corrected_chi_squared values and the corrected_p_value values
+    function to plot the heatmaps of the corrected_p_value values and the effect sizes. variables are ordered by
+    hierarchical clustering of the p-values
 
     :param cat_vars: categorical variables
     :param df: data frame with data on the variables to be plotted
     :param output_dir: directory to save data to 
     :param group: group within the group_col that corresponds to the data, e.g. XNOR or AND
+    :param group_col: column the data is grouped by, for the html report
+    :param max_annotated: values are written in the cells only up to this many variables
+    :param columns: columns of df to plot, theils_u is plotted as the U of the row variable given the column variable
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
-    cols_to_plot = ['corrected_p_value']  # ['corrected_chi_squared', 'corrected_p_value']
-    for i in cols_to_plot:
+    # the tables of run are written next to the heatmaps, nothing is written to output_dir with a bundle
+    if (writer is None or writer.bundle is None) and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+    order = cluster_order(pair_matrix(cat_vars, df, 'corrected_p_value'))
+
+    for i in columns:
+        if i == 'theils_u':
+            matrix = pair_matrix(cat_vars, df, 'theils_u_1_2', 'theils_u_2_1').loc[order, order]
+        else:
+            matrix = pair_matrix(cat_vars, df, i).loc[order, order]
+
+        if report is not None:
+            report.add_matrix('dependence', group_col, group, matrix, i)
+            continue
 
-        # reorganize data to make plotting nicer
-        dta = df[['cat_var_1', 'cat_var_2', i]]
-        dta_hm = dta.append(dta.reindex(columns = ['cat_var_2', 'cat_var_1', i]).rename(columns={'cat_var_1':'cat_var_2', 'cat_var_2':'cat_var_1'}))
+        # effect sizes are on the same 0 to 1 scale in every heatmap
+        limits = dict() if i in ['corrected_p_value', 'p_values'] else {'vmin': 0, 'vmax': 1}
 
-        ax = sns.heatmap(dta_hm.pivot_table(values=i, index='cat_var_1', columns='cat_var_2'), annot=True)
+        size = max(6, 0.3 * len(order))
+        fig, ax = plt.subplots(figsize=(size * 1.25, size))
+        sns.heatmap(matrix, annot=len(order) <= max_annotated, ax=ax,
+                    xticklabels=True, yticklabels=True, **limits)
         ax.set(xlabel=None)
         ax.set(ylabel=None)
         ax.invert_yaxis()
         plt.title(i)
 
         output = os.path.join(output_dir, 'dep_{}_{}_heatmap.png'.format(group, i))
-        if not os.path.exists(os.path.join(output_dir)):
-            os.makedirs(os.path.join(output_dir), exist_ok=True)
 
         print("saving to: " + output)
-        plt.savefig(output, bbox_inches='tight')
-        plt.close()
+        with rec.open_output(output, 'wb', writer=writer) as out_file:
+            plt.savefig(out_file, format='png', bbox_inches='tight')
+        plt.close(fig)
+
+
+def plot_mixed_heatmap(df, output_dir, group=" ", group_col=None, max_annotated=20, report=None, writer=None):
+    """
+    heatmap of the corrected p-values of the categorical (rows) x continuous (columns) pairs from kruskal_test
+
+    :param df: data frame with the corrected results of one group
+    :param output_dir: directory to save data to
+    :param group: group within the group_col that corresponds to the data
+    :param group_col: column the data is grouped by, for the html report
+    :param max_annotated: values are written in the cells only up to this many variables
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
+    """
+
+    cat_vars, rows = np.unique(df['cat_var_1'].values.astype(str), return_inverse=True)
+    cont_vars, cols = np.unique(df['cat_var_2'].values.astype(str), return_inverse=True)
+    matrix = np.full((len(cat_vars), len(cont_vars)), np.nan)
+    matrix[rows, cols] = df['corrected_p_value'].values
+    matrix = pd.DataFrame(matrix, index=cat_vars, columns=cont_vars)
+
+    if report is not None:
+        report.add_matrix('dependence', group_col, group, matrix, 'mixed corrected_p_value')
+        return
+
+    width, height = max(6, 0.3 * len(cont_vars)), max(4, 0.3 * len(cat_vars))
+    fig, ax = plt.subplots(figsize=(width * 1.25, height))
+    sns.heatmap(matrix, annot=max(matrix.shape) <= max_annotated, ax=ax, xticklabels=True, yticklabels=True)
+    ax.set(xlabel=None)
+    ax.set(ylabel=None)
+    plt.title('corrected_p_value (categorical x continuous)')
+
+    output = os.path.join(output_dir, 'dep_{}_mixed_corrected_p_value_heatmap.png'.format(group))
+
+    print("saving to: " + output)
+    with rec.open_output(output, 'wb', writer=writer) as out_file:
+        plt.savefig(out_file, format='png', bbox_inches='tight')
+    plt.close(fig)
 
 
-def save_df(group_col, df, output_dir):
+def save_significant_pairs(cat_vars, df, output_dir, group, alpha=0.01, writer=None):
+    """
+    save only the significantly dependent pairs of variables, as an edge list
+
+    :param cat_vars: categorical variables
+    :param df: data frame with the results of the pairs of one group
+    :param output_dir: directory to save data to
+    :param group: group within the group_col that corresponds to the data
+    :param alpha: pairs with a corrected p-value below alpha are saved
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
+    :return: path to the file
+    """
+
+    pvals = pair_matrix(cat_vars, df, 'corrected_p_value').values
+    rows, cols = np.nonzero(np.triu(pvals < alpha, 1))
+    order = np.argsort(pvals[rows, cols], kind='mergesort')
+    rows, cols = rows[order], cols[order]
+
+    edges_df = pd.DataFrame({'source': np.array(cat_vars, dtype=object)[rows],
+                             'target': np.array(cat_vars, dtype=object)[cols],
+                             'corrected_p_value': pvals[rows, cols]})
+
+    output = os.path.join(output_dir, 'dep_{}_significant_pairs.tsv'.format(group))
+
+    print("saving to: " + output)
+    with rec.open_output(output, writer=writer) as out_file:
+        edges_df.to_csv(out_file, sep='\t', index=False)
+
+    return output
+
+
+def save_df(group_col, df, output_dir, test='chi_squared_independence', writer=None):
     """
     function to save the full dataframe for each group 
 
     :param group_col: column the data is grouped by
     :param df:  data frame with data on the variables to be saved
     :param output_dir: directory to save data to 
+    :param test: name of the test for the file name
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     # sort by corrected p-value
@@ -152,15 +599,17 @@ def save_df(group_col, df, output_dir):
 
     df = df.drop(df.columns[[0, 1]], axis=1)
 
-    output = os.path.join(output_dir, 'dep_{}_chi_squared_independence_test.tsv'.format(group_col))
+    output = os.path.join(output_dir, 'dep_{}_{}_test.tsv'.format(group_col, test))
 
     print("saving to: " + output)
-    df.to_csv(output, sep='\t', index=False)
+    with rec.open_output(output, writer=writer) as out_file:
+        df.to_csv(out_file, sep='\t', index=False)
 
     return output
 
 
-def run(group_col, cat_vars, data_df, output_dir):
+def run(group_col, cat_vars, data_df, output_dir, cont_vars=None, correction='fdr_bh', mc_replicates=10000, n_jobs=1,
+        max_table_cells=10 ** 6, decisions=None, report=None, writer=None):
     """
     function to run everything
 
@@ -168,6 +617,15 @@ def run(group_col, cat_vars, data_df, output_dir):
     :param cat_vars: categorical variables to analyze
     :param data_df: dataframe of results to analyze
     :param output_dir: directory to save results to 
+    :param cont_vars: continuous variables to test against the categorical variables (None to skip)
+    :param correction: multiple testing correction, one of multiple_testing.METHODS
+    :param mc_replicates: number of random tables for the monte carlo exact tests, 0 to always use the chi^2
+    approximation
+    :param n_jobs: number of processes to spread the monte carlo tests over
+    :param max_table_cells: contingency tables with more cells than this are counted sparsely, without monte carlo test
+    :param decisions: list the sparse tables are added to, for the record (None to only print them)
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
     # safe copy
     cat_vars_copy = cat_vars.copy()
@@ -186,14 +644,24 @@ def run(group_col, cat_vars, data_df, output_dir):
 
     if group_col not in cat_vars_all:
         cat_vars_all.append(group_col)
-    df = chi2_test(cat_vars_all, data_df_copy, 'all')
+
+    # the results of all groups are written into one preallocated table
+    num_all, num_group = len(cat_vars_all), len(cat_vars_copy)
+    results = _empty_chi2_results(num_all * (num_all - 1) // 2 + len(groups) * num_group * (num_group - 1) // 2)
+    # the tables of all groups together are not written, so they are not given monte carlo exact tests
+    row = _fill_chi2_tests(results, 0, cat_vars_all, data_df_copy, 'all', max_table_cells=max_table_cells,
+                           decisions=decisions)
+    sparse_tables = dict()
 
     for group in groups:
         subset_df = data_df_copy[(data_df_copy[group_col] == group)]
 
-        df = df.append(chi2_test(cat_vars_copy, subset_df, group), ignore_index=True)
+        row = _fill_chi2_tests(results, row, cat_vars_copy, subset_df, group, sparse_tables, max_table_cells, decisions)
 
-    df = multiple_testing_correction(df)
+    # the tables of all groups are tested together, so they can be spread over the processes
+    monte_carlo_tests(results, sparse_tables, mc_replicates, n_jobs)
+
+    df = multiple_testing_correction(pd.DataFrame(results), correction)
 
     files = []
 
@@ -205,8 +673,24 @@ def run(group_col, cat_vars, data_df, output_dir):
     for i, group in enumerate(groups):
         subset_df = df[(df['group'] == group)]
 
-        plot_heatmap(cat_vars_copy, subset_df, output_dir, group)
-        files.append(save_df(group, subset_df, output_dir))
+        plot_heatmap(cat_vars_copy, subset_df, output_dir, group, group_col, report=report, writer=writer)
+        files.append(save_df(group, subset_df, output_dir, writer=writer))
+        files.append(save_significant_pairs(cat_vars_copy, subset_df, output_dir, group, writer=writer))
         # check_df(group, subset_df, output_dir)
 
+    # categorical x continuous pairs, corrected as their own family of tests
+    if cont_vars and cat_vars_copy:
+        mixed_df = pd.concat([kruskal_test(cat_vars_copy, cont_vars,
+                                           data_df[(data_df_copy[group_col] == group).values], group)
+                              for group in groups], ignore_index=True)
+        mixed_df = multiple_testing_correction(mixed_df, correction)
+
+        for group in groups:
+            subset_df = mixed_df[(mixed_df['group'] == group)]
+            if len(subset_df) == 0:
+                continue
+
+            plot_mixed_heatmap(subset_df, output_dir, group, group_col, report=report, writer=writer)
+            files.append(save_df(group, subset_df, output_dir, 'kruskal_mixed', writer=writer))
+
     return files
@@ -10,6 +10,8 @@ has dominate variation
 import os
 import sys
 import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import matplotlib
 import platform
@@ -20,12 +22,99 @@ else:
     matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import seaborn as sns
-from scipy.stats import kruskal
+from scipy import stats
 import diagnose.data_tracking as dattrk
-import statsmodels.stats.multitest as stat
+import diagnose.make_record as rec
+import diagnose.plotting as plotting
+import diagnose.multiple_testing as mt
+import diagnose.cardinality as cardinality
+import diagnose.rank_tests as rt
+import diagnose.bootstrap as bootstrap
 
 
-def analyze_by_var(group_col, score_col, cat_vars, data_df):
+def permutation_pvals(results_df, permutation_tests, max_permutations=10000, n_jobs=1):
+    """
+    replace the chi-squared p-values of the Kruskal-Wallis tests with permutation p-values, the tests of all groups and
+    variables are spread over the processes
+
+    :param results_df: dataframe with the results of analyze_by_var
+    :param permutation_tests: list of (row of results_df, scores, level codes) of the tests
+    :param max_permutations: maximum number of permutations per test
+    :param n_jobs: number of processes to spread the tests over
+    """
+
+    results_df['var_kw_pval_method'] = 'chi_squared'
+    results_df['var_kw_num_permutations'] = 0
+    if len(permutation_tests) == 0:
+        return
+
+    rows, values, codes = zip(*permutation_tests)
+    # one seed per test, so the p-values don't depend on the number of processes
+    seeds = np.random.SeedSequence(0).spawn(len(rows))
+    # permutations stop once a p-value is clearly above 0.05, or clearly below the bonferroni threshold, so the
+    # p-values that are significant after the correction are not limited by the number of permutations
+    num_tests = len(rows)
+    args = (values, codes, [max_permutations] * num_tests, [0.05] * num_tests, [0.05 / len(results_df)] * num_tests,
+            [0.999] * num_tests, seeds)
+
+    if n_jobs is not None and n_jobs > 1 and num_tests > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(rt.permutation_kruskal_pval, *args))
+    else:
+        results = list(map(rt.permutation_kruskal_pval, *args))
+
+    rows = list(rows)
+    results_df.loc[rows, 'var_kw_pval'] = [x[0] for x in results]
+    results_df.loc[rows, 'var_kw_num_permutations'] = [x[1] for x in results]
+    results_df.loc[rows, 'var_kw_pval_method'] = 'permutation'
+
+
+def rank_groups(data_df, group_col, score_col):
+    """
+    rank the scores of each group once, for the Kruskal-Wallis tests and the Dunn's tests of all its variables
+
+    :param data_df: dataframe
+    :param group_col: which column to group the data by
+    :param score_col: the score column
+    :return: dictionary of group: (ranks of the scores of the group, tie correction)
+    """
+
+    group_ranks = dict()
+    for group in data_df[group_col].unique():
+        subset_df = data_df[(data_df[group_col] == group)]
+        ranks = rt.rank_rows(subset_df[score_col].values.astype(float))
+        group_ranks[group] = ranks, rt.tie_correction(ranks)[0]
+
+    return group_ranks
+
+
+def _value_ranks(subset_df, var, score_col, ranks, ties, sort=False):
+    """
+    codes of the values of a variable in a group, with the scores, ranks and tie correction of the samples that have a
+    value: the ranks of the whole group, unless samples without a value are left out and the rest ranked again
+
+    :param subset_df: dataframe of the group
+    :param var: categorical variable
+    :param score_col: the score column
+    :param ranks: ranks of the scores of the group, from rank_groups
+    :param ties: tie correction of the ranks
+    :param sort: codes in the order of the sorted values instead of the order they appear in
+    :return: (codes, values, scores, ranks, tie correction) of the samples with a value
+    """
+
+    codes, values = pd.factorize(subset_df[var], sort=sort)
+    scores = subset_df[score_col].values.astype(float)
+    if (codes < 0).any():
+        scores = scores[codes >= 0]
+        codes = codes[codes >= 0]
+        ranks = rt.rank_rows(scores)
+        ties = rt.tie_correction(ranks)[0]
+
+    return codes, values, scores, ranks, ties
+
+
+def analyze_by_var(group_col, score_col, cat_vars, data_df, correction='fdr_bh', kw_permutations=0, n_jobs=1,
+                   group_ranks=None):
     """
     run a kruskal-wallis h test between each of the categorical variables and the score columns
 
@@ -33,29 +122,50 @@ def analyze_by_var(group_col, score_col, cat_vars, data_df):
     :param score_col: the score column
     :param cat_vars: list of categorical variables
     :param data_df: dataframe
+    :param correction: multiple testing correction, one of multiple_testing.METHODS
+    :param kw_permutations: maximum number of permutations for permutation p-values instead of the chi-squared
+    approximation, which is poor for the few samples per value of small groups (0 for the chi-squared approximation)
+    :param n_jobs: number of processes to spread the permutation tests over
+    :param group_ranks: ranks of the scores of each group from rank_groups (None to rank them here)
     :return:
         results_df: dataframe with the kruskal-wallis h-stat and kruskal-wallis p-value for each group/variable
-        combination
+        combination (and how the p-value was computed, if permutation p-values are used)
     """
 
     # need to evaluate results on a per gate basis
     # though these should be technically further subset by strain;
     # e.g. which 4 strains do we consider to be one "circuit"
     results_list = list()
+    permutation_tests = list()
+    group_ranks = rank_groups(data_df, group_col, score_col) if group_ranks is None else group_ranks
     groups = data_df[group_col].unique()
     for group in groups:
         subset_df = data_df[(data_df[group_col] == group)]
+        ranks, ties = group_ranks[group]
         for var in cat_vars:
-            vals = [group[score_col].values for name, group in subset_df.groupby(var)]
-            if len(vals) >= 2:
-                kw_hstat, kw_pval = kruskal(*vals)
+            # codes in the order of the values, as scipy.stats.kruskal of the groupby, samples without a value are
+            # left out
+            codes, _, scores, var_ranks, var_ties = _value_ranks(subset_df, var, score_col, ranks, ties, sort=True)
+
+            counts = np.bincount(codes)
+            if len(counts) >= 2:
+                # h-stat from the rank sums of the values, as scipy.stats.kruskal
+                n = len(var_ranks)
+                rank_sums = np.bincount(codes, weights=var_ranks)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    kw_hstat = (12 / (n * (n + 1)) * (rank_sums ** 2 / counts).sum() - 3 * (n + 1)) / var_ties
+                kw_pval = rt.kruskal_pval(kw_hstat, len(counts))
                 record = {'group': group, 'variable': var, 'var_kw_hstat': kw_hstat, 'var_kw_pval': kw_pval}
                 results_list.append(record)
+                if kw_permutations > 0 and np.isfinite(kw_pval):
+                    permutation_tests.append((len(results_list) - 1, scores, codes))
 
     results_df = pd.DataFrame(results_list)
+    if kw_permutations > 0:
+        permutation_pvals(results_df, permutation_tests, kw_permutations, n_jobs)
 
     # do a multiple tests correction to adjust for the number of hypothesis tests we've done
-    fdr = stat.multipletests(results_df.var_kw_pval, method='fdr_bh')
+    fdr = mt.correct(results_df.var_kw_pval.values, groups=results_df.group.values, method=correction)
     results_df['var_kw_pval_corrected'] = fdr[1]
 
     results_df.sort_values(by=['group', 'var_kw_pval_corrected'], ascending=[True, True], inplace=True)
@@ -63,7 +173,95 @@ def analyze_by_var(group_col, score_col, cat_vars, data_df):
     return results_df
 
 
-def summarize_results(data_df, results_df, group_col, score_col, cat_vars):
+def dunn_tests(results_df, group_col, score_col, data_df, alpha=0.05, group_ranks=None):
+    """
+    Dunn's post-hoc test between every pair of values of the variables with a significant Kruskal-Wallis test, to show
+    which values differ. the scores of each group are ranked once and the tie correction computed once (the same as
+    for the Kruskal-Wallis tests, if group_ranks is given), the mean ranks of the values of all its significant
+    variables come from the same ranks (ranked again without the samples that have no value for a variable), and all
+    pairs of values of a variable are tested at once. p-values are corrected with Holm's method within each variable
+
+    :param results_df: dataframe with results from kw test in the analyze_by_var() function
+    :param group_col: column by which to the data is grouped by
+    :param score_col: the score column
+    :param data_df: dataframe
+    :param alpha: variables with a corrected Kruskal-Wallis p-value below alpha are tested
+    :param group_ranks: ranks of the scores of each group from rank_groups (None to rank them here)
+    :return: dataframe with one row per pair of values of each variable of each group
+    """
+
+    columns = ['group', 'variable', 'value_1', 'value_2', 'count_1', 'count_2', 'mean_rank_1', 'mean_rank_2', 'z',
+               'pval', 'pval_corrected']
+    significant_df = results_df[results_df['var_kw_pval_corrected'] < alpha]
+    if group_ranks is None:
+        group_ranks = rank_groups(data_df[data_df[group_col].isin(significant_df['group'])], group_col, score_col)
+
+    results_list = list()
+    for group, group_results_df in significant_df.groupby('group', sort=False):
+        subset_df = data_df[(data_df[group_col] == group)]
+        ranks, ties = group_ranks[group]
+
+        for var in group_results_df['variable']:
+            # samples without a value are left out, as in the Kruskal-Wallis test
+            codes, values, _, var_ranks, var_ties = _value_ranks(subset_df, var, score_col, ranks, ties)
+            n = len(var_ranks)
+            # variance of the mean rank of one sample, with the tie correction
+            variance = n * (n + 1) / 12 * var_ties
+            counts = np.bincount(codes)
+            mean_ranks = np.bincount(codes, weights=var_ranks) / counts
+
+            first, second = np.triu_indices(len(values), 1)
+            z = (mean_ranks[first] - mean_ranks[second]) / np.sqrt(variance * (1 / counts[first] + 1 / counts[second]))
+            pvals = 2 * stats.norm.sf(np.abs(z))
+
+            results_list.append(pd.DataFrame({'group': group, 'variable': var,
+                                              'value_1': values[first], 'value_2': values[second],
+                                              'count_1': counts[first], 'count_2': counts[second],
+                                              'mean_rank_1': mean_ranks[first], 'mean_rank_2': mean_ranks[second],
+                                              'z': z, 'pval': pvals, 'pval_corrected': mt.adjust(pvals, 'holm')}))
+
+    if len(results_list) == 0:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(results_list, ignore_index=True)[columns]
+
+
+def median_cis(data_df, group_col, score_col, cat_vars, confidence=0.95, replicates=1000, n_jobs=1):
+    """
+    bootstrap confidence intervals for the median score of every value of every variable in every group, and for the
+    difference from the median score of the group, all computed at once (see bootstrap.median_cis)
+
+    :param data_df: full dataframe
+    :param group_col: column by which to group data_df by
+    :param score_col: score column
+    :param cat_vars: list of categorical variables
+    :param confidence: confidence level of the intervals
+    :param replicates: number of bootstrap replicates
+    :param n_jobs: number of processes to spread the replicates over
+    :return: dataframe with group, variable, value and the confidence intervals
+    """
+
+    long_df = pd.concat([pd.DataFrame({'group': data_df[group_col].values, 'variable': var,
+                                       'value': data_df[var].values, 'val': data_df[score_col].values.astype(float)})
+                         for var in cat_vars], ignore_index=True)
+    long_df = long_df[~np.isnan(long_df['val'].values) & ~long_df['value'].isna().values]
+
+    cell_codes = long_df.groupby(['group', 'variable', 'value'], sort=False).ngroup().values
+    segment_codes = long_df.groupby(['group', 'variable'], sort=False).ngroup().values
+
+    cis = bootstrap.median_cis(long_df['val'].values, cell_codes, segment_codes, replicates, confidence,
+                               n_jobs=n_jobs)
+
+    # one row per cell, in the order of the cell codes
+    cis_df = long_df[['group', 'variable', 'value']].iloc[np.unique(cell_codes, return_index=True)[1]]
+    cis_df = cis_df.reset_index(drop=True)
+    for name in ['median_ci_low', 'median_ci_high', 'median_diff', 'median_diff_ci_low', 'median_diff_ci_high']:
+        cis_df['val_' + name] = cis[name]
+
+    return cis_df
+
+
+def summarize_results(data_df, results_df, group_col, score_col, cat_vars, bootstrap_replicates=0, n_jobs=1):
     """
     Function to group and compute statistics on the samples per value of the variable for each group and then merge
     with the results of the analyze_by_var() function
@@ -73,9 +271,13 @@ def summarize_results(data_df, results_df, group_col, score_col, cat_vars):
     :param group_col: column by which to group data_df by
     :param score_col: score column
     :param cat_vars: list of categorical variables
+    :param bootstrap_replicates: number of bootstrap replicates for confidence intervals of the median of each value
+    (and its difference from the median of the group), 0 for no confidence intervals
+    :param n_jobs: number of processes to spread the bootstrap replicates over
     :return:
         summarize_df: dataframe with summary values on each group/variables combination as well as the kw test values
-        subset_summarize_df: subset of summarize_df values such that the p-values < 0.05 and median value < 0.5
+        subset_summarize_df: subset of summarize_df values such that the p-values < 0.05 and median value < 0.5 (the
+        upper end of the confidence interval of the median, if there are confidence intervals)
     """
 
     # reform and summarize by variable
@@ -102,16 +304,21 @@ def summarize_results(data_df, results_df, group_col, score_col, cat_vars):
         results_list.append(merged_df)
 
     summarize_df = pd.concat(results_list)
+    if bootstrap_replicates > 0:
+        cis_df = median_cis(data_df, group_col, score_col, cat_vars, replicates=bootstrap_replicates, n_jobs=n_jobs)
+        summarize_df = pd.merge(summarize_df, cis_df, how='left', on=['group', 'variable', 'value'])
     summarize_df.sort_values(by=['group', 'var_kw_pval_corrected', 'variable', 'val_median'],
                              ascending=[True, True, True, True], inplace=True)
 
+    # with confidence intervals, only values whose median is clearly below 0.5 are flagged, not small noisy ones
+    median_col = 'val_median_ci_high' if 'val_median_ci_high' in summarize_df.columns else 'val_median'
     subset_summarize_df = summarize_df[
-        (summarize_df['var_kw_pval_corrected'] < 0.05) & (summarize_df['val_median'] < 0.5)]
+        (summarize_df['var_kw_pval_corrected'] < 0.05) & (summarize_df[median_col] < 0.5)]
 
     return summarize_df, subset_summarize_df
 
 
-def plot_result_heatmap_stat(results_df, group_col, output_dir):
+def plot_result_heatmap_stat(results_df, group_col, output_dir, writer=None):
     """
     ToDo: Deprecated? This is commented out in run()
     Plot a heatmap of the kruskal-wallace h-stats for the groups in the group_col
@@ -119,6 +326,7 @@ def plot_result_heatmap_stat(results_df, group_col, output_dir):
     :param results_df: dataframe with results from kw test in the analyze_by_var() function
     :param group_col: column by which to the data is grouped by
     :param output_dir: output directory
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     if len(results_df['group'].unique()) >= 2:
@@ -140,22 +348,30 @@ def plot_result_heatmap_stat(results_df, group_col, output_dir):
         # sns_plot.ax_col_dendrogram.set_visible(False)
         out_path = os.path.join(output_dir, "avca__" + group_col + "__heatmap_stat.png")
         print("saving to: " + out_path)
-        plt.savefig(out_path)
+        with rec.open_output(out_path, 'wb', writer=writer) as out_file:
+            plt.savefig(out_file, format='png')
         plt.close()
 
 
-def plot_result_heatmap_pval(results_df, group_col, output_dir):
+def plot_result_heatmap_pval(results_df, group_col, output_dir, report=None, writer=None):
     """
     Plot a heatmap of the kruskal-wallace p-values for the groups in the group_col
 
     :param results_df: dataframe with results from kw test in the analyze_by_var() function
     :param group_col: column by which to the data is grouped by
     :param output_dir: output directory
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     if len(results_df['group'].unique()) >= 2:
         results_wide = results_df.pivot("group", "variable", "var_kw_pval_corrected")
 
+        if report is not None:
+            report.add_matrix('avcat', group_col, None, results_wide,
+                              'Corrected Kruskal-Wallis p-val (lower value -> investigate)')
+            return
+
         cmap = "YlGnBu"
         width = 1.5 + (0.9 * len(results_wide.columns.values))
         height = 1.5 + (0.9 * len(results_wide.index.values))
@@ -174,11 +390,13 @@ def plot_result_heatmap_pval(results_df, group_col, output_dir):
         # sns_plot.ax_col_dendrogram.set_visible(False)
         out_path = os.path.join(output_dir, "avca__" + group_col + "__heatmap_corrected_pval.png")
         print("saving to: " + out_path)
-        plt.savefig(out_path)
+        with rec.open_output(out_path, 'wb', writer=writer) as out_file:
+            plt.savefig(out_file, format='png')
         plt.close()
 
 
-def plot_result_distibution(results_df, group_col, score_col, data_df, output_dir):
+def plot_result_distibution(results_df, group_col, score_col, data_df, output_dir, max_plot_levels=50, decisions=None,
+                            report=None, budget=None, writer=None):
     """
     Boxplot of Performance Distributions for Groups in group_col with corrected KW p-values
 
@@ -187,73 +405,92 @@ def plot_result_distibution(results_df, group_col, score_col, data_df, output_di
     :param score_col: the score column
     :param data_df: full dataframe
     :param output_dir: output directory
+    :param max_plot_levels: variables with more levels than this are not plotted (None for no limit)
+    :param decisions: list the variables that are not plotted are added to, for the record (None to only print them)
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param budget: plotting.PlotBudget the plots are counted against (None for no limits)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     pal = sns.color_palette("hls", 8)
 
-    groups = results_df['group'].unique()
-    for group in groups:
-        subset_df = data_df[(data_df[group_col] == group)]
-        vars_sorted = results_df[results_df["group"] == group]['variable']
-
-        heights_list = [1]  # first plot will be whole distribution
-        for col in vars_sorted:
-            heights_list.append(len(subset_df[col].unique()))
-
-        fig_height = 2 + sum(heights_list) * 0.2 + len(vars_sorted) * 0.5
-
-        fig, axes = plt.subplots(len(vars_sorted) + 1,
-                                 figsize=(7, fig_height),
-                                 gridspec_kw={'height_ratios': heights_list},
-                                 sharex=True)
-
-        # show whole distribution
-        sns.boxplot(x=score_col,
-                    data=subset_df,
-                    orient="h",
-                    ax=axes[0],
-                    palette=pal)
-        axes[0].set(ylabel='ALL')
-
-        for i, var in enumerate(vars_sorted):
-            order = subset_df.groupby(by=[var])[score_col].median().sort_values(ascending=True).iloc[::-1].index
-            sns.boxplot(x=score_col, y=var,
-                        data=subset_df,
-                        orient="h",
-                        order=order,
-                        ax=axes[i + 1],
-                        palette=pal)
-            pval = results_df[(results_df['group'] == group) & (results_df['variable'] == var)].iloc[0][
-                'var_kw_pval_corrected']
-            axes[i + 1].annotate("p-value: {0:.5e}".format(pval), xy=(0, 1), xycoords="axes fraction",
-                                 xytext=(5, 10), textcoords="offset points",
-                                 ha="left", va="top")
-            axes[i + 1].set_ylabel(var, loc='top', rotation='horizontal', fontweight='bold')
-
-        fig.suptitle('Performance Distributions for\n {0:s} = {1:s} \nwith corrected KW p-values'.format(group_col,
-                                                                                                         group),
-                     fontsize=16)
-
-        # fix xaxis
-        for a in fig.axes: # [fig.axes[0], fig.axes[-1]]:
-            a.tick_params(
-                axis='x',  # changes apply to the x-axis
-                which='both',  # both major and minor ticks are affected
-                bottom=True,
-                top=False,
-                labelbottom=True)
-            # a.xaxis.label.set_visible(False)
-
-        out_path = os.path.join(output_dir, "avca__" + group_col + "_" + group + "__dist.png")
-        print("saving to: " + out_path)
-        fig.tight_layout(rect=[0, 0, 1, .97])
-        fig.savefig(out_path)
-        plt.close()
-
-
-# ToDo: Do we need all three of these functions? Couldn't we just have title and comment as arguments? Since that's the
-#  only difference?
-def save_df_stats_var(results_df, group_col, doc_info, output_dir):
+    # the most significant groups and variables are plotted first, the rest only while there is budget left
+    budget = plotting.PlotBudget() if budget is None else budget
+    groups = budget.order_groups(results_df, 'var_kw_pval_corrected')
+    with plotting.FigureCache() as figures:
+        for group in groups:
+            subset_df = data_df[(data_df[group_col] == group)]
+            # variables with too many levels for a boxplot each are left out
+            vars_sorted = budget.select('avcat', group_col, group,
+                                        cardinality.plottable('avcat', group, results_df[results_df["group"] == group][
+                                            'variable'], subset_df, max_plot_levels, decisions))
+            if report is None and not budget.allow('avcat', group_col, group, vars_sorted):
+                continue
+
+            # box statistics for every variable at once, boxes are ordered by median
+            box_stats = plotting.compute_box_stats(subset_df, score_col, list(vars_sorted))
+
+            # the report draws the boxplots from the statistics, no figure needed
+            if report is not None:
+                report.add_box_stats('avcat', group_col, group, 'ALL', box_stats[None], score_col)
+                for var in vars_sorted:
+                    pval = results_df[(results_df['group'] == group) & (results_df['variable'] == var)].iloc[0][
+                        'var_kw_pval_corrected']
+                    report.add_box_stats('avcat', group_col, group, var, box_stats[var], score_col,
+                                         "p-value: {0:.5e}".format(pval))
+                continue
+
+            with budget.timed():
+                heights_list = [1]  # first plot will be whole distribution
+                for var in vars_sorted:
+                    heights_list.append(len(box_stats[var]))
+
+                fig_height = 2 + sum(heights_list) * 0.2 + len(vars_sorted) * 0.5
+
+                # groups with the same box counts and label lengths get the same layout, so the figure is reused
+                label_length = max([len(str(var)) for var in vars_sorted] +
+                                   [len(str(x['label'])) for var in vars_sorted for x in box_stats[var]] + [0])
+                layout_key = (tuple(heights_list), label_length)
+                fig, axes, reused = figures.get(layout_key, nrows=len(vars_sorted) + 1,
+                                                figsize=(7, fig_height),
+                                                gridspec_kw={'height_ratios': heights_list},
+                                                sharex=True)
+
+                # show whole distribution
+                plotting.draw_box_stats(axes[0], box_stats[None], pal)
+                axes[0].set(xlabel=score_col, ylabel='ALL')
+
+                for i, var in enumerate(vars_sorted):
+                    plotting.draw_box_stats(axes[i + 1], box_stats[var], pal)
+                    axes[i + 1].set(xlabel=score_col)
+                    pval = results_df[(results_df['group'] == group) & (results_df['variable'] == var)].iloc[0][
+                        'var_kw_pval_corrected']
+                    axes[i + 1].annotate("p-value: {0:.5e}".format(pval), xy=(0, 1), xycoords="axes fraction",
+                                         xytext=(5, 10), textcoords="offset points",
+                                         ha="left", va="top")
+                    axes[i + 1].set_ylabel(var, loc='top', rotation='horizontal', fontweight='bold')
+
+                fig.suptitle('Performance Distributions for\n {0:s} = {1:s} \nwith corrected KW p-values'.format(
+                    group_col, group), fontsize=16)
+
+                # fix xaxis
+                for a in fig.axes: # [fig.axes[0], fig.axes[-1]]:
+                    a.tick_params(
+                        axis='x',  # changes apply to the x-axis
+                        which='both',  # both major and minor ticks are affected
+                        bottom=True,
+                        top=False,
+                        labelbottom=True)
+                    # a.xaxis.label.set_visible(False)
+
+                out_path = os.path.join(output_dir, "avca__" + group_col + "_" + group + "__dist.png")
+                print("saving to: " + out_path)
+                figures.tight_layout(layout_key, rect=[0, 0, 1, .97])
+                with rec.open_output(out_path, 'wb', writer=writer) as out_file:
+                    fig.savefig(out_file, format='png')
+
+
+def save_df_stats_var(results_df, group_col, doc_info, output_dir, writer=None):
     """
     Saving results_df to file
 
@@ -262,12 +499,13 @@ def save_df_stats_var(results_df, group_col, doc_info, output_dir):
     :param doc_info: Information about what was run to get these results (e.g. what script was run, what command was
     run)
     :param output_dir: output directory
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     :return: out_path: where the file was saved to
     """
 
     out_path = os.path.join(output_dir, "avca__" + group_col + "__stats_var.tsv")
     print("saving to: " + out_path)
-    with open(out_path, 'w') as out_file:
+    with rec.open_output(out_path, writer=writer) as out_file:
         out_file.write(doc_info)
         out_file.write("# analysis of variance performed for each group\n")
         out_file.write("# Kruskal-Wallace p-val with correction (lower value -> investigate)\n")
@@ -276,7 +514,32 @@ def save_df_stats_var(results_df, group_col, doc_info, output_dir):
     return out_path
 
 
-def save_df_stats_val(results_df, group_col, doc_info, output_dir):
+def save_df_posthoc(posthoc_df, group_col, doc_info, output_dir, writer=None):
+    """
+    Saving the results of the post-hoc tests to file
+
+    :param posthoc_df: dataframe with results from dunn_tests()
+    :param group_col: column by which to the data is grouped by
+    :param doc_info: Information about what was run to get these results (e.g. what script was run, what command was
+    run)
+    :param output_dir: output directory
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
+    :return: out_path: where the file was saved to
+    """
+
+    out_path = os.path.join(output_dir, "avca__" + group_col + "__posthoc_dunn.tsv")
+    print("saving to: " + out_path)
+    with rec.open_output(out_path, writer=writer) as out_file:
+        out_file.write(doc_info)
+        out_file.write("# Dunn's post-hoc test between the values of the variables with a significant Kruskal-Wallace "
+                       "test\n")
+        out_file.write("# p-val with Holm correction within each variable (lower value -> values differ)\n")
+        out_file.write("# \n")
+        posthoc_df.to_csv(out_file, sep='\t', header=True, index=False)
+    return out_path
+
+
+def save_df_stats_val(results_df, group_col, doc_info, output_dir, writer=None):
     """
     Saving results_df to file
 
@@ -285,12 +548,13 @@ def save_df_stats_val(results_df, group_col, doc_info, output_dir):
     :param doc_info: Information about what was run to get these results (e.g. what script was run, what command was
     run)
     :param output_dir: output directory
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     :return: out_path: where the file was saved to
     """
 
     out_path = os.path.join(output_dir, "avca__" + group_col + "__stats_val.tsv")
     print("saving to: " + out_path)
-    with open(out_path, 'w') as out_file:
+    with rec.open_output(out_path, writer=writer) as out_file:
         out_file.write(doc_info)
         out_file.write("# stats on values of each variable, and analysis of variance for each group \n")
         out_file.write("# Kruskal-Wallace p-val with correction (lower value -> investigate)\n")
@@ -299,7 +563,8 @@ def save_df_stats_val(results_df, group_col, doc_info, output_dir):
     return out_path
 
 
-def run(group_col, cat_vars, data_df, score_col, output_dir):
+def run(group_col, cat_vars, data_df, score_col, output_dir, correction='fdr_bh', kw_permutations=0,
+        bootstrap_replicates=0, n_jobs=1, max_plot_levels=50, decisions=None, report=None, budget=None, writer=None):
     """
     Function to analyze categorical variables
 
@@ -308,6 +573,17 @@ def run(group_col, cat_vars, data_df, score_col, output_dir):
     :param data_df: dataframe
     :param score_col: the score column
     :param output_dir: output directory
+    :param correction: multiple testing correction, one of multiple_testing.METHODS
+    :param kw_permutations: maximum number of permutations for permutation p-values of the Kruskal-Wallis tests (0 for
+    the chi-squared approximation)
+    :param bootstrap_replicates: number of bootstrap replicates for confidence intervals of the median of each value in
+    stats_val, 0 for no confidence intervals
+    :param n_jobs: number of processes to spread the permutation tests and bootstrap replicates over
+    :param max_plot_levels: variables with more levels than this are not plotted (None for no limit)
+    :param decisions: list the variables that are not plotted are added to, for the record (None to only print them)
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param budget: plotting.PlotBudget the plots are counted against (None for no limits)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     :return: files: list of files output by the script
     """
 
@@ -326,20 +602,30 @@ def run(group_col, cat_vars, data_df, score_col, output_dir):
 
     files = []
     # run analysis
-    results_df = analyze_by_var(group_col, score_col, cat_vars_copy, data_df_copy)
-    files.append(save_df_stats_var(results_df, group_col, doc_info, output_dir))
+    # the scores of each group are ranked once for the Kruskal-Wallis and the Dunn's tests
+    group_ranks = rank_groups(data_df_copy, group_col, score_col)
+    results_df = analyze_by_var(group_col, score_col, cat_vars_copy, data_df_copy, correction, kw_permutations, n_jobs,
+                                group_ranks)
+    files.append(save_df_stats_var(results_df, group_col, doc_info, output_dir, writer=writer))
+
+    # which values of the significant variables differ
+    posthoc_df = dunn_tests(results_df, group_col, score_col, data_df_copy, group_ranks=group_ranks)
+    files.append(save_df_posthoc(posthoc_df, group_col, doc_info, output_dir, writer=writer))
 
     # summarize the results
-    summary_df, subset_summarize_df = summarize_results(data_df_copy, results_df, group_col, score_col, cat_vars_copy)
-    files.append(save_df_stats_val(summary_df, group_col, doc_info, output_dir))
+    summary_df, subset_summarize_df = summarize_results(data_df_copy, results_df, group_col, score_col, cat_vars_copy,
+                                                        bootstrap_replicates, n_jobs)
+    files.append(save_df_stats_val(summary_df, group_col, doc_info, output_dir, writer=writer))
     # save_df_stats_val_worry(subset_summarize_df, group_col, doc_info, output_dir)
     # ToDo: Is this supposed to be commented out?
 
     # remove NAs and plot
     results_df.dropna(inplace=True)
     # plot_result_heatmap_stat(results_df, group_col, output_dir) todo: deprecated?
-    plot_result_heatmap_pval(results_df, group_col, output_dir)
-    plot_result_distibution(results_df, group_col, score_col, data_df_copy, output_dir)
+    plot_result_heatmap_pval(results_df, group_col, output_dir, report=report, writer=writer)
+    plot_result_distibution(results_df, group_col, score_col, data_df_copy, output_dir,
+                            max_plot_levels=max_plot_levels, decisions=decisions, report=report, budget=budget,
+                            writer=writer)
 
     return files
 
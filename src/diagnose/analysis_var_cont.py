@@ -11,6 +11,7 @@ has dominant variation
 import os
 import sys
 import json
+import numpy as np
 import pandas as pd
 import matplotlib
 import platform
@@ -19,13 +20,68 @@ if platform.system() == "Darwin":
     matplotlib.use("TkAgg")
 else:
     matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import seaborn as sns
-import diagnose.dal.cp_ys as dat
 import diagnose.data_tracking as dattrk
+import diagnose.make_record as rec
+import diagnose.plotting as plotting
+import diagnose.multiple_testing as mt
+import diagnose.rank_tests as rt
 
 
-def analyze_by_var(group_col, score_col, cont_vars, data_df):
+def permutation_pvals(subset_df, score_col, variables, num_permutations=10000):
+    """
+    permutation p-values of the spearman correlations of the score with the variables of a group. each correlation
+    leaves out the samples where the score or its variable is missing, as the correlation itself does, and the
+    correlations of each batch of permutations with all variables that are missing the same samples are computed at once
+
+    :param subset_df: dataframe of the group, with float columns
+    :param score_col: the score column
+    :param variables: list of continuous variables
+    :param num_permutations: number of permutations
+    :return: array of p-values
+    """
+
+    variables = list(variables)
+    pvals = np.full(len(variables), np.nan)
+    if len(variables) == 0:
+        return pvals
+
+    scores = subset_df[score_col].values
+    values = subset_df[variables].values
+    complete = ~np.isnan(values) & ~np.isnan(scores)[:, None]
+
+    # variables with the same complete samples share the permutations
+    patterns, pattern_codes = np.unique(complete, axis=1, return_inverse=True)
+    pattern_codes = pattern_codes.ravel()
+    for i in range(patterns.shape[1]):
+        rows, cols = patterns[:, i], np.flatnonzero(pattern_codes == i)
+        if rows.sum() >= 3:
+            pvals[cols] = rt.permutation_spearman_pvals(scores[rows], values[rows][:, cols], num_permutations)
+
+    return pvals
+
+
+def add_significance(df, correction='fdr_bh'):
+    """
+    add the p-value (t approximation, unless permutation p-values are already there), the confidence interval (fisher z)
+    and the p-value corrected for multiple testing to a table of spearman correlations, for all rows at once
+
+    :param df: dataframe with group, spearman and n columns
+    :param correction: multiple testing correction, one of multiple_testing.METHODS
+    """
+
+    pvals = rt.spearman_pvals(df['spearman'].values, df['n'].values)
+    if 'spearman_pval' in df.columns:
+        permuted = df['spearman_pval'].notna().values
+        df['spearman_pval_method'] = np.where(permuted, 'permutation', 't')
+        pvals = np.where(permuted, df['spearman_pval'].values, pvals)
+    df['spearman_pval'] = pvals
+    df['spearman_ci_low'], df['spearman_ci_high'] = rt.spearman_cis(df['spearman'].values, df['n'].values)
+    df['spearman_pval_corrected'] = mt.correct(pvals, groups=df['group'].values, method=correction)[1]
+
+
+def analyze_by_var(group_col, score_col, cont_vars, data_df, correction='fdr_bh', spearman_permutations=0,
+                   permutation_max_n=30):
     """
     Functoin to get spearman's correlation for both the score column vs. the continuous variables and between the
     covariates/predictors.
@@ -34,6 +90,10 @@ def analyze_by_var(group_col, score_col, cont_vars, data_df):
     :param score_col: the score column
     :param cont_vars: list of continous variables
     :param data_df: dataframe
+    :param correction: multiple testing correction, one of multiple_testing.METHODS
+    :param spearman_permutations: number of permutations for permutation p-values of the correlations with the score
+    in groups with few samples, where the t approximation is poor (0 for the t approximation in every group)
+    :param permutation_max_n: groups with at most this many samples get permutation p-values
     :return:
         results_df: List of dataframes containing the correlation values between each continuous variable and the score
         variable subset by group.
@@ -49,7 +109,7 @@ def analyze_by_var(group_col, score_col, cont_vars, data_df):
     groups = data_df[group_col].unique()
     for group in groups:
         cols_to_keep = [score_col] + cont_vars
-        subset_df = data_df[(data_df[group_col] == group)]
+        subset_df = data_df.loc[(data_df[group_col] == group), cols_to_keep].copy()
 
         cols_to_use = list()
         # try converting columns to floats
@@ -64,8 +124,11 @@ def analyze_by_var(group_col, score_col, cont_vars, data_df):
 
         subset_df = subset_df[cols_to_use]
 
-        # TODO: this is inefficient!
-        corr_mat = subset_df.corr(method='spearman')  # get correlation between all variables
+        # correlation between all variables, and the number of samples of each (pairs of values that are both
+        # present), from the same ranks the p-values and intervals are computed for
+        rho, n = rt.spearman_matrix(subset_df.values)
+        corr_mat = pd.DataFrame(rho, index=subset_df.columns, columns=subset_df.columns)
+        n_mat = pd.DataFrame(n, index=subset_df.columns, columns=subset_df.columns)
 
         # get the correlation between each continuous variable and the score variable
         # this should be a list
@@ -76,7 +139,11 @@ def analyze_by_var(group_col, score_col, cont_vars, data_df):
         corr_score.reset_index(level=0, inplace=True)
         corr_score.rename(columns={score_col: "spearman"}, inplace=True)
         corr_score['group'] = group
-        corr_score = corr_score[['group', 'variable', 'spearman']]
+        corr_score['n'] = n_mat[score_col].loc[corr_score['variable']].values
+        corr_score = corr_score[['group', 'variable', 'spearman', 'n']]
+        if spearman_permutations > 0 and len(subset_df) <= permutation_max_n:
+            corr_score['spearman_pval'] = permutation_pvals(subset_df, score_col, corr_score['variable'],
+                                                            spearman_permutations)
         results_list.append(corr_score)
 
         # get the correlation between the covariates/predictors
@@ -88,25 +155,31 @@ def analyze_by_var(group_col, score_col, cont_vars, data_df):
         corr_list_df.columns = ['name_1', 'name_2', 'spearman']
         corr_list_df['variables'] = list(zip(corr_list_df['name_1'], corr_list_df['name_2']))
         corr_list_df['group'] = group
-        corr_list_df = corr_list_df[['group', 'variables', 'spearman']]
+        corr_list_df['n'] = n_mat.values[n_mat.index.get_indexer(corr_list_df['name_1']),
+                                         n_mat.columns.get_indexer(corr_list_df['name_2'])]
+        corr_list_df = corr_list_df[['group', 'variables', 'spearman', 'n']]
         corr_list_df.sort_values(by=['spearman'], inplace=True)
         depend_list.append(corr_list_df)
 
     results_df = pd.concat(results_list)
     results_df['spearman_abs'] = results_df['spearman'].abs()
+    add_significance(results_df, correction)
     results_df.sort_values(by=['group', 'spearman_abs'], ascending=[True, False], inplace=True)
 
     depend_df = pd.concat(depend_list)
     depend_df['spearman_abs'] = depend_df['spearman'].abs()
+    add_significance(depend_df, correction)
     depend_df.sort_values(by=['group', 'spearman_abs'], ascending=[True, False], inplace=True)
 
     return results_df, depend_df
 
 
-def plot_result_score_corr(results_df, group_col, score_col, data_df, output_dir):
+def plot_result_score_corr(results_df, group_col, score_col, data_df, output_dir, max_points=10000, vars_per_page=None,
+                           report=None, budget=None, writer=None):
     """
     create a scatter plot of the score variable plotted against each of the continuous with spearman correlation
-    in the title. There should be one plot per group.
+    in the title. There should be one plot per group. Groups with more than max_points samples are drawn as binned 2-D
+    densities instead of a point per sample.
 
     :param results_df:  List of dataframes containing the correlation values between each continuous variable and the
     score variable subset by group.
@@ -114,62 +187,130 @@ def plot_result_score_corr(results_df, group_col, score_col, data_df, output_dir
     :param score_col: the score column
     :param data_df: dataframe
     :param output_dir: output directory
+    :param max_points: above this many samples in a group, plot densities instead of scatter plots
+    :param vars_per_page: maximum number of variables per figure, more variables are split into several files named
+    __scatter_p<page>.png (None for one figure per group)
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param budget: plotting.PlotBudget the plots are counted against (None for no limits)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     pal = sns.color_palette("hls", 8)
 
-    groups = results_df['group'].unique()
-    for group in groups:
-        subset_df = data_df[(data_df[group_col] == group)]
-        vars_sorted = results_df[results_df["group"] == group]['variable']
-
-        # convert to numeric
-        for var in vars_sorted:
-            subset_df[var] = subset_df[var].astype('float')
-
-        # TODO: put corr val in plot title
-
-        # TODO: trying to get plots to be square
-        fig_width = 5
-        fig_height = fig_width * len(vars_sorted) * 0.85
-
-        fig, axes = plt.subplots(nrows=len(vars_sorted), ncols=1,
-                                 figsize=(fig_width, fig_height),
-                                 sharex=True)
-
-        if len(vars_sorted) <= 1:
-            axes = [axes]
-
-        for i, var in enumerate(vars_sorted):
-            # ToDo: Is order deprecated/unused?
-            order = subset_df.groupby(by=[var])[score_col].median().sort_values(ascending=True).iloc[::-1].index
-            sns.scatterplot(x=score_col, y=var,
-                            data=subset_df,
-                            ax=axes[i],
-                            palette=pal
-                            )
-
-            # ToDo: why is this labeled pval? I thought this was a correlation value
-            pval = results_df[(results_df['group'] == group) & (results_df['variable'] == var)].iloc[0][
-                'spearman']
-            axes[i].annotate("spearman: {0:.5f}".format(pval), xy=(0, 1), xycoords="axes fraction",
-                             xytext=(5, 10), textcoords="offset points",
-                             ha="left", va="top")
-
-            margin = (max(subset_df[var]) - min(subset_df[var])) * 0.05
-            axes[i].set(ylim=(min(subset_df[var]) - margin, max(subset_df[var]) + margin))
-
-        fig.suptitle('Performance for {0:s} = {1:s} '.format(group_col, group),
-                     fontsize=16)
-
-        out_path = os.path.join(output_dir, "avco__" + group_col + "_" + group + "__scatter.png")
-        print("saving to: " + out_path)
-        fig.tight_layout(rect=[0, 0.03, 1, 0.95])
-        fig.savefig(out_path)
-        plt.close()
+    # the strongest correlations are plotted first, the rest only while there is budget left
+    budget = plotting.PlotBudget() if budget is None else budget
+    groups = budget.order_groups(results_df, 'spearman_abs', ascending=False)
+    with plotting.FigureCache() as figures:
+        for group in groups:
+            subset_df = data_df[(data_df[group_col] == group)]
+            vars_sorted = budget.select('avcont', group_col, group,
+                                        results_df[results_df["group"] == group]['variable'])
+
+            # convert to numeric
+            for var in vars_sorted:
+                subset_df[var] = subset_df[var].astype('float')
+
+            # the report draws densities of every group, they are small whatever the number of samples
+            if report is not None:
+                for var in vars_sorted:
+                    density = plotting.compute_density(subset_df[score_col].values, subset_df[var].values)
+                    spearman = results_df[(results_df['group'] == group) & (results_df['variable'] == var)].iloc[0][
+                        'spearman']
+                    report.add_density('avcont', group_col, group, var, density, score_col,
+                                       "spearman: {0:.5f}".format(spearman))
+                continue
+
+            use_density = len(subset_df) > max_points
+            if use_density:
+                print("{0:d} samples for {1:s} = {2:s}, plotting densities".format(len(subset_df), group_col, group))
+
+            page_size = len(vars_sorted) if vars_per_page is None else vars_per_page
+            pages = [vars_sorted[i:i + page_size] for i in range(0, len(vars_sorted), max(page_size, 1))]
+
+            for page_num, page_vars in enumerate(pages):
+                if not budget.allow('avcont', group_col, group, page_vars):
+                    continue
+                with budget.timed():
+                    # TODO: put corr val in plot title
+
+                    # TODO: trying to get plots to be square
+                    fig_width = 5
+                    fig_height = fig_width * len(page_vars) * 0.85
+
+                    # scatter plots of a reused figure keep their artists, only the points are replaced
+                    layout_key = (use_density, len(page_vars))
+                    fig, axes, reused = figures.get(layout_key, clear=use_density,
+                                                    nrows=len(page_vars), ncols=1,
+                                                    figsize=(fig_width, fig_height),
+                                                    sharex=True)
+
+                    for i, var in enumerate(page_vars):
+                        if use_density:
+                            density = plotting.compute_density(subset_df[score_col].values, subset_df[var].values)
+                            plotting.draw_density(axes[i], density)
+                        else:
+                            _draw_scatter(axes[i], subset_df, score_col, var, pal)
+                        axes[i].set(xlabel=score_col, ylabel=var)
+
+                        # ToDo: why is this labeled pval? I thought this was a correlation value
+                        pval = results_df[(results_df['group'] == group) & (results_df['variable'] == var)].iloc[0][
+                            'spearman']
+                        if len(axes[i].texts) > 0:
+                            axes[i].texts[0].set_text("spearman: {0:.5f}".format(pval))
+                        else:
+                            axes[i].annotate("spearman: {0:.5f}".format(pval), xy=(0, 1), xycoords="axes fraction",
+                                             xytext=(5, 10), textcoords="offset points",
+                                             ha="left", va="top")
+
+                        var_min, var_max = subset_df[var].min(), subset_df[var].max()
+                        margin = (var_max - var_min) * 0.05
+                        axes[i].set(ylim=(var_min - margin, var_max + margin))
+
+                    fig.suptitle('Performance for {0:s} = {1:s} '.format(group_col, group),
+                                 fontsize=16)
+
+                    if len(pages) > 1:
+                        out_path = os.path.join(output_dir, "avco__{0:s}_{1:s}__scatter_p{2:d}.png".format(
+                            group_col, group, page_num + 1))
+                    else:
+                        out_path = os.path.join(output_dir, "avco__" + group_col + "_" + group + "__scatter.png")
+                    print("saving to: " + out_path)
+                    figures.tight_layout(layout_key, rect=[0, 0.03, 1, 0.95])
+                    with rec.open_output(out_path, 'wb', writer=writer) as out_file:
+                        fig.savefig(out_file, format='png')
+
+
+def _draw_scatter(ax, subset_df, score_col, var, palette):
+    """
+    scatter plot of var against the score. if ax already has the scatter plot of a previous group, its points are
+    replaced instead of drawing a new plot
 
+    :param ax: matplotlib axes
+    :param subset_df: dataframe of the group
+    :param score_col: the score column
+    :param var: continuous variable
+    :param palette: color palette
+    """
 
-def save_df_stats_var(results_df, group_col, doc_info, output_dir):
+    points = subset_df[[score_col, var]].values
+    if len(ax.collections) == 1:
+        ax.collections[0].set_offsets(points)
+    else:
+        ax.cla()
+        sns.scatterplot(x=score_col, y=var,
+                        data=subset_df,
+                        ax=ax,
+                        palette=palette
+                        )
+
+    # the x limits of updated plots aren't rescaled automatically
+    score_min, score_max = np.nanmin(points[:, 0]), np.nanmax(points[:, 0])
+    margin = (score_max - score_min) * 0.05
+    if np.isfinite(margin):
+        ax.set(xlim=(score_min - margin, score_max + margin))
+
+
+def save_df_stats_var(results_df, group_col, doc_info, output_dir, writer=None):
     """
     Function to save the results_df as a tsv
 
@@ -179,21 +320,23 @@ def save_df_stats_var(results_df, group_col, doc_info, output_dir):
     :param doc_info: Information about what was run to get these results (e.g. what script was run, what command was
     run)
     :param output_dir: output directory
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     :return: out_path: path to saved file
     """
 
     out_path = os.path.join(output_dir, "avco__" + group_col + "__stats_var.tsv")
     print("saving to: " + out_path)
-    with open(out_path, 'w') as out_file:
+    with rec.open_output(out_path, writer=writer) as out_file:
         out_file.write(doc_info)
         out_file.write("# spearman correlation to score, for each group\n")
         out_file.write("# spearman correlation (bigger positive/negative number -> investigate)\n")
+        out_file.write("# n: number of samples, spearman_pval_corrected: p-value corrected for multiple testing\n")
         out_file.write("# \n")
         results_df.to_csv(out_file, sep='\t', header=True, index=False)
     return out_path
 
 
-def save_df_depend(results_df, group_col, doc_info, output_dir):
+def save_df_depend(results_df, group_col, doc_info, output_dir, writer=None):
     """
     Function to save the depend_df as a tsv
 
@@ -203,21 +346,24 @@ def save_df_depend(results_df, group_col, doc_info, output_dir):
     :param doc_info: Information about what was run to get these results (e.g. what script was run, what command was
     run)
     :param output_dir: output directory
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     :return: out_path: path to saved file
     """
 
     out_path = os.path.join(output_dir, "avco_depend__" + group_col + ".tsv")
     print("saving to: " + out_path)
-    with open(out_path, 'w') as out_file:
+    with rec.open_output(out_path, writer=writer) as out_file:
         out_file.write(doc_info)
         out_file.write("# spearman correlation between variables for each group\n")
         out_file.write("# spearman correlation (bigger positive/negative number -> dependency)\n")
+        out_file.write("# n: number of samples, spearman_pval_corrected: p-value corrected for multiple testing\n")
         out_file.write("# \n")
         results_df.to_csv(out_file, sep='\t', header=True, index=False)
     return out_path
 
 
-def run(group_col, cont_vars, data_df, score_col, output_dir):
+def run(group_col, cont_vars, data_df, score_col, output_dir, max_points=10000, vars_per_page=None, correction='fdr_bh',
+        spearman_permutations=0, report=None, budget=None, writer=None):
     """
     Function to run analysis of continous variables
 
@@ -226,6 +372,14 @@ def run(group_col, cont_vars, data_df, score_col, output_dir):
     :param data_df: dataframe
     :param score_col: the score column
     :param output_dir: output directory
+    :param max_points: above this many samples in a group, plot densities instead of scatter plots
+    :param vars_per_page: maximum number of variables per scatter plot figure (None for all)
+    :param correction: multiple testing correction, one of multiple_testing.METHODS
+    :param spearman_permutations: number of permutations for permutation p-values of the correlations with the score in
+    groups with at most 30 samples (0 for the t approximation)
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param budget: plotting.PlotBudget the plots are counted against (None for no limits)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     :return: files: list of files output by the script
     """
 
@@ -244,16 +398,20 @@ def run(group_col, cont_vars, data_df, score_col, output_dir):
 
     files = []
     # run analysis
-    results_df, depend_df = analyze_by_var(group_col, score_col, cont_vars_copy, data_df_copy)
-    files.append(save_df_stats_var(results_df, group_col, doc_info, output_dir))
-    files.append(save_df_depend(depend_df, group_col, doc_info, output_dir))
+    results_df, depend_df = analyze_by_var(group_col, score_col, cont_vars_copy, data_df_copy, correction,
+                                           spearman_permutations)
+    files.append(save_df_stats_var(results_df, group_col, doc_info, output_dir, writer=writer))
+    files.append(save_df_depend(depend_df, group_col, doc_info, output_dir, writer=writer))
 
-    plot_result_score_corr(results_df, group_col, score_col, data_df_copy, output_dir)
+    plot_result_score_corr(results_df, group_col, score_col, data_df_copy, output_dir, max_points, vars_per_page,
+                           report=report, budget=budget, writer=writer)
 
     return files
 
 
 if __name__ == '__main__':
+    import diagnose.dal.cp_ys as dat
+
     config_path = "configs/diagnose_config_bio.json"
     dta_json = json.load(open(config_path))
 
@@ -17,22 +17,24 @@ if platform.system() == "Darwin":
     matplotlib.use("TkAgg")
 else:
     matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.stats import kruskal
 import itertools
-import diagnose.dal.cp_ys as dat
 import diagnose.data_tracking as dattrk
-import statsmodels.stats.multitest as stat
+import diagnose.make_record as rec
+import diagnose.plotting as plotting
+import diagnose.multiple_testing as mt
+import diagnose.cardinality as cardinality
 
 
-def analyze_by_part(score_col, cat_vars, data_df):
+def analyze_by_part(score_col, cat_vars, data_df, correction='fdr_bh'):
     """
     get kruskal-wallis p-value (corrected for multiple tests) for each part
 
     :param score_col: the score column
     :param cat_vars: list of parts ToDo: We probably shouldn't reuse this variable name because it's confusing
     :param data_df: dataframe
+    :param correction: multiple testing correction, one of multiple_testing.METHODS
     :return: results_df: dataframe with corrected kw p-values for each of the parts (or combinations of parts)
     """
 
@@ -46,7 +48,7 @@ def analyze_by_part(score_col, cat_vars, data_df):
 
     results_df = pd.DataFrame(results_list)
 
-    fdr = stat.multipletests(results_df.var_kw_pval, method='fdr_bh')
+    fdr = mt.correct(results_df.var_kw_pval.values, method=correction)
     results_df['var_kw_pval_corrected'] = fdr[1]
 
     results_df.sort_values(by=['var_kw_pval_corrected'], ascending=[True], inplace=True)
@@ -162,7 +164,7 @@ def combine_cat_vars_nonp(data_df, cat_vars, score_col):
     return combo_vars_str, combos_df
 
 
-def save_df_stats_var(results_df, doc_info, output_dir, prefix):
+def save_df_stats_var(results_df, doc_info, output_dir, prefix, writer=None):
     """
     Saving results_df to file
 
@@ -171,11 +173,12 @@ def save_df_stats_var(results_df, doc_info, output_dir, prefix):
     run)
     :param output_dir: output directory
     :param prefix: prefix for file name
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     out_path = os.path.join(output_dir, prefix + "__stats_var.tsv")
     print("saving to: " + out_path)
-    with open(out_path, 'w') as out_file:
+    with rec.open_output(out_path, writer=writer) as out_file:
         out_file.write(doc_info)
         out_file.write("# analysis of variance performed for each part\n")
         out_file.write("# Kruskal-Wallace p-val with correction (lower value -> investigate)\n")
@@ -183,7 +186,7 @@ def save_df_stats_var(results_df, doc_info, output_dir, prefix):
         results_df.to_csv(out_file, sep='\t', header=True, index=False)
 
 
-def save_df_stats_val(results_df, doc_info, output_dir, prefix):
+def save_df_stats_val(results_df, doc_info, output_dir, prefix, writer=None):
     """
     Save summary dataframe to file
 
@@ -193,11 +196,12 @@ def save_df_stats_val(results_df, doc_info, output_dir, prefix):
     run)
     :param output_dir: output directory
     :param prefix: prefix for file name
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     out_path = os.path.join(output_dir, prefix + "__stats_val.tsv")
     print("saving to: " + out_path)
-    with open(out_path, 'w') as out_file:
+    with rec.open_output(out_path, writer=writer) as out_file:
         out_file.write(doc_info)
         out_file.write("# stats on values of each variable, and analysis of variance for each group \n")
         out_file.write("# Kruskal-Wallace p-val with correction (lower value -> investigate)\n")
@@ -205,7 +209,7 @@ def save_df_stats_val(results_df, doc_info, output_dir, prefix):
         results_df.to_csv(out_file, sep='\t', header=True, index=False)
 
 
-def save_df_stats_val_worry(results_df, doc_info, output_dir, prefix):
+def save_df_stats_val_worry(results_df, doc_info, output_dir, prefix, writer=None):
     """
     Save subset of summary dataframe to file
 
@@ -214,11 +218,12 @@ def save_df_stats_val_worry(results_df, doc_info, output_dir, prefix):
     run)
     :param output_dir: output directory
     :param prefix: prefix for file name
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     out_path = os.path.join(output_dir, prefix + "__stats_val_CHECK.tsv")
     print("saving to: " + out_path)
-    with open(out_path, 'w') as out_file:
+    with rec.open_output(out_path, writer=writer) as out_file:
         out_file.write(doc_info)
         out_file.write("# stats on values of each variable, and analysis of variance for each group \n")
         out_file.write("# Kruskal-Wallace p-val with correction (lower value -> investigate)\n")
@@ -227,7 +232,8 @@ def save_df_stats_val_worry(results_df, doc_info, output_dir, prefix):
         results_df.to_csv(out_file, sep='\t', header=True, index=False)
 
 
-def plot_result_distibution(results_df, score_col, data_df, output_dir, prefix):
+def plot_result_distibution(results_df, score_col, data_df, output_dir, prefix, top_k=None, max_plot_levels=50,
+                            decisions=None, report=None, budget=None, writer=None):
     """
     Boxplot of Performance Distributions for each part with corrected KW p-values
 
@@ -236,54 +242,70 @@ def plot_result_distibution(results_df, score_col, data_df, output_dir, prefix):
     :param data_df: dataframe
     :param output_dir: output directory
     :param prefix: prefix for file name
+    :param top_k: number of parts to plot, the most significant first, unless the plot budget sets it
+    :param max_plot_levels: variables with more levels than this are not plotted (None for no limit)
+    :param decisions: list the variables that are not plotted are added to, for the record (None to only print them)
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param budget: plotting.PlotBudget the plots are counted against (None for no limits)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     pal = sns.color_palette("hls", 8)
 
-    vars_sorted = results_df['variable']
+    budget = plotting.PlotBudget() if budget is None else budget
+    vars_sorted = budget.select('avpart', None, prefix,
+                                cardinality.plottable('avpart', prefix, results_df['variable'], data_df, max_plot_levels,
+                                                      decisions), top_k)
+    if report is None and not budget.allow('avpart', None, prefix, vars_sorted):
+        return
+
+    # box statistics for every variable at once, boxes are ordered by median
+    box_stats = plotting.compute_box_stats(data_df, score_col, list(vars_sorted))
+
+    # the report draws the boxplots from the statistics, no figure needed
+    if report is not None:
+        report.add_box_stats('avpart', None, prefix, 'ALL', box_stats[None], score_col)
+        for var in vars_sorted:
+            pval = results_df[(results_df['variable'] == var)].iloc[0]['var_kw_pval_corrected']
+            report.add_box_stats('avpart', None, prefix, var, box_stats[var], score_col,
+                                 "p-value: {0:.5e}".format(pval))
+        return
 
     heights_list = [1]  # first plot will be whole distribution
-    for col in vars_sorted:
-        heights_list.append(len(data_df[col].unique()))
+    for var in vars_sorted:
+        heights_list.append(len(box_stats[var]))
 
     fig_height = 2 + sum(heights_list) * 0.5
 
-    fig, axes = plt.subplots(len(vars_sorted) + 1,
-                             figsize=(7, fig_height),
-                             gridspec_kw={'height_ratios': heights_list},
-                             sharex=True)
-
-    # show whole distribution
-    sns.boxplot(x=score_col,
-                data=data_df,
-                orient="h",
-                ax=axes[0],
-                palette=pal)
-    axes[0].set(ylabel='ALL')
-
-    for i, var in enumerate(vars_sorted):
-        order = data_df.groupby(by=[var])[score_col].median().sort_values(ascending=True).iloc[::-1].index
-        sns.boxplot(x=score_col, y=var,
-                    data=data_df,
-                    orient="h",
-                    order=order,
-                    ax=axes[i + 1],
-                    palette=pal)
-        pval = results_df[(results_df['variable'] == var)].iloc[0]['var_kw_pval_corrected']
-        axes[i + 1].annotate("p-value: {0:.5e}".format(pval), xy=(0, 1), xycoords="axes fraction",
-                             xytext=(5, 10), textcoords="offset points",
-                             ha="left", va="top")
-
-    fig.suptitle('Performance Distributions for Parts \nwith corrected KW p-values', fontsize=16)
-
-    out_path = os.path.join(output_dir, prefix + "__dist.png")
-    print("saving to: " + out_path)
-    fig.tight_layout(rect=[0, 0.03, 1, 0.95])
-    fig.savefig(out_path)
-    # plt.close() ToDo: Deprecated? Can we delete this?
+    with plotting.FigureCache() as figures, budget.timed():
+        fig, axes, reused = figures.get('dist', nrows=len(vars_sorted) + 1,
+                                        figsize=(7, fig_height),
+                                        gridspec_kw={'height_ratios': heights_list},
+                                        sharex=True)
+
+        # show whole distribution
+        plotting.draw_box_stats(axes[0], box_stats[None], pal)
+        axes[0].set(xlabel=score_col, ylabel='ALL')
+
+        for i, var in enumerate(vars_sorted):
+            plotting.draw_box_stats(axes[i + 1], box_stats[var], pal)
+            axes[i + 1].set(xlabel=score_col, ylabel=var)
+            pval = results_df[(results_df['variable'] == var)].iloc[0]['var_kw_pval_corrected']
+            axes[i + 1].annotate("p-value: {0:.5e}".format(pval), xy=(0, 1), xycoords="axes fraction",
+                                 xytext=(5, 10), textcoords="offset points",
+                                 ha="left", va="top")
+
+        fig.suptitle('Performance Distributions for Parts \nwith corrected KW p-values', fontsize=16)
+
+        out_path = os.path.join(output_dir, prefix + "__dist.png")
+        print("saving to: " + out_path)
+        figures.tight_layout('dist', rect=[0, 0.03, 1, 0.95])
+        with rec.open_output(out_path, 'wb', writer=writer) as out_file:
+            fig.savefig(out_file, format='png')
 
 
-def run(data_df, cat_vars, score_col, output_dir):
+def run(data_df, cat_vars, score_col, output_dir, correction='fdr_bh', max_plot_levels=50, decisions=None, report=None,
+        budget=None, writer=None):
     """
     function to run analysis of parts
 
@@ -291,6 +313,12 @@ def run(data_df, cat_vars, score_col, output_dir):
     :param cat_vars: list of parts
     :param score_col: the score column
     :param output_dir: output directory
+    :param correction: multiple testing correction, one of multiple_testing.METHODS
+    :param max_plot_levels: variables with more levels than this are not plotted (None for no limit)
+    :param decisions: list the variables that are not plotted are added to, for the record (None to only print them)
+    :param report: html_report.Report to add the summaries to instead of drawing png files (None for png files)
+    :param budget: plotting.PlotBudget the plots are counted against (None for no limits)
+    :param writer: make_record.OutputWriter the files are written with (None for separate files that are not recorded)
     """
 
     doc_info = dattrk.get_doc_info_string(__file__, sys.argv, None)
@@ -301,29 +329,33 @@ def run(data_df, cat_vars, score_col, output_dir):
     data_df.fillna('NAN', inplace=True)
 
     # run analysis for individual parts
-    results_df = analyze_by_part(score_col, cat_vars, data_df)
-    save_df_stats_var(results_df, doc_info, output_dir, 'av_part')
+    results_df = analyze_by_part(score_col, cat_vars, data_df, correction)
+    save_df_stats_var(results_df, doc_info, output_dir, 'av_part', writer=writer)
 
     summary_df, subset_summarize_df = summarize_results(data_df, results_df, score_col, cat_vars)
 
-    save_df_stats_val(summary_df, doc_info, output_dir, 'av_part')
-    save_df_stats_val_worry(subset_summarize_df, doc_info, output_dir, 'av_part')
-    plot_result_distibution(results_df, score_col, data_df, output_dir, 'av_part')
+    save_df_stats_val(summary_df, doc_info, output_dir, 'av_part', writer=writer)
+    save_df_stats_val_worry(subset_summarize_df, doc_info, output_dir, 'av_part', writer=writer)
+    plot_result_distibution(results_df, score_col, data_df, output_dir, 'av_part', max_plot_levels=max_plot_levels,
+                            decisions=decisions, report=report, budget=budget, writer=writer)
 
     # analysis for combinations of parts, pairs
     combos_df, combo_vars_str = combine_cat_vars(data_df=data_df, cat_vars=cat_vars, score_col=score_col)
-    results_df = analyze_by_part(score_col, combo_vars_str, combos_df)
-    save_df_stats_var(results_df, doc_info, output_dir, 'av_partcombos')
+    results_df = analyze_by_part(score_col, combo_vars_str, combos_df, correction)
+    save_df_stats_var(results_df, doc_info, output_dir, 'av_partcombos', writer=writer)
 
     summary_df, subset_summarize_df = summarize_results(combos_df, results_df, score_col, combo_vars_str)
 
-    save_df_stats_val(summary_df, doc_info, output_dir, 'av_partcombos')
-    save_df_stats_val_worry(subset_summarize_df, doc_info, output_dir, 'av_partcombos')
-    plot_result_distibution(results_df[0:25], score_col, combos_df, output_dir, 'av_partcombos')
+    save_df_stats_val(summary_df, doc_info, output_dir, 'av_partcombos', writer=writer)
+    save_df_stats_val_worry(subset_summarize_df, doc_info, output_dir, 'av_partcombos', writer=writer)
+    plot_result_distibution(results_df, score_col, combos_df, output_dir, 'av_partcombos', top_k=25,
+                            max_plot_levels=max_plot_levels, decisions=decisions, report=report, budget=budget,
+                            writer=writer)
 
 
 if __name__ == '__main__':
     import json
+    import diagnose.dal.cp_ys as dat
 
     config_path = "configs/diagnose_config_bio.json"
     dta_json = json.load(open(config_path))
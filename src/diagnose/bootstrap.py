@@ -0,0 +1,120 @@
+"""
+bootstrap confidence intervals for the medians of many cells (e.g. the values of every variable of every group) at once
+
+the samples are sorted by value within each segment (e.g. all values of a variable within a group), and the positions
+of the samples of each cell are kept in one block per cell. a bootstrap replicate draws positions within each cell's
+block: sorting the draws sorts every cell, and sorting the positions they point to sorts every segment, so the medians
+of all cells and segments are read directly at their middle positions.
+
+:created: 2021
+:copyright: (c) 2021, GDA
+:license: see LICENSE for more details
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def segment_medians(sorted_values, starts, sizes):
+    """
+    medians of contiguous sorted blocks of the last axis
+
+    :param sorted_values: array (... x samples), sorted within each block
+    :param starts: array with the first position of each block
+    :param sizes: array with the size of each block
+    :return: array (... x blocks) of medians
+    """
+
+    return (sorted_values[..., starts + (sizes - 1) // 2] + sorted_values[..., starts + sizes // 2]) / 2
+
+
+def _bootstrap_batch(sorted_values, cell_positions, cell_starts, cell_sizes, segment_starts, segment_sizes,
+                     num_replicates, seed):
+    """
+    medians of the cells and of the segments for a batch of bootstrap replicates, each cell is resampled on its own
+    (the segments are resampled stratified by cell)
+
+    :return: (array (replicates x cells), array (replicates x segments))
+    """
+
+    rng = np.random.default_rng(seed)
+    cell_of = np.repeat(np.arange(len(cell_sizes)), cell_sizes)
+    draws = cell_starts[cell_of] + (rng.random((num_replicates, len(sorted_values))) *
+                                    cell_sizes[cell_of]).astype('int64')
+
+    # the draws sorted within each cell block point to sorted values of the cell
+    draws.sort(axis=1)
+    positions = cell_positions[draws]
+    cell_medians = segment_medians(sorted_values[positions], cell_starts, cell_sizes)
+
+    # every segment gets as many draws as it has samples, so sorting the positions sorts each segment in place
+    positions.sort(axis=1)
+
+    return cell_medians, segment_medians(sorted_values[positions], segment_starts, segment_sizes)
+
+
+def median_cis(values, cell_codes, segment_codes, replicates=1000, confidence=0.95, max_batch_elements=2 ** 24,
+               n_jobs=1, seed=0):
+    """
+    percentile bootstrap confidence intervals for the median of every cell, and for the difference between the median
+    of a cell and the median of its segment
+
+    :param values: array of the values of the samples
+    :param cell_codes: array with the cell of each sample (0 to the number of cells - 1)
+    :param segment_codes: array with the segment of each sample, every cell must be within one segment
+    :param replicates: number of bootstrap replicates
+    :param confidence: confidence level of the intervals
+    :param max_batch_elements: replicates are drawn in batches of at most this many samples x replicates
+    :param n_jobs: number of processes to spread the batches over
+    :param seed: seed for the replicates, results do not depend on n_jobs
+    :return: dictionary of arrays, one value per cell: median, median_ci_low, median_ci_high, median_diff,
+    median_diff_ci_low, median_diff_ci_high
+    """
+
+    values = np.asarray(values, dtype=float)
+    order = np.lexsort((values, segment_codes))
+    sorted_values = values[order]
+    sorted_cells = np.asarray(cell_codes)[order]
+    sorted_segments = np.asarray(segment_codes)[order]
+
+    # positions of the samples of each cell, one block per cell (ascending, so sorted by value)
+    cell_positions = np.lexsort((np.arange(len(values)), sorted_cells, sorted_segments))
+    block_cells = sorted_cells[cell_positions]
+    cell_starts = np.flatnonzero(np.r_[True, block_cells[1:] != block_cells[:-1]])
+    cell_sizes = np.diff(np.r_[cell_starts, len(values)])
+    segment_starts = np.flatnonzero(np.r_[True, sorted_segments[1:] != sorted_segments[:-1]])
+    segment_sizes = np.diff(np.r_[segment_starts, len(values)])
+    # segment of each cell, as a position in segment_starts
+    cell_segment = np.searchsorted(segment_starts, cell_positions[cell_starts], side='right') - 1
+
+    batch_size = max(1, max_batch_elements // max(1, len(values)))
+    batch_replicates = [min(batch_size, replicates - i) for i in range(0, replicates, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_replicates))
+    batch_args = [(sorted_values, cell_positions, cell_starts, cell_sizes, segment_starts, segment_sizes, b, s)
+                  for b, s in zip(batch_replicates, seeds)]
+
+    if n_jobs is not None and n_jobs > 1 and len(batch_args) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            batch_results = list(executor.map(_bootstrap_batch, *zip(*batch_args)))
+    else:
+        batch_results = [_bootstrap_batch(*args) for args in batch_args]
+
+    cell_medians = np.concatenate([x[0] for x in batch_results])
+    diffs = cell_medians - np.concatenate([x[1] for x in batch_results])[:, cell_segment]
+    quantiles = [(1 - confidence) / 2, 1 - (1 - confidence) / 2]
+    median_ci = np.quantile(cell_medians, quantiles, axis=0)
+    diff_ci = np.quantile(diffs, quantiles, axis=0)
+
+    median = segment_medians(sorted_values[cell_positions], cell_starts, cell_sizes)
+    diff = median - segment_medians(sorted_values, segment_starts, segment_sizes)[cell_segment]
+
+    # back from the order of the cell blocks to the cell codes
+    cells = block_cells[cell_starts]
+    results = dict()
+    for name, x in [('median', median), ('median_ci_low', median_ci[0]), ('median_ci_high', median_ci[1]),
+                    ('median_diff', diff), ('median_diff_ci_low', diff_ci[0]), ('median_diff_ci_high', diff_ci[1])]:
+        results[name] = np.full(cells.max() + 1, np.nan)
+        results[name][cells] = x
+
+    return results
@@ -0,0 +1,278 @@
+"""
+single-file bundle for the output of a run, instead of many small files.
+
+entries (tables, images) are appended to the bundle as they are written, and an index with the offset of each entry is
+written at the end, so single entries can be read without unpacking the whole bundle.
+
+layout:
+    magic (8 bytes)
+    for each entry: entry header (name length: uint32, data length: uint64), name (utf-8), data
+    index (json: {name: [data offset, data length]})
+    index offset (uint64), index magic (8 bytes)
+
+usage:
+    python -m diagnose.bundle list <bundle>
+    python -m diagnose.bundle extract <bundle> [<name> ...] [--output_dir <dir>]
+
+:created: 2021
+:copyright: (c) 2021, GDA
+:license: see LICENSE for more details
+"""
+
+import io
+import os
+import json
+import struct
+import argparse
+
+MAGIC = b'DDBUNDL1'
+INDEX_MAGIC = b'DDBINDEX'
+ENTRY_HEADER = struct.Struct('<IQ')
+FOOTER = struct.Struct('<Q8s')
+
+
+class BundleEntry(object):
+    """
+    file-like object for writing one entry into a bundle
+    """
+
+    def __init__(self, bundle, name):
+        """
+        :param bundle: BundleWriter the entry is written to
+        :param name: name of the entry
+        """
+        self.bundle = bundle
+        self.name = name
+        self.size = 0
+        self.closed = False
+
+        encoded_name = name.encode('utf-8')
+        self.header_offset = bundle.file.tell()
+        bundle.file.write(ENTRY_HEADER.pack(len(encoded_name), 0))
+        bundle.file.write(encoded_name)
+        self.data_offset = bundle.file.tell()
+
+    def write(self, data):
+        self.size += len(data)
+        return self.bundle.file.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        # now that the size is known, fill it in the entry header
+        end = self.bundle.file.tell()
+        self.bundle.file.seek(self.header_offset)
+        self.bundle.file.write(ENTRY_HEADER.pack(len(self.name.encode('utf-8')), self.size))
+        self.bundle.file.seek(end)
+        self.bundle.index[self.name] = [self.data_offset, self.size]
+        self.bundle.entry = None
+        self.closed = True
+
+
+class BundleWriter(object):
+    """
+    write the entries of a bundle one after the other, then the index on close
+    """
+
+    def __init__(self, path, root=None):
+        """
+        :param path: path to the bundle file
+        :param root: directory that entry names are relative to (for entries added by file path)
+        """
+        self.path = path
+        self.root = root if root is not None else os.path.dirname(path)
+        self.index = dict()
+        self.entry = None
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+
+    def entry_name(self, file_path):
+        """
+        name of the entry for a file that would otherwise be written at file_path
+
+        :param file_path: path to file
+        :return: name relative to the root of the bundle
+        """
+
+        return os.path.relpath(file_path, self.root).replace(os.sep, '/')
+
+    def open_entry(self, name):
+        """
+        start a new entry, only one entry can be open at a time
+
+        :param name: name of the entry
+        :return: BundleEntry to write the data to
+        """
+
+        if self.entry is not None:
+            raise ValueError("bundle entry {0:s} is still open".format(self.entry.name))
+        self.entry = BundleEntry(self, name)
+
+        return self.entry
+
+    def add(self, name, data):
+        """
+        add an entry with all of its data at once
+
+        :param name: name of the entry
+        :param data: bytes
+        """
+
+        entry = self.open_entry(name)
+        entry.write(data)
+        entry.close()
+
+    def close(self):
+        """
+        write the index and close the bundle file
+        """
+
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(json.dumps(self.index).encode('utf-8'))
+        self.file.write(FOOTER.pack(index_offset, INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BundleReader(object):
+    """
+    read entries from a bundle without unpacking it
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the bundle file
+        """
+        self.path = path
+        self.file = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("not a bundle: {0:s}".format(path))
+        self.index = self._read_index()
+
+    def _read_index(self):
+        """
+        read the index at the end of the bundle, or rebuild it from the entry headers if the bundle wasn't closed
+
+        :return: index {name: [data offset, data length]}
+        """
+
+        self.file.seek(0, os.SEEK_END)
+        end = self.file.tell()
+        if end >= len(MAGIC) + FOOTER.size:
+            self.file.seek(end - FOOTER.size)
+            index_offset, index_magic = FOOTER.unpack(self.file.read(FOOTER.size))
+            if index_magic == INDEX_MAGIC:
+                self.file.seek(index_offset)
+                return json.loads(self.file.read(end - FOOTER.size - index_offset).decode('utf-8'))
+
+        print("no index in {0:s}, scanning entries".format(self.path))
+        index = dict()
+        offset = len(MAGIC)
+        while offset + ENTRY_HEADER.size <= end:
+            self.file.seek(offset)
+            name_length, data_length = ENTRY_HEADER.unpack(self.file.read(ENTRY_HEADER.size))
+            data_offset = offset + ENTRY_HEADER.size + name_length
+            if data_offset + data_length > end:
+                break
+            index[self.file.read(name_length).decode('utf-8')] = [data_offset, data_length]
+            offset = data_offset + data_length
+
+        return index
+
+    def list(self):
+        """
+        :return: list of (name, size) of the entries
+        """
+
+        return [(name, size) for name, (offset, size) in self.index.items()]
+
+    def read(self, name):
+        """
+        :param name: name of the entry
+        :return: data of the entry as bytes
+        """
+
+        offset, size = self.index[name]
+        self.file.seek(offset)
+
+        return self.file.read(size)
+
+    def open(self, name):
+        """
+        :param name: name of the entry
+        :return: binary file-like object with the data of the entry, e.g. for pd.read_csv
+        """
+
+        return io.BytesIO(self.read(name))
+
+    def extract(self, output_dir, names=None):
+        """
+        write entries to files
+
+        :param output_dir: directory to extract to
+        :param names: names of the entries to extract, default is all
+        :return: list of paths to the extracted files
+        """
+
+        if names is None:
+            names = list(self.index.keys())
+
+        paths = list()
+        for name in names:
+            out_path = os.path.join(output_dir, *name.split('/'))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'wb') as out_file:
+                out_file.write(self.read(name))
+            paths.append(out_path)
+
+        return paths
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    """
+    list or extract the entries of a bundle
+    """
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_list = subparsers.add_parser('list', help='list the entries in a bundle')
+    parser_list.add_argument("bundle", help="path to the bundle")
+
+    parser_extract = subparsers.add_parser('extract', help='extract entries from a bundle')
+    parser_extract.add_argument("bundle", help="path to the bundle")
+    parser_extract.add_argument("names", help="entries to extract, default is all", nargs='*')
+    parser_extract.add_argument("--output_dir", help="directory to extract to", default='.')
+
+    args = parser.parse_args()
+
+    with BundleReader(args.bundle) as reader:
+        if args.command == 'list':
+            for name, size in reader.list():
+                print("{0:>12d}  {1:s}".format(size, name))
+        else:
+            for path in reader.extract(args.output_dir, args.names if args.names else None):
+                print("extracted: " + path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+guardrails for categorical variables with many levels (e.g. a well id or a timestamp that ends up in cat_vars), so a
+single such column doesn't blow up the memory or time of a run:
+    - contingency tables with more than max_table_cells cells are counted sparsely (only the observed combinations)
+    - levels with fewer than min_level_count samples can be lumped into one "other" level
+    - variables with more than max_plot_levels levels are left out of the boxplots
+
+every decision is printed and added to the list of decisions given to the analyses, for the record of the run.
+
+:created: 2021
+:copyright: (c) 2021, GDA
+:license: see LICENSE for more details
+"""
+
+import numpy as np
+
+OTHER_LEVEL = 'other'
+
+
+def log_decision(analysis, group, variables, decision, detail, decisions=None):
+    """
+    print a decision and add it to the decisions, for the record
+
+    :param analysis: analysis, e.g. dependence
+    :param group: group the decision applies to
+    :param variables: list of the variables the decision applies to
+    :param decision: what was done, e.g. sparse_table
+    :param detail: why, e.g. the number of levels
+    :param decisions: list the decision is added to (None to only print it)
+    """
+
+    print("cardinality: {0:s} {1:s} for {2:s} ({3:s})".format(analysis, decision, ', '.join(map(str, variables)),
+                                                             detail))
+    if decisions is None:
+        return
+
+    decisions.append({'analysis': analysis, 'group': group, 'variables': list(variables), 'decision': decision,
+                      'detail': detail})
+
+
+def other_level(levels):
+    """
+    name for the lumped levels that isn't one of the levels, OTHER_LEVEL with a number appended if it is
+
+    :param levels: levels of the variable
+    :return: name of the lumped level
+    """
+
+    levels = set(levels)
+    name, suffix = OTHER_LEVEL, 0
+    while name in levels:
+        suffix += 1
+        name = "{0:s}_{1:d}".format(OTHER_LEVEL, suffix)
+
+    return name
+
+
+def lump_rare_levels(data_df, variables, min_count=None, decisions=None):
+    """
+    replace the levels of each variable with fewer than min_count samples by one other level (see other_level),
+    unless that would leave fewer than two levels
+
+    :param data_df: dataframe
+    :param variables: categorical variables
+    :param min_count: minimum number of samples of a level (nothing is lumped if None)
+    :param decisions: list the lumped and skipped variables are added to (None to only print them)
+    :return: dataframe, a copy if any level was lumped
+    """
+
+    if min_count is None:
+        return data_df
+
+    lumped_df = data_df
+    for var in variables:
+        counts = data_df[var].value_counts()
+        rare = counts.index[counts < min_count]
+        if len(rare) < 2:
+            continue
+
+        # the other level and the common levels, a constant variable can't be tested
+        if len(counts) - len(rare) + 1 < 2:
+            log_decision('data', 'all', [var], 'skip_lump', "all {0:d} levels with fewer than {1:d} samples"
+                         .format(len(counts), min_count), decisions)
+            continue
+
+        if lumped_df is data_df:
+            lumped_df = data_df.copy()
+        lumped_df[var] = lumped_df[var].where(~lumped_df[var].isin(rare), other_level(counts.index))
+        log_decision('data', 'all', [var], 'lump_levels', "{0:d} of {1:d} levels with fewer than {2:d} samples"
+                     .format(len(rare), len(counts), min_count), decisions)
+
+    return lumped_df
+
+
+def plottable(analysis, group, variables, data_df, max_levels=50, decisions=None):
+    """
+    variables with at most max_levels levels, so the boxplots of a near-unique variable aren't drawn
+
+    :param analysis: analysis, e.g. avcat
+    :param group: group that is plotted
+    :param variables: variables to plot
+    :param data_df: data of the group
+    :param max_levels: variables with more levels than this are not plotted (None for no limit)
+    :param decisions: list the skipped variables are added to (None to only print them)
+    :return: list of variables to plot
+    """
+
+    variables = list(variables)
+    if max_levels is None:
+        return variables
+
+    num_levels = [data_df[var].nunique(dropna=False) for var in variables]
+    skipped = [var for var, n in zip(variables, num_levels) if n > max_levels]
+    if len(skipped) > 0:
+        log_decision(analysis, group, skipped, 'skip_plot', "more than {0:d} levels".format(max_levels), decisions)
+
+    return [var for var, n in zip(variables, num_levels) if n <= max_levels]
+
+
+def sparse_contingency(codes_1, codes_2):
+    """
+    the observed cells of the contingency table of two categorical variables, without building the full table
+
+    :param codes_1: array of the codes (0 to the number of levels - 1) of the first variable
+    :param codes_2: array of the codes of the second variable
+    :return: (counts of the observed cells, counts of each level of the first variable, counts of each level of the
+    second variable, row of each observed cell, column of each observed cell)
+    """
+
+    num_2 = codes_2.max() + 1
+    cells, counts = np.unique(codes_1.astype('int64') * num_2 + codes_2, return_counts=True)
+
+    return counts, np.bincount(codes_1), np.bincount(codes_2), cells // num_2, cells % num_2
+
+
+def sparse_chi2(counts, row_sums, col_sums, rows, cols):
+    """
+    pearson chi^2 statistic of a contingency table from its observed cells, N * (sum(O^2 / (r * c)) - 1), which only
+    needs the nonzero cells
+
+    :param counts: counts of the observed cells
+    :param row_sums: counts of each row
+    :param col_sums: counts of each column
+    :param rows: row of each observed cell
+    :param cols: column of each observed cell
+    :return: (chi^2 statistic, degrees of freedom)
+    """
+
+    n = row_sums.sum()
+    statistic = n * ((counts.astype(float) ** 2 / (row_sums[rows].astype(float) * col_sums[cols])).sum() - 1)
+
+    return max(statistic, 0.0), (len(row_sums) - 1) * (len(col_sums) - 1)
@@ -0,0 +1,338 @@
+"""
+self-contained html report, an alternative to the per-group png files.
+
+the analyses add compact summaries (box statistics, binned densities, p-value matrices) to the report instead of
+drawing figures. the summaries are embedded in one html file as json and drawn in the browser, where groups and
+variables can be filtered. the file doesn't need anything else, so it can be opened offline.
+
+:created: 2021
+:copyright: (c) 2021, GDA
+:license: see LICENSE for more details
+"""
+
+import html
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+import diagnose.make_record as rec
+
+
+def _compact(value, digits=6):
+    """
+    convert summaries to plain json types, rounding floats to a number of significant digits
+
+    :param value: number, string, array, list or dict
+    :param digits: significant digits kept for floats
+    :return: json serializable value
+    """
+
+    if isinstance(value, dict):
+        return {str(k): _compact(v, digits) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray, pd.Series)):
+        return [_compact(v, digits) for v in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        if not math.isfinite(value):
+            return None
+        return float('{0:.{1:d}g}'.format(value, digits))
+
+    return value if value is None else str(value)
+
+
+class Report(object):
+    """
+    summaries of the analyses of a run, written as a single html file
+    """
+
+    def __init__(self, title):
+        """
+        :param title: title of the report
+        """
+        self.title = title
+        self.panels = list()
+
+    def _add(self, kind, section, group_col, group, variable, data, annotation):
+        self.panels.append({'kind': kind, 'section': section,
+                            'group_col': group_col, 'group': None if group is None else str(group),
+                            'variable': None if variable is None else str(variable),
+                            'annotation': annotation, 'data': _compact(data)})
+
+    def add_box_stats(self, section, group_col, group, variable, stats, x_label, annotation=None):
+        """
+        add boxplots of the score for the values of a variable
+
+        :param section: analysis the panel belongs to, e.g. avcat
+        :param group_col: column the data is grouped by (None if not grouped)
+        :param group: group of the panel
+        :param variable: variable the score is split by
+        :param stats: list of box statistics from plotting.compute_box_stats
+        :param x_label: label of the score axis
+        :param annotation: text shown with the panel, e.g. the p-value
+        """
+
+        boxes = [{key: x[key] for key in ['label', 'med', 'q1', 'q3', 'whislo', 'whishi', 'fliers', 'count']}
+                 for x in stats]
+        self._add('box', section, group_col, group, variable, {'boxes': boxes, 'x_label': x_label}, annotation)
+
+    def add_density(self, section, group_col, group, variable, density, x_label, annotation=None):
+        """
+        add a binned 2-D density of a variable against the score, only the non-empty bins are kept
+
+        :param section: analysis the panel belongs to, e.g. avcont
+        :param group_col: column the data is grouped by (None if not grouped)
+        :param group: group of the panel
+        :param variable: variable on the y axis
+        :param density: dictionary from plotting.compute_density
+        :param x_label: label of the x axis
+        :param annotation: text shown with the panel, e.g. the correlation
+        """
+
+        x_bins, y_bins = np.nonzero(density['counts'])
+        cells = np.column_stack([x_bins, y_bins, density['counts'][x_bins, y_bins]]).astype(int)
+        self._add('density', section, group_col, group, variable,
+                  {'cells': cells, 'x_edges': density['x_edges'], 'y_edges': density['y_edges'],
+                   'x_label': x_label, 'y_label': variable}, annotation)
+
+    def add_matrix(self, section, group_col, group, matrix_df, annotation=None):
+        """
+        add a matrix of p-values (or other values between 0 and 1), drawn as a heatmap table
+
+        :param section: analysis the panel belongs to, e.g. dependence
+        :param group_col: column the data is grouped by (None if not grouped)
+        :param group: group of the panel (None for a matrix over all groups)
+        :param matrix_df: dataframe with the row labels as index and column labels as columns
+        :param annotation: text shown with the panel
+        """
+
+        self._add('matrix', section, group_col, group, None,
+                  {'rows': list(matrix_df.index), 'columns': list(matrix_df.columns), 'values': matrix_df.values},
+                  annotation)
+
+    def to_html(self):
+        """
+        :return: the report as a self-contained html page
+        """
+
+        data = json.dumps({'title': self.title, 'panels': self.panels}, separators=(',', ':'))
+        # the json is inside a script element, which must not be closed early
+        data = data.replace('</', '<\\/')
+
+        return HTML_TEMPLATE.replace('__TITLE__', html.escape(self.title)).replace('__DATA__', data)
+
+    def write(self, out_path, writer=None):
+        """
+        write the report, through make_record so it is hashed (and bundled) like the other output
+
+        :param out_path: path to the html file
+        :param writer: make_record.OutputWriter the files are written with (None for separate files that are not
+        recorded)
+        :return: out_path
+        """
+
+        print("saving to: " + out_path)
+        with rec.open_output(out_path, 'wb', writer=writer) as out_file:
+            out_file.write(self.to_html().encode('utf-8'))
+
+        return out_path
+
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { font-family: sans-serif; margin: 20px; color: #222; }
+#controls { position: sticky; top: 0; background: #fff; padding: 8px 0; border-bottom: 1px solid #ccc; }
+#controls label { margin-right: 16px; }
+.panel { display: inline-block; vertical-align: top; margin: 10px; padding: 8px; border: 1px solid #ddd; }
+.panel h3 { font-size: 14px; margin: 0 0 4px 0; }
+.annotation { font-size: 12px; color: #555; margin-bottom: 4px; }
+table.matrix { border-collapse: collapse; font-size: 11px; }
+table.matrix td, table.matrix th { padding: 3px 5px; border: 1px solid #eee; text-align: center; }
+svg text { font-size: 10px; }
+</style>
+</head>
+<body>
+<h1>__TITLE__</h1>
+<div id="controls">
+  <label>analysis <select id="section"><option value="">all</option></select></label>
+  <label>group <input id="group" placeholder="filter"></label>
+  <label>variable <input id="variable" placeholder="filter"></label>
+  <span id="count"></span>
+</div>
+<div id="panels"></div>
+<script type="application/json" id="report-data">__DATA__</script>
+<script>
+"use strict";
+const report = JSON.parse(document.getElementById("report-data").textContent);
+const maxPanels = 200;
+const svgNS = "http://www.w3.org/2000/svg";
+const palette = ["#db5f57", "#dbc257", "#91db57", "#57db80", "#57d3db", "#5770db", "#a157db", "#db57b2"];
+
+function svgElement(name, attrs, text) {
+  const el = document.createElementNS(svgNS, name);
+  for (const key in attrs) { el.setAttribute(key, attrs[key]); }
+  if (text !== undefined) { el.textContent = text; }
+  return el;
+}
+
+function format(x) {
+  return Math.abs(x) >= 1e4 || (Math.abs(x) < 1e-2 && x !== 0) ? x.toExponential(2) : +x.toFixed(3);
+}
+
+function xAxis(svg, scale, lo, hi, y, left, width, label) {
+  svg.appendChild(svgElement("line", {x1: left, x2: left + width, y1: y, y2: y, stroke: "#444"}));
+  for (let i = 0; i <= 4; i++) {
+    const value = lo + (hi - lo) * i / 4;
+    svg.appendChild(svgElement("line", {x1: scale(value), x2: scale(value), y1: y, y2: y + 4, stroke: "#444"}));
+    svg.appendChild(svgElement("text", {x: scale(value), y: y + 14, "text-anchor": "middle"}, format(value)));
+  }
+  svg.appendChild(svgElement("text", {x: left + width / 2, y: y + 28, "text-anchor": "middle"}, label));
+}
+
+function drawBoxes(data) {
+  const boxes = data.boxes, rowHeight = 18, left = 130, width = 380;
+  const height = boxes.length * rowHeight + 40;
+  let lo = Infinity, hi = -Infinity;
+  for (const b of boxes) {
+    for (const v of [b.whislo, b.whishi].concat(b.fliers)) {
+      if (v !== null) { lo = Math.min(lo, v); hi = Math.max(hi, v); }
+    }
+  }
+  if (hi === lo) { hi = lo + 1; }
+  const scale = v => left + (v - lo) / (hi - lo) * width;
+  const svg = svgElement("svg", {width: left + width + 20, height: height});
+  boxes.forEach((b, i) => {
+    const y = i * rowHeight + 4, mid = y + rowHeight / 2;
+    const line = (x1, x2, y1, y2) => svg.appendChild(svgElement("line", {x1: x1, x2: x2, y1: y1, y2: y2, stroke: "#444"}));
+    line(scale(b.whislo), scale(b.q1), mid, mid);
+    line(scale(b.q3), scale(b.whishi), mid, mid);
+    line(scale(b.whislo), scale(b.whislo), y + 4, y + rowHeight - 4);
+    line(scale(b.whishi), scale(b.whishi), y + 4, y + rowHeight - 4);
+    svg.appendChild(svgElement("rect", {x: scale(b.q1), y: y + 2, width: Math.max(scale(b.q3) - scale(b.q1), 1),
+                                        height: rowHeight - 4, fill: palette[i % palette.length], stroke: "#444"}));
+    line(scale(b.med), scale(b.med), y + 2, y + rowHeight - 2);
+    for (const f of b.fliers) {
+      svg.appendChild(svgElement("circle", {cx: scale(f), cy: mid, r: 2, fill: "#444"}));
+    }
+    svg.appendChild(svgElement("text", {x: left - 6, y: mid + 3, "text-anchor": "end"}, b.label + " (" + b.count + ")"));
+  });
+  xAxis(svg, scale, lo, hi, boxes.length * rowHeight + 6, left, width, data.x_label);
+  return svg;
+}
+
+function color(t) {
+  // dark blue for low values to yellow for high values
+  return "hsl(" + (250 - 190 * t) + ", 75%, " + (25 + 45 * t) + "%)";
+}
+
+function drawDensity(data) {
+  const size = 300, left = 50, top = 10;
+  const xe = data.x_edges, ye = data.y_edges, nx = xe.length - 1, ny = ye.length - 1;
+  const svg = svgElement("svg", {width: left + size + 20, height: top + size + 40});
+  const maxCount = Math.max(1, ...data.cells.map(c => c[2]));
+  const cw = size / nx, ch = size / ny;
+  for (const [i, j, count] of data.cells) {
+    const t = Math.log(count) / Math.log(Math.max(maxCount, 2));
+    svg.appendChild(svgElement("rect", {x: left + i * cw, y: top + size - (j + 1) * ch, width: cw + 0.5,
+                                        height: ch + 0.5, fill: color(t)}));
+  }
+  svg.appendChild(svgElement("rect", {x: left, y: top, width: size, height: size, fill: "none", stroke: "#444"}));
+  const scale = v => left + (v - xe[0]) / (xe[nx] - xe[0]) * size;
+  xAxis(svg, scale, xe[0], xe[nx], top + size, left, size, data.x_label);
+  svg.appendChild(svgElement("text", {x: left - 4, y: top + 8, "text-anchor": "end"}, format(ye[ny])));
+  svg.appendChild(svgElement("text", {x: left - 4, y: top + size, "text-anchor": "end"}, format(ye[0])));
+  svg.appendChild(svgElement("text", {x: 12, y: top + size / 2, "text-anchor": "middle",
+                                      transform: "rotate(-90 12 " + (top + size / 2) + ")"}, data.y_label));
+  return svg;
+}
+
+function drawMatrix(data) {
+  const table = document.createElement("table");
+  table.className = "matrix";
+  const header = table.insertRow();
+  header.appendChild(document.createElement("th"));
+  for (const c of data.columns) {
+    const th = document.createElement("th");
+    th.textContent = c;
+    header.appendChild(th);
+  }
+  data.rows.forEach((r, i) => {
+    const row = table.insertRow();
+    const th = document.createElement("th");
+    th.textContent = r;
+    row.appendChild(th);
+    data.values[i].forEach(v => {
+      const cell = row.insertCell();
+      if (v === null) { return; }
+      // low p-values are dark, they are the ones to investigate
+      cell.style.background = color(Math.min(Math.max(v, 0), 1));
+      cell.style.color = v < 0.5 ? "#fff" : "#000";
+      cell.textContent = v.toFixed(2);
+      cell.title = v;
+    });
+  });
+  return table;
+}
+
+const renderers = {box: drawBoxes, density: drawDensity, matrix: drawMatrix};
+
+function title(panel) {
+  let text = panel.section + ": ";
+  if (panel.group !== null) { text += (panel.group_col !== null ? panel.group_col + " = " : "") + panel.group; }
+  if (panel.variable !== null) { text += " | " + panel.variable; }
+  return text;
+}
+
+function render() {
+  const section = document.getElementById("section").value;
+  const group = document.getElementById("group").value.toLowerCase();
+  const variable = document.getElementById("variable").value.toLowerCase();
+  const selected = report.panels.filter(p =>
+    (section === "" || p.section === section) &&
+    (group === "" || (p.group !== null && p.group.toLowerCase().includes(group))) &&
+    (variable === "" || (p.variable !== null && p.variable.toLowerCase().includes(variable))));
+  const container = document.getElementById("panels");
+  container.innerHTML = "";
+  for (const panel of selected.slice(0, maxPanels)) {
+    const div = document.createElement("div");
+    div.className = "panel";
+    const h = document.createElement("h3");
+    h.textContent = title(panel);
+    div.appendChild(h);
+    if (panel.annotation) {
+      const note = document.createElement("div");
+      note.className = "annotation";
+      note.textContent = panel.annotation;
+      div.appendChild(note);
+    }
+    div.appendChild(renderers[panel.kind](panel.data));
+    container.appendChild(div);
+  }
+  document.getElementById("count").textContent = selected.length > maxPanels ?
+    "showing " + maxPanels + " of " + selected.length + " panels, filter to see the rest" :
+    selected.length + " panels";
+}
+
+const sections = [...new Set(report.panels.map(p => p.section))];
+for (const s of sections) {
+  const option = document.createElement("option");
+  option.value = s;
+  option.textContent = s;
+  document.getElementById("section").appendChild(option);
+}
+for (const id of ["section", "group", "variable"]) {
+  document.getElementById(id).addEventListener("input", render);
+}
+render();
+</script>
+</body>
+</html>
+"""
@@ -8,18 +8,125 @@ Helper functions for producing record.json
 """
 
 import os
+import io
 import hashlib
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+# algorithms that can be used to hash output files
+HASH_ALGORITHMS = ['md5', 'sha256', 'blake2b']
 
-def make_hash(file_path):
+
+class HashingWriter(io.BufferedIOBase):
+    """
+    binary file wrapper that hashes the bytes as they are written, so the file doesn't need to be read back to hash it
+    """
+
+    def __init__(self, raw, algorithm):
+        """
+        :param raw: binary file opened for writing
+        :param algorithm: one of HASH_ALGORITHMS
+        """
+        super().__init__()
+        self.raw = raw
+        self.hasher = hashlib.new(algorithm)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self.raw.close()
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+class OutputWriter(object):
+    """
+    output files of a run: each file is hashed while it is written, and the hashes are kept for make_hashes_for_files.
+    with a bundle, the files become entries in the bundle instead of separate files
     """
-    make a md5 hash for a file
+
+    def __init__(self, algorithm='md5', bundle=None):
+        """
+        :param algorithm: one of HASH_ALGORITHMS
+        :param bundle: bundle.BundleWriter to write into, or None for separate files
+        """
+
+        if algorithm not in HASH_ALGORITHMS:
+            raise ValueError("unknown hash algorithm: {0:s}, use one of {1:s}".format(algorithm,
+                                                                                     ', '.join(HASH_ALGORITHMS)))
+        self.algorithm = algorithm
+        self.bundle = bundle
+        # hashes of the files written so far, {absolute path: (algorithm, hash)}
+        self.hashes = {}
+
+    @contextmanager
+    def open(self, file_path, mode='w'):
+        """
+        open an output file, hashing it while it is written
+
+        :param file_path: path to file
+        :param mode: 'w' for text, 'wb' for binary (e.g. for savefig)
+        :return: file object
+        """
+
+        algorithm = self.algorithm
+        if self.bundle is not None:
+            raw = self.bundle.open_entry(self.bundle.entry_name(file_path))
+        else:
+            raw = open(file_path, 'wb')
+        writer = HashingWriter(raw, algorithm)
+        out_file = io.TextIOWrapper(writer) if mode == 'w' else writer
+        try:
+            yield out_file
+        finally:
+            out_file.close()
+
+        self.hashes[os.path.abspath(file_path)] = (algorithm, writer.hexdigest())
+
+    def written_files(self):
+        """
+        files written so far
+
+        :return: list of paths
+        """
+
+        return list(self.hashes.keys())
+
+
+def open_output(file_path, mode='w', writer=None):
+    """
+    open an output file through writer, so it is hashed (and bundled) with the other output of the run
 
     :param file_path: path to file
-    :return: hash: md5 hash for a file
+    :param mode: 'w' for text, 'wb' for binary (e.g. for savefig)
+    :param writer: OutputWriter, None for a separate file that is not recorded
+    :return: file object
     """
-    md5 = hashlib.md5()
+
+    return (OutputWriter() if writer is None else writer).open(file_path, mode)
+
+
+def make_hash(file_path, algorithm='md5'):
+    """
+    make a hash for a file
+
+    :param file_path: path to file
+    :param algorithm: one of HASH_ALGORITHMS
+    :return: hash: hash for a file
+    """
+    hasher = hashlib.new(algorithm)
 
     with open(file_path, 'rb') as file:
         # read in binary. chunks in case of big files
@@ -27,25 +134,45 @@ def make_hash(file_path):
             data = file.read(65536)
             if not data:
                 break
-            md5.update(data)
+            hasher.update(data)
 
-    hash_val = md5.hexdigest()
-    print("MD5: {0}".format(hash_val))
+    hash_val = hasher.hexdigest()
+    print("{0}: {1}".format(algorithm.upper(), hash_val))
 
     return hash_val
 
 
-def make_hashes_for_files(file_list):
+def make_hashes_for_files(file_list, algorithm=None, n_threads=4, writer=None):
     """
-    for each file in a directory, make path, call hash, and make a record with file name and hash
+    for each file, make a record with file name and hash. files written through writer already have their hash,
+    other files are read and hashed on a thread pool
 
     :param file_list: list of file records [{"name": x}, ...]
-    :return: list of file records [{"name": str, "hash_md5": str}, ...]
+    :param algorithm: one of HASH_ALGORITHMS, default is the algorithm of writer (md5 without a writer)
+    :param n_threads: number of threads for hashing files that weren't written through writer
+    :param writer: OutputWriter the output of the run was written with
+    :return: list of file records [{"name": str, "hash_<algorithm>": str}, ...]
     """
 
+    hashes = {} if writer is None else writer.hashes
+    if algorithm is None:
+        algorithm = 'md5' if writer is None else writer.algorithm
+    key = 'hash_' + algorithm
+
+    to_hash = list()
     for file in file_list:
-        hash_val = make_hash(file['name'])
-        file['hash_md5'] = hash_val
+        if key in file:
+            continue
+        written = hashes.get(os.path.abspath(file['name']))
+        if written is not None and written[0] == algorithm:
+            file[key] = written[1]
+        else:
+            to_hash.append(file)
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        hashes = executor.map(make_hash, [file['name'] for file in to_hash], [algorithm] * len(to_hash))
+        for file, hash_val in zip(to_hash, hashes):
+            file[key] = hash_val
 
     return file_list
 
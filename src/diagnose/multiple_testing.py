@@ -0,0 +1,134 @@
+"""
+multiple testing correction shared by the analyses, vectorized over arrays of p-values
+
+methods:
+    fdr_bh: Benjamini & Hochberg false discovery rate
+    fdr_by: Benjamini & Yekutieli false discovery rate (any dependence between the tests)
+    holm: Holm step-down family-wise error rate
+    hierarchical: Benjamini & Hochberg within each group, then across the groups (see hierarchical)
+
+:created: 2021
+:copyright: (c) 2021, GDA
+:license: see LICENSE for more details
+"""
+
+import numpy as np
+
+METHODS = ['fdr_bh', 'fdr_by', 'holm', 'hierarchical']
+
+
+def adjust(pvals, method='fdr_bh'):
+    """
+    adjusted p-values, for each row of pvals (the last axis) at once. missing p-values are left out of the correction
+    and stay missing. for fdr_bh the values are the same as statsmodels' multipletests
+
+    :param pvals: array of p-values (tests) or (rows x tests)
+    :param method: fdr_bh, fdr_by or holm
+    :return: array of adjusted p-values, same shape as pvals
+    """
+
+    pvals = np.asarray(pvals, dtype=float)
+    squeeze = pvals.ndim == 1
+    pvals = np.atleast_2d(pvals)
+    if pvals.size == 0:
+        return pvals[0].copy() if squeeze else pvals.copy()
+
+    missing = np.isnan(pvals)
+    num_tests = (~missing).sum(axis=1, keepdims=True)
+    order = np.argsort(np.where(missing, np.inf, pvals), axis=1, kind='mergesort')
+    sorted_pvals = np.take_along_axis(np.where(missing, np.inf, pvals), order, axis=1)
+    rank = np.arange(1, pvals.shape[1] + 1)[None, :]
+
+    if method in ['fdr_bh', 'fdr_by']:
+        ecdf_factor = rank / num_tests
+        if method == 'fdr_by':
+            ecdf_factor = ecdf_factor / np.cumsum(1 / np.arange(1, pvals.shape[1] + 1))[np.maximum(num_tests - 1, 0)]
+        adjusted = sorted_pvals / ecdf_factor
+        # step up: each p-value gets the smallest adjusted value of the p-values at least as large
+        adjusted = np.minimum.accumulate(adjusted[:, ::-1], axis=1)[:, ::-1]
+    elif method == 'holm':
+        adjusted = np.maximum.accumulate(sorted_pvals * np.maximum(num_tests - rank + 1, 1), axis=1)
+    else:
+        raise ValueError("unknown correction: {0:s}".format(method))
+
+    corrected = np.empty_like(adjusted)
+    np.put_along_axis(corrected, order, np.minimum(adjusted, 1), axis=1)
+    corrected[missing] = np.nan
+
+    return corrected[0] if squeeze else corrected
+
+
+def hierarchical(pvals, groups):
+    """
+    two level false discovery rate: Benjamini & Hochberg within each group, and across the groups on the smallest
+    adjusted p-value of each group (the Simes p-value of the group). a test's p-value is the larger of the two, so it
+    is only significant if its group is
+
+    :param pvals: array of p-values
+    :param groups: array with the group of each p-value
+    :return: array of adjusted p-values
+    """
+
+    pvals = np.asarray(pvals, dtype=float)
+    if len(pvals) == 0:
+        return pvals.copy()
+    group_codes, group_index = np.unique(np.asarray(groups), return_inverse=True)
+
+    # one row per group, padded with missing values, so all groups are adjusted at once
+    order = np.argsort(group_index, kind='mergesort')
+    group_sizes = np.bincount(group_index, minlength=len(group_codes))
+    position = np.arange(len(pvals)) - np.repeat(np.cumsum(group_sizes) - group_sizes, group_sizes)
+    padded = np.full((len(group_codes), group_sizes.max()), np.nan)
+    padded[group_index[order], position] = pvals[order]
+
+    within = adjust(padded, 'fdr_bh')
+    across = adjust(np.nanmin(np.where(np.isnan(within), np.inf, within), axis=1), 'fdr_bh')
+
+    corrected = np.empty(len(pvals))
+    corrected[order] = np.maximum(within[group_index[order], position], across[group_index[order]])
+    corrected[np.isnan(pvals)] = np.nan
+
+    return corrected
+
+
+def correct(pvals, alpha=0.05, groups=None, method='fdr_bh'):
+    """
+    correct the p-values of an analysis, in the same form as statsmodels' multipletests
+
+    :param pvals: array of p-values
+    :param alpha: error rate for the rejected hypotheses
+    :param groups: group of each p-value, for the hierarchical method (one group if None)
+    :param method: one of METHODS
+    :return: (reject, corrected): boolean array of rejected hypotheses, array of corrected p-values
+    """
+
+    if method not in METHODS:
+        raise ValueError("unknown correction: {0:s}, use one of {1:s}".format(method, ', '.join(METHODS)))
+    pvals = np.asarray(pvals, dtype=float)
+
+    if method == 'hierarchical':
+        corrected = hierarchical(pvals, np.zeros(len(pvals)) if groups is None else groups)
+    else:
+        corrected = adjust(pvals, method)
+
+    return corrected <= alpha, corrected
+
+
+def corrected_statistic(statistic, pvals, corrected_pvals, dist, **dist_params):
+    """
+    the statistic that goes with each corrected p-value, from the inverse cdf (ppf) of its distribution evaluated at
+    the corrected p-value. where the correction didn't change the p-value, the statistic is kept as is
+
+    :param statistic: array of the test statistics
+    :param pvals: array of p-values
+    :param corrected_pvals: array of corrected p-values
+    :param dist: scipy.stats distribution, e.g. scipy.stats.chi2
+    :param dist_params: arrays of the parameters of the distribution for each test, e.g. df=degrees of freedom
+    :return: array of corrected statistics
+    """
+
+    statistic = np.asarray(statistic, dtype=float)
+    pvals = np.asarray(pvals, dtype=float)
+    corrected_pvals = np.asarray(corrected_pvals, dtype=float)
+
+    return np.where(pvals == corrected_pvals, statistic, dist.ppf(corrected_pvals, **dist_params))
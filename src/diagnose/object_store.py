@@ -0,0 +1,240 @@
+"""
+content-addressed store for output files, so files that are identical between runs are only kept once.
+
+objects are stored by hash as <store_dir>/<algorithm>/<first 2 characters of hash>/<rest of hash>. run directories
+either keep a hardlink to the object in place of each file, or drop the file and keep only the entry in record.json
+(manifest mode, see restore_run). gc removes objects that no retained run refers to.
+
+usage:
+    python -m diagnose.object_store gc <store_dir> <run or output dir> [<run or output dir> ...]
+    python -m diagnose.object_store restore <store_dir> <run dir>
+
+:created: 2021
+:copyright: (c) 2021, GDA
+:license: see LICENSE for more details
+"""
+
+import os
+import glob
+import json
+import shutil
+import argparse
+
+STORE_MODES = ['hardlink', 'manifest']
+
+
+def object_path(store_dir, algorithm, hash_val):
+    """
+    path of an object in the store
+
+    :param store_dir: store directory
+    :param algorithm: hash algorithm, e.g. md5
+    :param hash_val: hash of the file
+    :return: path to the object
+    """
+
+    return os.path.join(store_dir, algorithm, hash_val[:2], hash_val[2:])
+
+
+def _replace_with_link(src, dst):
+    """
+    atomically replace dst with a hardlink to src
+
+    :param src: existing file
+    :param dst: file to replace
+    """
+
+    tmp_path = dst + '.tmp_link'
+    os.link(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def store_file(file_path, hash_val, store_dir, algorithm, mode='hardlink'):
+    """
+    add a file to the store. if an identical object is already stored the file is deduplicated against it
+
+    :param file_path: path to file
+    :param hash_val: hash of the file, e.g. from make_record.make_hashes_for_files
+    :param store_dir: store directory
+    :param algorithm: hash algorithm used for hash_val
+    :param mode: 'hardlink' to replace the file with a hardlink to the object, 'manifest' to remove the file
+    :return: path to the object
+    """
+
+    obj_path = object_path(store_dir, algorithm, hash_val)
+    os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+
+    if not os.path.exists(obj_path):
+        try:
+            os.link(file_path, obj_path)
+        except FileExistsError:
+            # stored by another run in the meantime
+            pass
+        except OSError:
+            # store is on another file system, copy it in
+            tmp_path = obj_path + '.tmp_copy'
+            shutil.copyfile(file_path, tmp_path)
+            os.replace(tmp_path, obj_path)
+        # objects are shared by runs, so they must not be edited through a run directory
+        os.chmod(obj_path, 0o444)
+
+    if mode == 'manifest':
+        os.remove(file_path)
+    elif not os.path.samefile(file_path, obj_path):
+        try:
+            _replace_with_link(obj_path, file_path)
+        except OSError as e:
+            print("keeping a copy of", file_path, e)
+
+    return obj_path
+
+
+def store_files(files, store_dir, algorithm, out_dir, mode='hardlink'):
+    """
+    add the output files of a run to the store
+
+    :param files: list of file records [{"name": path, "hash_<algorithm>": str}, ...]
+    :param store_dir: store directory
+    :param algorithm: hash algorithm of the records
+    :param out_dir: output directory of the run
+    :param mode: 'hardlink' or 'manifest', see store_file
+    :return: list of file records with the path relative to out_dir and how the file was stored added
+    """
+
+    if mode not in STORE_MODES:
+        raise ValueError("unknown store mode: {0:s}, use one of {1:s}".format(mode, ', '.join(STORE_MODES)))
+
+    for file in files:
+        store_file(file['name'], file['hash_' + algorithm], store_dir, algorithm, mode)
+        file['path'] = os.path.relpath(file['name'], out_dir)
+        file['stored'] = mode
+
+    return files
+
+
+def find_records(paths):
+    """
+    find the record.json of each run, paths can be run directories or directories containing runs
+
+    :param paths: list of directories
+    :return: list of paths to record.json files
+    """
+
+    records = list()
+    for path in paths:
+        record_path = os.path.join(path, 'record.json')
+        if os.path.exists(record_path):
+            records.append(record_path)
+        else:
+            records.extend(sorted(glob.glob(os.path.join(path, '*', 'record.json'))))
+
+    return records
+
+
+def referenced_objects(store_dir, record_paths):
+    """
+    objects in the store referred to by runs
+
+    :param store_dir: store directory
+    :param record_paths: list of paths to record.json files
+    :return: set of object paths
+    """
+
+    referenced = set()
+    for record_path in record_paths:
+        with open(record_path, 'r') as record_file:
+            record = json.load(record_file)
+        for file in record['files']:
+            for key, hash_val in file.items():
+                if key.startswith('hash_'):
+                    referenced.add(os.path.abspath(object_path(store_dir, key[len('hash_'):], hash_val)))
+
+    return referenced
+
+
+def gc(store_dir, run_paths, dry_run=False):
+    """
+    remove objects that are not referred to by any retained run
+
+    :param store_dir: store directory
+    :param run_paths: run directories (or directories containing runs) that are retained
+    :param dry_run: only report what would be removed
+    :return: list of removed objects
+    """
+
+    record_paths = find_records(run_paths)
+    print("found {0:d} retained runs".format(len(record_paths)))
+    referenced = referenced_objects(store_dir, record_paths)
+
+    removed = list()
+    for obj_path in glob.glob(os.path.join(store_dir, '*', '??', '*')):
+        if os.path.abspath(obj_path) not in referenced:
+            removed.append(obj_path)
+            if not dry_run:
+                os.remove(obj_path)
+
+    print("{0:s} {1:d} unreferenced objects".format("would remove" if dry_run else "removed", len(removed)))
+
+    return removed
+
+
+def restore_run(store_dir, run_dir):
+    """
+    put back the files of a run stored in manifest mode, as hardlinks to the objects (or copies if the store is on
+    another file system)
+
+    :param store_dir: store directory
+    :param run_dir: run directory with record.json
+    :return: list of restored files
+    """
+
+    with open(os.path.join(run_dir, 'record.json'), 'r') as record_file:
+        record = json.load(record_file)
+
+    restored = list()
+    for file in record['files']:
+        if 'path' not in file:
+            continue
+        file_path = os.path.join(run_dir, file['path'])
+        if os.path.exists(file_path):
+            continue
+        algorithm, hash_val = [(k[len('hash_'):], v) for k, v in file.items() if k.startswith('hash_')][0]
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        obj_path = object_path(store_dir, algorithm, hash_val)
+        try:
+            os.link(obj_path, file_path)
+        except OSError:
+            shutil.copyfile(obj_path, file_path)
+        restored.append(file_path)
+
+    return restored
+
+
+def main():
+    """
+    garbage collect the store or restore a run from it
+    """
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_gc = subparsers.add_parser('gc', help='remove objects no retained run refers to')
+    parser_gc.add_argument("store_dir", help="object store directory")
+    parser_gc.add_argument("run_dirs", help="retained run directories, or directories containing runs", nargs='+')
+    parser_gc.add_argument("--dry_run", help="only list the objects that would be removed", action="store_true")
+
+    parser_restore = subparsers.add_parser('restore', help='put back the files of a run stored in manifest mode')
+    parser_restore.add_argument("store_dir", help="object store directory")
+    parser_restore.add_argument("run_dir", help="run directory")
+
+    args = parser.parse_args()
+
+    if args.command == 'gc':
+        gc(args.store_dir, args.run_dirs, args.dry_run)
+    else:
+        restored = restore_run(args.store_dir, args.run_dir)
+        print("restored {0:d} files".format(len(restored)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""
+plotting helpers shared by the analyses
+
+:created: 2021
+:copyright: (c) 2021, GDA
+:license: see LICENSE for more details
+"""
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+
+
+class FigureCache(object):
+    """
+    figures kept by layout, so groups that are plotted with the same layout reuse the figure, its axes and the layout
+    computed for the first of them instead of building new ones. use it as a context manager so the figures are closed
+    even if plotting fails.
+    """
+
+    def __init__(self, max_figures=8):
+        """
+        :param max_figures: maximum number of figures kept open, the least recently used one is closed first
+        """
+        self.max_figures = max_figures
+        self.figures = OrderedDict()
+        self.laid_out = set()
+
+    def get(self, key, clear=True, **subplots_kwargs):
+        """
+        figure and axes for a layout, made with plt.subplots the first time the key is used
+
+        :param key: layout key, figures with the same key must be made with the same subplots_kwargs
+        :param clear: clear the axes of a reused figure. without clearing, the artists of the previous group are kept
+        so their data can be updated in place
+        :param subplots_kwargs: arguments for plt.subplots
+        :return: fig, axes (always a flat array), and whether the figure was reused
+        """
+
+        if key in self.figures:
+            self.figures.move_to_end(key)
+            fig, axes = self.figures[key]
+            if clear:
+                for ax in axes:
+                    ax.cla()
+                    if subplots_kwargs.get('sharex') or subplots_kwargs.get('sharey'):
+                        # clearing shows the labels again that plt.subplots hides on shared axes
+                        ax.label_outer()
+            return fig, axes, True
+
+        if len(self.figures) >= self.max_figures:
+            old_key, (old_fig, old_axes) = self.figures.popitem(last=False)
+            self.laid_out.discard(old_key)
+            plt.close(old_fig)
+
+        fig, axes = plt.subplots(squeeze=False, **subplots_kwargs)
+        axes = axes.ravel()
+        self.figures[key] = (fig, axes)
+
+        return fig, axes, False
+
+    def tight_layout(self, key, rect=None):
+        """
+        tight layout of the figure for key, only computed the first time. reused figures keep the subplot parameters
+        of the first layout
+
+        :param key: layout key
+        :param rect: rectangle for fig.tight_layout
+        """
+
+        if key not in self.laid_out:
+            self.figures[key][0].tight_layout(rect=rect)
+            self.laid_out.add(key)
+
+    def close(self):
+        """
+        close all figures
+        """
+
+        for fig, axes in self.figures.values():
+            plt.close(fig)
+        self.figures.clear()
+        self.laid_out.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PlotBudget(object):
+    """
+    budget for the plots of a run: at most top_k variables per group, taken in the order the analysis ranks them
+    (corrected p-value or |spearman|), and at most max_plots figures and max_seconds of plotting overall. plots that
+    don't fit are listed in skipped for the record.
+    """
+
+    def __init__(self, top_k=None, max_plots=None, max_seconds=None):
+        """
+        :param top_k: maximum number of variables plotted per group (None for all)
+        :param max_plots: maximum number of figures (None for no limit)
+        :param max_seconds: no new figure is started after this much time spent plotting (None for no limit)
+        """
+        self.top_k = top_k
+        self.max_plots = max_plots
+        self.max_seconds = max_seconds
+        self.num_plots = 0
+        self.seconds = 0.0
+        self.skipped = list()
+
+    def _skip(self, section, group_col, group, variables, reason):
+        for var in variables:
+            self.skipped.append({'analysis': section, 'group_col': group_col, 'group': group, 'variable': var,
+                                 'reason': reason})
+
+    def order_groups(self, results_df, rank_col, ascending=True):
+        """
+        groups ordered by their best ranked variable, so the most interesting groups are plotted before the budget
+        runs out
+
+        :param results_df: results with a group column
+        :param rank_col: column the variables are ranked by, e.g. var_kw_pval_corrected
+        :param ascending: True if lower values rank higher (p-values), False otherwise (|spearman|)
+        :return: list of groups
+        """
+
+        best = results_df.groupby('group', sort=False)[rank_col]
+        best = best.min() if ascending else best.max()
+
+        return list(best.sort_values(ascending=ascending, kind='mergesort').index)
+
+    def select(self, section, group_col, group, variables, top_k=None):
+        """
+        variables of a group to plot, the ones after the top_k are skipped
+
+        :param section: analysis, e.g. avcat
+        :param group_col: column the data is grouped by
+        :param group: group
+        :param variables: variables of the group, ranked most interesting first
+        :param top_k: number of variables to keep if the budget has no top_k
+        :return: list of variables to plot
+        """
+
+        variables = list(variables)
+        top_k = self.top_k if self.top_k is not None else top_k
+        if top_k is not None and len(variables) > top_k:
+            self._skip(section, group_col, group, variables[top_k:], 'top_k')
+            variables = variables[:top_k]
+
+        return variables
+
+    def allow(self, section, group_col, group, variables):
+        """
+        whether there is budget left for another figure, if not its variables are skipped
+
+        :param section: analysis, e.g. avcat
+        :param group_col: column the data is grouped by
+        :param group: group
+        :param variables: variables in the figure
+        :return: True if the figure can be plotted
+        """
+
+        if self.max_plots is not None and self.num_plots >= self.max_plots:
+            self._skip(section, group_col, group, variables, 'max_plots')
+            return False
+        if self.max_seconds is not None and self.seconds >= self.max_seconds:
+            self._skip(section, group_col, group, variables, 'max_seconds')
+            return False
+
+        return True
+
+    @contextmanager
+    def timed(self):
+        """
+        count a figure and the time spent on it against the budget
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.num_plots += 1
+            self.seconds += time.perf_counter() - start
+
+
+def compute_box_stats(data_df, score_col, variables, max_outliers=50, whis=1.5, seed=0):
+    """
+    Compute the boxplot statistics of the score for every value of every variable in one grouped pass, so plotting
+    doesn't depend on the number of samples. Quartiles and whiskers are computed the same way as matplotlib's boxplot.
+
+    :param data_df: dataframe
+    :param score_col: the score column
+    :param variables: list of variables (columns) to split the score by
+    :param max_outliers: maximum number of outliers kept per box (a random sample of them)
+    :param whis: whiskers extend to the furthest sample within whis * IQR of the box
+    :param seed: seed for sampling the outliers
+    :return: dictionary with, for each variable, the list of stats of each value (sorted by median, highest first) in
+    the format of matplotlib's Axes.bxp. the key None has the stats of the whole distribution.
+    """
+
+    scores = data_df[score_col].astype('float').values
+    keep = ~np.isnan(scores)
+    scores = scores[keep]
+    n = len(scores)
+
+    # long format: one row per sample per variable, the whole distribution is variable None
+    long_df = pd.DataFrame({'variable': np.repeat(np.arange(len(variables) + 1), n),
+                            'value': np.concatenate([np.full(n, '')] +
+                                                    [data_df[var].values[keep].astype(str) for var in variables]),
+                            'score': np.tile(scores, len(variables) + 1)})
+
+    grouped = long_df.groupby(['variable', 'value'])['score']
+    group_id = grouped.ngroup().values
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    counts = grouped.size()
+    q1, med, q3 = [quartiles[q].values for q in [0.25, 0.5, 0.75]]
+
+    iqr = q3 - q1
+    inside = (long_df['score'].values >= (q1 - whis * iqr)[group_id]) & \
+             (long_df['score'].values <= (q3 + whis * iqr)[group_id])
+    whiskers = long_df[inside].groupby(group_id[inside])['score'].agg(['min', 'max'])
+
+    # random sample of at most max_outliers outliers per box
+    rng = np.random.default_rng(seed)
+    outliers_df = long_df[~inside].assign(group_id=group_id[~inside])
+    outliers_df = outliers_df.iloc[rng.permutation(len(outliers_df))]
+    outliers_df = outliers_df[outliers_df.groupby('group_id').cumcount() < max_outliers]
+    # the outliers of each box, split from the scores sorted by box (keeping the random order within a box)
+    outliers_df = outliers_df.sort_values('group_id', kind='stable')
+    box_ids, starts = np.unique(outliers_df['group_id'].values, return_index=True)
+    outliers = dict(zip(box_ids, np.split(outliers_df['score'].values, starts[1:])))
+
+    box_stats = {None: []}
+    for var in variables:
+        box_stats[var] = []
+    for i, (var_i, value) in enumerate(quartiles.index):
+        var = None if var_i == 0 else variables[var_i - 1]
+        box_stats[var].append({'label': value,
+                               'med': med[i], 'q1': q1[i], 'q3': q3[i],
+                               'whislo': whiskers['min'].get(i, q1[i]), 'whishi': whiskers['max'].get(i, q3[i]),
+                               'fliers': outliers.get(i, np.array([])),
+                               'count': counts.iloc[i]})
+
+    for var in variables:
+        box_stats[var].sort(key=lambda x: x['med'], reverse=True)
+
+    return box_stats
+
+
+def draw_box_stats(ax, stats, palette):
+    """
+    draw horizontal boxplots from precomputed statistics, first box on top
+
+    :param ax: matplotlib axes
+    :param stats: list of stats from compute_box_stats
+    :param palette: list of colors, used in order for the boxes
+    """
+
+    if len(stats) == 0:
+        return
+
+    positions = np.arange(len(stats))[::-1]
+    artists = ax.bxp(stats, positions=positions, vert=False, widths=0.8, patch_artist=True,
+                     medianprops={'color': '0.25'}, flierprops={'marker': 'd', 'markersize': 4,
+                                                                 'markerfacecolor': '0.25', 'markeredgecolor': '0.25'})
+    for i, box in enumerate(artists['boxes']):
+        box.set_facecolor(palette[i % len(palette)])
+        box.set_edgecolor('0.25')
+
+    ax.set_yticks(positions)
+    ax.set_yticklabels([x['label'] for x in stats])
+    ax.set_ylim(-0.5, len(stats) - 0.5)
+
+
+def compute_density(x, y, bins=60):
+    """
+    bin samples into a 2-D histogram, for plotting groups with too many samples for a scatter plot
+
+    :param x: array of x values
+    :param y: array of y values
+    :param bins: number of bins along each axis
+    :return: dictionary with the counts (x bins by y bins), the x bin edges and the y bin edges
+    """
+
+    keep = ~(np.isnan(x) | np.isnan(y))
+    counts, x_edges, y_edges = np.histogram2d(x[keep], y[keep], bins=bins)
+
+    return {'counts': counts, 'x_edges': x_edges, 'y_edges': y_edges}
+
+
+def draw_density(ax, density, cmap='viridis'):
+    """
+    draw a 2-D histogram from compute_density, empty bins are left blank and counts use a log color scale
+
+    :param ax: matplotlib axes
+    :param density: dictionary from compute_density
+    :param cmap: color map
+    """
+
+    counts = np.ma.masked_equal(density['counts'].T, 0)
+    if counts.count() == 0:
+        return
+    ax.pcolormesh(density['x_edges'], density['y_edges'], counts, cmap=cmap,
+                  norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)))
@@ -7,8 +7,15 @@ File needed so pip install works properly
 :license: see LICENSE for more details
 """
 
-import numpy as np
 import itertools
+from concurrent.futures import ProcessPoolExecutor
+import json
+import numpy as np
+import pandas as pd
+from scipy import stats
+import diagnose.rank_tests as rt
+import diagnose.multiple_testing as mt
+import diagnose.analysis_for_dep as dep
 
 
 def check_varying_categories(df):
@@ -35,23 +42,746 @@ def get_num_replicates(df):
     return df.groupby(df.columns.tolist(), as_index=False).size()
 
 
-def get_covered_combinations(df):
+def summarize_replicates(replicates, min_replicates=2, max_listed=1000):
+    """
+    Compact summary of the number of replicates per combination of covariates, small enough to report for large
+    designs
+
+    :param replicates: dataframe from get_num_replicates, the covariates and a 'size' column
+    :param min_replicates: combinations with fewer replicates than this are reported as under-replicated
+    :param max_listed: maximum number of under-replicated combinations to list
+    :return: dictionary with
+        - the histogram of the number of replicates (number of replicates: number of combinations)
+        - the under-replicated combinations (at most max_listed)
+        - per variable, the number of samples, number of combinations and fewest replicates for each value
+    """
+
+    cols = [c for c in replicates.columns if c != 'size']
+    sizes = replicates['size']
+
+    histogram = sizes.value_counts().sort_index()
+
+    under_df = replicates[sizes < min_replicates].sort_values(by='size')
+    under_list = [{'combination': [str(x) for x in row[:-1]], 'num_replicates': int(row[-1])}
+                  for row in under_df[cols + ['size']].head(max_listed).itertuples(index=False)]
+
+    marginals = {}
+    for col in cols:
+        grouped = replicates.groupby(col)['size'].agg(['sum', 'count', 'min'])
+        marginals[col] = {str(level): {'num_samples': int(row['sum']),
+                                       'num_combos': int(row['count']),
+                                       'min_replicates': int(row['min'])}
+                          for level, row in grouped.iterrows()}
+
+    return {'num_combos_observed': len(replicates),
+            'min_replicates': int(sizes.min()) if len(sizes) else 0,
+            'median_replicates': float(sizes.median()) if len(sizes) else 0,
+            'max_replicates': int(sizes.max()) if len(sizes) else 0,
+            'replicate_count_histogram': {str(k): int(v) for k, v in histogram.items()},
+            'under_replicated_threshold': min_replicates,
+            'num_under_replicated_combos': len(under_df),
+            'under_replicated_combos': under_list,
+            'marginals': marginals}
+
+
+def write_replicates_table(replicates, out_path, chunk_size=100000):
+    """
+    Write the number of replicates per combination of covariates to a tsv a chunk of rows at a time
+
+    :param replicates: dataframe from get_num_replicates
+    :param out_path: path to the tsv
+    :param chunk_size: number of rows written at a time
+    :return: out_path: where the file was saved to
+    """
+
+    print("saving to: " + out_path)
+    with open(out_path, 'w') as out_file:
+        out_file.write('\t'.join(str(c) for c in replicates.columns) + '\n')
+        for start in range(0, len(replicates), chunk_size):
+            replicates.iloc[start:start + chunk_size].to_csv(out_file, sep='\t', header=False, index=False)
+
+    return out_path
+
+
+def encode_levels(df):
+    """
+    integer-code the levels of each column so combinations can be handled as arrays instead of lists of labels
+
+    :param df: experimental setup dataframe
+    :return:
+        - codes: array (rows x columns) with the level code of each value, codes are in order of first appearance
+        - levels: list with the array of level labels for each column
+    """
+
+    codes = np.empty(df.shape, dtype=np.int64)
+    levels = []
+    for i, col in enumerate(df.columns):
+        # missing values are treated as their own level, the same way the analyses fill them with 'NAN'
+        col_codes, col_levels = pd.factorize(df[col].fillna('NAN'))
+        codes[:, i] = col_codes
+        levels.append(np.asarray(col_levels))
+
+    return codes, levels
+
+
+def encode_combinations(codes, radices):
+    """
+    mixed-radix encode each row of level codes into a single integer, i.e. the position of the combination in
+    itertools.product of the levels of each column
+
+    :param codes: array (rows x columns) of level codes
+    :param radices: number of levels in each column
+    :return: array with one integer per row (python ints in an object array if the number of possible combinations
+    does not fit in 64 bits)
+    """
+
+    if _num_possible(radices) < np.iinfo(np.int64).max:
+        encoded = np.zeros(codes.shape[0], dtype=np.int64)
+        for i, radix in enumerate(radices):
+            encoded = encoded * radix + codes[:, i]
+    else:
+        encoded = np.zeros(codes.shape[0], dtype=object)
+        for i, radix in enumerate(radices):
+            encoded = encoded * int(radix) + codes[:, i].astype(object)
+
+    return encoded
+
+
+def decode_combination(encoded, radices):
+    """
+    inverse of encode_combinations for a single combination
+
+    :param encoded: integer code of a combination
+    :param radices: number of levels in each column
+    :return: tuple with the level code of each column
+    """
+
+    encoded = int(encoded)
+    comb = []
+    for radix in reversed(radices):
+        encoded, code = divmod(encoded, int(radix))
+        comb.append(code)
+
+    return tuple(reversed(comb))
+
+
+def _num_possible(radices):
+    """
+    number of possible combinations of levels, as an exact python int
+
+    :param radices: number of levels in each column
+    :return: product of the radices
+    """
+
+    n = 1
+    for radix in radices:
+        n *= int(radix)
+    return n
+
+
+def get_unique_combinations(df):
+    """
+    get the distinct combinations of variables that appear in the experimental setup as sorted integer codes
+
+    :param df: experimental setup dataframe
+    :return:
+        - covered: sorted list of the mixed-radix codes of the observed combinations
+        - levels: list with the array of level labels for each column
+    """
+
+    codes, levels = encode_levels(df)
+    encoded = encode_combinations(codes, [len(x) for x in levels])
+    if encoded.dtype == object:
+        covered = sorted(set(encoded.tolist()))
+    else:
+        covered = np.unique(encoded).tolist()
+
+    return covered, levels
+
+
+def iter_missing_combinations(df, max_missing=None):
+    """
+    lazily generate the combinations of variables that do not appear in the experimental setup, in the same order as
+    itertools.product of the levels of each column
+
+    :param df: experimental setup dataframe
+    :param max_missing: stop after this many missing combinations (None for no limit)
+    :return: generator of tuples of level labels
+    """
+
+    covered, levels = get_unique_combinations(df)
+
+    return _iter_missing(covered, levels, max_missing)
+
+
+def _iter_missing(covered, levels, max_missing=None):
+    """
+    lazily generate the combinations of levels whose mixed-radix codes are not in covered
+
+    :param covered: sorted list of the codes of the observed combinations
+    :param levels: list with the array of level labels for each column
+    :param max_missing: stop after this many missing combinations (None for no limit)
+    :return: generator of tuples of level labels
+    """
+
+    radices = [len(x) for x in levels]
+    n_possible = _num_possible(radices)
+
+    num_yielded = 0
+    pos = 0
+    candidate = 0
+    while candidate < n_possible:
+        if max_missing is not None and num_yielded >= max_missing:
+            return
+        if pos < len(covered) and covered[pos] == candidate:
+            pos += 1
+        else:
+            comb = decode_combination(candidate, radices)
+            yield tuple(levels[i][c] for i, c in enumerate(comb))
+            num_yielded += 1
+        candidate += 1
+
+
+def count_covered_combinations(df, combinations=None):
+    """
+    count the distinct combinations of variables that appear in the experimental setup
+
+    :param df: experimental setup dataframe
+    :param combinations: (covered, levels) from get_unique_combinations of df, encoded here if None
+    :return:
+        - number of distinct combinations covered
+        - number of possible combinations
+    """
+
+    if combinations is None:
+        combinations = get_unique_combinations(df)
+    covered, levels = combinations
+
+    return len(covered), _num_possible([len(x) for x in levels])
+
+
+def get_covered_combinations(df, max_missing=1000, combinations=None):
     """
     Checking Covered vs. missing combinations of variables
 
     :param df: experimental setup dataframe
-    :return: percentage of combinations covered and which combinations are not covered
+    :param max_missing: maximum number of missing combinations to report (None for no limit)
+    :param combinations: (covered, levels) from get_unique_combinations of df, encoded here if None
+    :return: percentage of combinations covered and which combinations are not covered (at most max_missing)
+    """
+
+    if combinations is None:
+        combinations = get_unique_combinations(df)
+    num_covered, num_possible = count_covered_combinations(df, combinations)
+
+    if num_covered == num_possible:
+        return 1, []
+    else:
+        missing = list(_iter_missing(*combinations, max_missing))
+        return num_covered / num_possible, missing
+
+
+def _subset_counts(codes, radices, subsets):
+    """
+    count how often each combination of levels appears for every subset of columns in one bincount
+
+    :param codes: array (rows x columns) of level codes
+    :param radices: array with the number of levels in each column
+    :param subsets: array (subsets x t) of column indices
+    :return: list with the array of counts per combination for each subset, in mixed-radix order
+    """
+
+    sizes = np.prod(radices[subsets], axis=1)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+
+    # encode every subset at once, shifting each subset into its own range of bins
+    encoded = np.zeros((codes.shape[0], len(subsets)), dtype=np.int64)
+    for j in range(subsets.shape[1]):
+        encoded = encoded * radices[subsets[:, j]] + codes[:, subsets[:, j]]
+    counts = np.bincount((encoded + offsets[:-1]).ravel(), minlength=offsets[-1])
+
+    return [counts[offsets[i]:offsets[i + 1]] for i in range(len(subsets))]
+
+
+def _t_wise_chunk(codes, radices, subsets, max_missing):
+    """
+    coverage of a chunk of column subsets, run in a worker process for wide metadata
+
+    :param codes: array (rows x columns) of level codes
+    :param radices: array with the number of levels in each column
+    :param subsets: array (subsets x t) of column indices
+    :param max_missing: maximum number of missing combinations to keep per subset
+    :return: list of (number covered, number possible, codes of the first max_missing missing combinations)
+    """
+
+    results = []
+    for counts in _subset_counts(codes, radices, subsets):
+        missing = np.flatnonzero(counts == 0)
+        results.append((int(np.count_nonzero(counts)), len(counts), missing[:max_missing]))
+
+    return results
+
+
+def get_t_wise_coverage(df, t=2, max_missing=100, n_jobs=1, max_chunk_elements=2 ** 24):
+    """
+    Checking covered vs. missing combinations of levels for every subset of t variables, e.g. t=2 for pairwise
+    coverage
+
+    :param df: experimental setup dataframe
+    :param t: size of the subsets of variables
+    :param max_missing: maximum number of missing combinations to report per subset
+    :param n_jobs: number of processes to spread the subsets over
+    :param max_chunk_elements: maximum size of the (rows x subsets) code array built at once
+    :return: list of records with the variables, proportion of combinations covered and missing combinations for each
+    subset
+    """
+
+    codes, levels = encode_levels(df)
+    radices = np.array([len(x) for x in levels], dtype=np.int64)
+    subsets = np.array(list(itertools.combinations(range(codes.shape[1]), t)), dtype=np.int64)
+    if len(subsets) == 0:
+        return []
+
+    chunk_size = max(1, max_chunk_elements // max(1, codes.shape[0]))
+    chunks = [subsets[i:i + chunk_size] for i in range(0, len(subsets), chunk_size)]
+
+    if n_jobs is not None and n_jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            chunk_results = list(executor.map(_t_wise_chunk, itertools.repeat(codes), itertools.repeat(radices),
+                                              chunks, itertools.repeat(max_missing)))
+    else:
+        chunk_results = [_t_wise_chunk(codes, radices, chunk, max_missing) for chunk in chunks]
+
+    results = []
+    for subset, (num_covered, num_possible, missing) in zip(subsets, itertools.chain(*chunk_results)):
+        missing_combos = []
+        for m in missing:
+            comb = decode_combination(m, radices[subset])
+            missing_combos.append([levels[col][c] for col, c in zip(subset, comb)])
+        results.append({'variables': [df.columns[col] for col in subset],
+                        'prop_combos_covered': num_covered / num_possible,
+                        'num_poss_combos': num_possible,
+                        'num_missing_combos': num_possible - num_covered,
+                        'missing_combos': missing_combos})
+
+    return results
+
+
+def suggest_design_completion(df, t=2, n_candidates=10, max_runs=None, seed=0):
+    """
+    Greedily propose additional runs so that every combination of levels for every subset of t variables is covered
+    (a covering array built on top of the existing design). Each new run starts from a missing combination in the
+    subset with the most missing combinations, and the remaining variables are filled in one at a time with the level
+    that covers the most missing combinations; the best of n_candidates randomized runs is kept.
+
+    :param df: experimental setup dataframe
+    :param t: size of the subsets of variables to cover, e.g. 2 for pairwise
+    :param n_candidates: number of candidate runs to build for each run proposed
+    :param max_runs: stop after proposing this many runs (None for no limit)
+    :param seed: seed for the random order variables are filled in
+    :return: dataframe with the proposed runs, with the same columns as df
+    """
+
+    codes, levels = encode_levels(df)
+    radices = np.array([len(x) for x in levels], dtype=np.int64)
+    n_cols = codes.shape[1]
+    t = min(t, n_cols)
+
+    subsets = np.array(list(itertools.combinations(range(n_cols), t)), dtype=np.int64)
+    counts = _subset_counts(codes, radices, subsets)
+    offsets = np.concatenate([[0], np.cumsum([len(x) for x in counts])])
+    uncovered = np.concatenate(counts) == 0
+
+    # multiplier of each position in the mixed-radix code of each subset
+    weights = np.ones_like(subsets)
+    for j in range(t - 2, -1, -1):
+        weights[:, j] = weights[:, j + 1] * radices[subsets[:, j + 1]]
+    col_subsets = [np.flatnonzero((subsets == c).any(axis=1)) for c in range(n_cols)]
+
+    rng = np.random.default_rng(seed)
+    new_runs = []
+    while uncovered.any() and (max_runs is None or len(new_runs) < max_runs):
+        per_subset = np.add.reduceat(uncovered, offsets[:-1])
+        s = np.argmax(per_subset)
+        start_code = np.flatnonzero(uncovered[offsets[s]:offsets[s + 1]])[0]
+        start_levels = decode_combination(start_code, radices[subsets[s]])
+
+        best_run, best_codes, best_gain = None, None, -1
+        for _ in range(n_candidates):
+            run = np.full(n_cols, -1, dtype=np.int64)
+            run[subsets[s]] = start_levels
+
+            for c in rng.permutation(n_cols):
+                if run[c] >= 0:
+                    continue
+
+                # subsets with c where every other variable is already set
+                idx = col_subsets[c]
+                sub = subsets[idx]
+                idx = idx[((run[sub] >= 0) | (sub == c)).all(axis=1)]
+                if len(idx) == 0:
+                    run[c] = rng.integers(radices[c])
+                    continue
+
+                sub = subsets[idx]
+                w = weights[idx]
+                base = offsets[idx] + (np.where(sub == c, 0, run[sub]) * w).sum(axis=1)
+                candidates = base[:, None] + w[sub == c][:, None] * np.arange(radices[c])[None, :]
+                gain = uncovered[candidates].sum(axis=0)
+                run[c] = rng.choice(np.flatnonzero(gain == gain.max()))
+
+            run_codes = offsets[:-1] + (run[subsets] * weights).sum(axis=1)
+            gain = np.count_nonzero(uncovered[run_codes])
+            if gain > best_gain:
+                best_run, best_codes, best_gain = run, run_codes, gain
+
+        uncovered[best_codes] = False
+        new_runs.append(best_run)
+
+    return pd.DataFrame([[levels[i][c] for i, c in enumerate(run)] for run in new_runs], columns=df.columns)
+
+
+def _simulate_power_batch(codes, radices, level_effects, n_sim, alpha, seed):
+    """
+    simulate scores for a batch of experiments and run the Kruskal-Wallis test on every variable
+
+    :param codes: array (rows x tested variables) of level codes
+    :param radices: number of levels of each tested variable
+    :param level_effects: list with the array of effects on the score of each level, for each tested variable
+    :param n_sim: number of simulated experiments in the batch
+    :param alpha: threshold for the p-values
+    :param seed: seed sequence for the batch
+    :return:
+        - number of simulations where each variable is significant after FDR correction
+        - number of simulations where each variable is significant without correction
+    """
+
+    rng = np.random.default_rng(seed)
+    n = codes.shape[0]
+
+    mean_score = np.zeros(n)
+    for i, effects in enumerate(level_effects):
+        mean_score += effects[codes[:, i]]
+    scores = mean_score[None, :] + rng.standard_normal((n_sim, n))
+
+    ranks = rt.rank_rows(scores)
+    pvals = np.column_stack([rt.kruskal_pval(rt.kruskal_h(ranks, codes[:, i], radix), radix)
+                             for i, radix in enumerate(radices)])
+
+    return (mt.adjust(pvals, 'fdr_bh') <= alpha).sum(axis=0), (pvals < alpha).sum(axis=0)
+
+
+def estimate_power(df, effect_sizes, n_sim=1000, alpha=0.05, batch_size=250, n_jobs=1, seed=0):
     """
+    Monte Carlo estimate of the power of the Kruskal-Wallis test run by analysis_var_cat to detect an effect of each
+    variable with the proposed design. Scores are simulated as the sum of the level effects of every variable plus
+    standard normal noise, the effect size of a variable is the difference between the means of its highest and lowest
+    levels in units of the noise standard deviation (levels are spaced evenly in between). The p-values are corrected
+    with Benjamini & Hochberg across the variables, as in analysis_var_cat.
 
-    if np.prod(df.nunique()) == len(df.drop_duplicates()):
-        return 1, None
+    :param df: experimental setup dataframe, one row per planned sample
+    :param effect_sizes: dictionary of variable: effect size, variables that are not listed have no effect
+    :param n_sim: number of simulated experiments
+    :param alpha: threshold for the corrected p-values
+    :param batch_size: number of experiments simulated at once
+    :param n_jobs: number of processes to spread the batches over
+    :param seed: seed for the simulations, results do not depend on n_jobs
+    :return: dataframe with the effect size, number of levels and power (corrected and uncorrected) for each variable
+    """
+
+    codes, levels = encode_levels(df)
+    radices = np.array([len(x) for x in levels])
+
+    # a variable that doesn't vary can't be tested
+    tested = np.flatnonzero(radices >= 2)
+    codes = codes[:, tested]
+    radices = radices[tested]
+    variables = [df.columns[i] for i in tested]
+    level_effects = [effect_sizes.get(var, 0) * np.linspace(-0.5, 0.5, radix) for var, radix in zip(variables, radices)]
+
+    batch_sims = [min(batch_size, n_sim - i) for i in range(0, n_sim, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sims))
+    batch_args = [(codes, radices, level_effects, b, alpha, s) for b, s in zip(batch_sims, seeds)]
+
+    if n_jobs is not None and n_jobs > 1 and len(batch_args) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            batch_results = list(executor.map(_simulate_power_batch, *zip(*batch_args)))
     else:
-        unique_col_vals = []
-        for col in df.columns:
-            unique_col_vals.append(df[col].unique())
-
-        missing = []
-        for comb in list(itertools.product(*unique_col_vals)):
-            if list(comb) not in df.values.tolist():
-                missing.append(comb)
-        return 1 - len(missing)/len(list(itertools.product(*unique_col_vals))), missing
+        batch_results = [_simulate_power_batch(*args) for args in batch_args]
+
+    num_reject = sum(x[0] for x in batch_results)
+    num_reject_uncorrected = sum(x[1] for x in batch_results)
+
+    return pd.DataFrame({'variable': variables,
+                         'effect_size': [effect_sizes.get(var, 0) for var in variables],
+                         'num_levels': radices,
+                         'power': num_reject / n_sim,
+                         'power_uncorrected': num_reject_uncorrected / n_sim})
+
+
+def rows_digest(df, start=0, digest=None):
+    """
+    order sensitive digest of the index and values of the rows of a dataframe, the digest of more rows is the digest
+    of the earlier rows updated with the new ones, so it can be kept up to date incrementally
+
+    :param df: dataframe with the rows to add
+    :param start: position of the first row of df in the full dataframe
+    :param digest: digest of the rows before start (None if start is 0)
+    :return: digest, as a hex string
+    """
+
+    row_hashes = pd.util.hash_pandas_object(df, index=True).values
+    positions = pd.util.hash_array(np.arange(start, start + len(df), dtype=np.uint64))
+    total = np.uint64(0 if digest is None else int(digest, 16))
+    with np.errstate(over='ignore'):
+        total += pd.util.hash_array(row_hashes ^ positions).sum(dtype=np.uint64)
+
+    return '{0:016x}'.format(int(total))
+
+
+def new_preflight_state(columns):
+    """
+    empty state for an incremental preflight check, see update_preflight_state
+
+    :param columns: variables in the experimental setup dataframe
+    :return: state: dictionary with
+        - columns: the variables
+        - num_rows, digest: how many samples have been added, and the digest of their index and values
+        - levels: for each variable, the list of values in order of first appearance
+        - combination_counts: number of samples for each combination of level codes
+        - contingency: for each pair of variables, the table of the number of samples for each pair of level codes
+    """
+
+    return {'columns': list(columns),
+            'num_rows': 0,
+            'digest': rows_digest(pd.DataFrame(columns=columns)),
+            'levels': {col: [] for col in columns},
+            'combination_counts': {},
+            'contingency': {pair: np.zeros((0, 0), dtype=np.int64) for pair in itertools.combinations(columns, 2)}}
+
+
+def update_preflight_state(state, df):
+    """
+    add new samples to the state of an incremental preflight check, the work done is proportional to the number of
+    new samples
+
+    :param state: state from new_preflight_state or load_preflight_state, updated in place
+    :param df: experimental setup dataframe with only the new samples
+    :return: state
+    """
+
+    columns = state['columns']
+    codes = np.empty((len(df), len(columns)), dtype=np.int64)
+    for i, col in enumerate(columns):
+        col_levels = state['levels'][col]
+        lookup = {x: k for k, x in enumerate(col_levels)}
+        values = df[col].fillna('NAN')
+        for x in pd.unique(values):
+            if x not in lookup:
+                lookup[x] = len(col_levels)
+                col_levels.append(x)
+        codes[:, i] = values.map(lookup).values
+
+    radices = [len(state['levels'][col]) for col in columns]
+
+    # the counts are keyed by level codes, so they don't change when new levels show up
+    encoded, counts = np.unique(encode_combinations(codes, radices), return_counts=True)
+    for code, count in zip(encoded, counts):
+        comb = decode_combination(code, radices)
+        state['combination_counts'][comb] = state['combination_counts'].get(comb, 0) + int(count)
+
+    for (i, col_1), (j, col_2) in itertools.combinations(enumerate(columns), 2):
+        table = np.bincount(codes[:, i] * radices[j] + codes[:, j],
+                            minlength=radices[i] * radices[j]).reshape(radices[i], radices[j])
+        old_table = state['contingency'][(col_1, col_2)]
+        table[:old_table.shape[0], :old_table.shape[1]] += old_table
+        state['contingency'][(col_1, col_2)] = table
+
+    state['digest'] = rows_digest(df[columns], state['num_rows'], state['digest'])
+    state['num_rows'] += len(df)
+
+    return state
+
+
+def save_preflight_state(state, out_path):
+    """
+    save the state of an incremental preflight check to a json file
+
+    :param state: state from update_preflight_state
+    :param out_path: path to the json file
+    :return: out_path: where the file was saved to
+    """
+
+    state_json = {'columns': state['columns'],
+                  'num_rows': state['num_rows'],
+                  'digest': state['digest'],
+                  'levels': state['levels'],
+                  'combination_counts': [list(k) + [v] for k, v in state['combination_counts'].items()],
+                  'contingency': [{'cat_var_1': k[0], 'cat_var_2': k[1], 'counts': v.tolist()}
+                                  for k, v in state['contingency'].items()]}
+
+    print("saving to: " + out_path)
+    with open(out_path, 'w') as out_file:
+        json.dump(state_json, out_file)
+
+    return out_path
+
+
+def load_preflight_state(state_path):
+    """
+    load the state of an incremental preflight check saved by save_preflight_state
+
+    :param state_path: path to the json file
+    :return: state
+    """
+
+    with open(state_path, 'r') as state_file:
+        state_json = json.load(state_file)
+
+    state = new_preflight_state(state_json['columns'])
+    state['num_rows'] = state_json['num_rows']
+    # states saved without a digest never match, so they are rebuilt
+    state['digest'] = state_json.get('digest')
+    state['levels'] = state_json['levels']
+    state['combination_counts'] = {tuple(x[:-1]): x[-1] for x in state_json['combination_counts']}
+    for x in state_json['contingency']:
+        counts = np.array(x['counts'], dtype=np.int64).reshape(len(state['levels'][x['cat_var_1']]),
+                                                               len(state['levels'][x['cat_var_2']]))
+        state['contingency'][(x['cat_var_1'], x['cat_var_2'])] = counts
+
+    return state
+
+
+def state_matches(state, df):
+    """
+    check that the samples already in the state are the first samples of df (same index and values, in the same
+    order), i.e. new samples have only been appended
+
+    :param state: state from load_preflight_state
+    :param df: full experimental setup dataframe
+    :return: True if the state can be updated with the remaining samples of df
+    """
+
+    if state['columns'] != list(df.columns) or state['num_rows'] > len(df):
+        return False
+
+    return rows_digest(df.iloc[:state['num_rows']]) == state['digest']
+
+
+def state_varying_categories(state):
+    """
+    check_varying_categories from the state of an incremental preflight check
+
+    :param state: state from update_preflight_state
+    :return:
+        - number of unique values in each column
+        - which columns have non-varying categories
+    """
+
+    nunique = pd.Series({col: len([x for x in state['levels'][col] if x != 'NAN']) for col in state['columns']})
+
+    return nunique, list(nunique[nunique.values == 1].index)
+
+
+def state_num_replicates(state):
+    """
+    get_num_replicates from the state of an incremental preflight check, combinations with a missing value are left
+    out as in the groupby of get_num_replicates
+
+    :param state: state from update_preflight_state
+    :return: number of replicates per combination of covariates
+    """
+
+    columns = state['columns']
+    missing = [state['levels'][col].index('NAN') if 'NAN' in state['levels'][col] else -1 for col in columns]
+    combs = [comb for comb in state['combination_counts'] if all(c != m for c, m in zip(comb, missing))]
+    replicates = pd.DataFrame([[state['levels'][col][c] for col, c in zip(columns, comb)] for comb in combs],
+                              columns=columns)
+    replicates['size'] = [state['combination_counts'][comb] for comb in combs]
+
+    return replicates.sort_values(by=columns).reset_index(drop=True)
+
+
+def state_covered_combinations(state, max_missing=1000):
+    """
+    get_covered_combinations from the state of an incremental preflight check
+
+    :param state: state from update_preflight_state
+    :param max_missing: maximum number of missing combinations to report (None for no limit)
+    :return:
+        - percentage of combinations covered
+        - which combinations are not covered (at most max_missing)
+        - number of possible combinations
+        - number of missing combinations
+    """
+
+    levels = [state['levels'][col] for col in state['columns']]
+    radices = [len(x) for x in levels]
+    num_possible = _num_possible(radices)
+    num_covered = len(state['combination_counts'])
+
+    if num_covered == num_possible:
+        return 1, [], num_possible, 0
+
+    combs = np.array(list(state['combination_counts'].keys()), dtype=np.int64).reshape(-1, len(radices))
+    covered = sorted(set(encode_combinations(combs, radices).tolist()))
+    missing = list(_iter_missing(covered, levels, max_missing))
+
+    return num_covered / num_possible, missing, num_possible, num_possible - num_covered
+
+
+def state_pairwise_coverage(state, max_missing=100):
+    """
+    get_t_wise_coverage for t=2 from the contingency tables in the state of an incremental preflight check
+
+    :param state: state from update_preflight_state
+    :param max_missing: maximum number of missing combinations to report per pair
+    :return: list of records with the variables, proportion of combinations covered and missing combinations for each
+    pair of variables
+    """
+
+    results = []
+    for (col_1, col_2), table in state['contingency'].items():
+        missing = np.flatnonzero(table.ravel() == 0)
+        results.append({'variables': [col_1, col_2],
+                        'prop_combos_covered': 1 - len(missing) / table.size,
+                        'num_poss_combos': table.size,
+                        'num_missing_combos': len(missing),
+                        'missing_combos': [[state['levels'][col_1][m // table.shape[1]],
+                                            state['levels'][col_2][m % table.shape[1]]]
+                                           for m in missing[:max_missing]]})
+
+    return results
+
+
+def state_chi2_test(state, mc_replicates=10000, n_jobs=1):
+    """
+    chi^2 test for independence (as analysis_for_dep.chi2_test) from the contingency tables in the state of an
+    incremental preflight check
+
+    :param state: state from update_preflight_state
+    :param mc_replicates: number of random tables for the monte carlo exact tests, 0 to always use the chi^2
+    approximation
+    :param n_jobs: number of processes to spread the monte carlo tests over
+    :return: df: dataframe with the combinations of the categorical variables, chi^2 values, p-values, degrees of
+    freedom and effect sizes
+    """
+
+    columns = ['group', 'cat_var_1', 'cat_var_2', 'chi_squared_val', 'p_values', 'deg_of_fr', 'p_value_method',
+               'cramers_v', 'theils_u_1_2', 'theils_u_2_1']
+    pairs = list(state['contingency'].items())
+    results = {col: np.empty(len(pairs), dtype=object) for col in columns}
+    sparse_tables = dict()
+    for row, ((col_1, col_2), table) in enumerate(pairs):
+        chi2_t = stats.chi2_contingency(table)
+        theils_u = dep.theils_u(table)
+        for col, value in zip(columns, ['all', col_1, col_2, chi2_t[0], chi2_t[1], chi2_t[2], 'chi_squared',
+                                        dep.cramers_v(table), theils_u[0], theils_u[1]]):
+            results[col][row] = value
+        if chi2_t[2] > 0 and dep.fails_expected_count_rule(chi2_t[3]):
+            sparse_tables[row] = table
+
+    # same monte carlo exact tests as analysis_for_dep.chi2_test
+    dep.monte_carlo_tests(results, sparse_tables, mc_replicates, n_jobs)
+
+    return pd.DataFrame(results, columns=columns).infer_objects()
@@ -0,0 +1,321 @@
+"""
+rank based tests computed for many variables or many simulated/permuted data sets at once
+
+:created: 2021
+:copyright: (c) 2021, GDA
+:license: see LICENSE for more details
+"""
+
+import numpy as np
+from scipy import stats
+from scipy import sparse
+
+
+def rank_rows(values):
+    """
+    rank each row of a matrix, ties get the average rank (as in scipy.stats.rankdata). missing values get a missing
+    rank and are left out of the ranking of the others
+
+    :param values: array (rows x samples)
+    :return: ranks: array (rows x samples) of ranks starting at 1
+    """
+
+    missing = np.isnan(values)
+    if not missing.any():
+        return stats.rankdata(values, axis=-1)
+
+    # missing values are ranked after all the others, so they don't change their ranks
+    ranks = stats.rankdata(np.where(missing, np.inf, values), axis=-1)
+    ranks[missing] = np.nan
+
+    return ranks
+
+
+def tie_correction(values):
+    """
+    tie correction of the Kruskal-Wallis h-stat for each row, 1 - sum(t^3 - t) / (n^3 - n) over the groups of t tied
+    values (as in scipy.stats.tiecorrect). missing values are left out
+
+    :param values: array (rows x samples), values or ranks
+    :return: array with the correction of each row
+    """
+
+    values = np.atleast_2d(values)
+    n = (~np.isnan(values)).sum(axis=-1)
+    sorted_values = np.sort(values, axis=-1)
+
+    # runs of equal values in each row (missing values are sorted last and never equal)
+    rows, cols = sorted_values.shape
+    new_run = np.ones((rows, cols), dtype=bool)
+    new_run[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    run_starts = np.flatnonzero(new_run.ravel())
+    run_lengths = np.diff(np.append(run_starts, rows * cols)).astype(float)
+    tie_sum = np.bincount(run_starts // cols, weights=run_lengths ** 3 - run_lengths, minlength=rows)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1 - tie_sum / (n.astype(float) ** 3 - n)
+
+
+def level_indicator(codes, n_levels):
+    """
+    indicator matrix of the level of each sample
+
+    :param codes: array with the integer level code of each sample
+    :param n_levels: number of levels
+    :return: array (samples x levels) of 0/1
+    """
+
+    indicator = np.zeros((len(codes), n_levels))
+    indicator[np.arange(len(codes)), codes] = 1
+
+    return indicator
+
+
+def kruskal_h(ranks, codes, n_levels):
+    """
+    Kruskal-Wallis h-stat for every row of a rank matrix, with the samples split into levels by codes (no correction
+    for ties)
+
+    :param ranks: array (rows x samples) of ranks
+    :param codes: array with the integer level code of each sample
+    :param n_levels: number of levels
+    :return: h_stat: array with the h-stat for each row
+    """
+
+    n = ranks.shape[-1]
+    indicator = level_indicator(codes, n_levels)
+    level_sizes = indicator.sum(axis=0)
+    rank_sums = ranks @ indicator
+
+    return 12 / (n * (n + 1)) * (rank_sums ** 2 / level_sizes).sum(axis=-1) - 3 * (n + 1)
+
+
+def kruskal_pval(h_stat, n_levels):
+    """
+    p-value for the Kruskal-Wallis h-stat from the chi-squared approximation
+
+    :param h_stat: array of h-stats
+    :param n_levels: number of levels
+    :return: p-values
+    """
+
+    return stats.chi2.sf(h_stat, n_levels - 1)
+
+
+def one_hot(codes_list):
+    """
+    sparse indicator matrix of several categorical variables side by side
+
+    :param codes_list: list with the array of integer level codes (starting at 0) of each variable
+    :return:
+        - csr matrix (samples x levels of all variables) of 0/1
+        - array with the first column of each variable
+    """
+
+    num_levels = np.array([codes.max() + 1 if len(codes) else 0 for codes in codes_list])
+    starts = np.concatenate([[0], np.cumsum(num_levels)[:-1]]).astype(int)
+    num_samples = len(codes_list[0]) if codes_list else 0
+
+    cols = np.concatenate([codes + start for codes, start in zip(codes_list, starts)]) if codes_list else []
+    rows = np.tile(np.arange(num_samples), len(codes_list))
+    indicator = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(num_samples, num_levels.sum()))
+
+    return indicator, starts
+
+
+def kruskal_h_pairs(ranks, indicator, starts, ties=None):
+    """
+    Kruskal-Wallis h-stat for every pair of a row of the rank matrix and a categorical variable, in one pass: the
+    rank sums of all levels of all variables are one sparse matrix product. samples with a missing rank are left out
+
+    :param ranks: array (rows x samples) of ranks, e.g. of continuous variables
+    :param indicator: sparse indicator matrix (samples x levels) from one_hot
+    :param starts: first column of each categorical variable in indicator
+    :param ties: tie correction of each row from tie_correction (None for no correction)
+    :return:
+        - h_stat: array (rows x variables)
+        - dof: array (rows x variables) of degrees of freedom, the number of levels with samples - 1
+        - n: array with the number of samples of each row
+    """
+
+    valid = ~np.isnan(ranks)
+    n = valid.sum(axis=1).astype(float)
+    rank_sums = np.asarray(indicator.T @ np.where(valid, ranks, 0).T).T
+    sizes = np.asarray(indicator.T @ valid.T.astype(float)).T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(sizes > 0, rank_sums ** 2 / sizes, 0)
+        h_stat = 12 / (n * (n + 1))[:, None] * np.add.reduceat(terms, starts, axis=1) - 3 * (n + 1)[:, None]
+        if ties is not None:
+            h_stat = h_stat / ties[:, None]
+    dof = np.add.reduceat((sizes > 0).astype(int), starts, axis=1) - 1
+
+    return h_stat, dof, n
+
+
+def permutation_kruskal_pval(values, codes, max_permutations=10000, alpha=0.05, min_alpha=None, confidence=0.999,
+                             seed=0, first_batch=100, max_batch_elements=2 ** 22):
+    """
+    permutation p-value of the Kruskal-Wallis test: the samples are ranked once, and the rank sums of the levels for a
+    batch of permutations of the level labels are one bincount. permutations are drawn in growing batches until the
+    confidence interval (Clopper-Pearson) of the p-value is clearly above alpha or below min_alpha, or max_permutations
+    is reached, so obvious cases stop after a few hundred permutations
+
+    :param values: array of the scores of the samples
+    :param codes: array with the integer level code (starting at 0) of each sample
+    :param max_permutations: maximum number of permutations
+    :param alpha: stop once the p-value is clearly above alpha
+    :param min_alpha: stop once the p-value is clearly below min_alpha, e.g. the threshold after a multiple testing
+    correction (None for alpha)
+    :param confidence: confidence of the interval used for stopping
+    :param seed: seed or seed sequence for the permutations
+    :param first_batch: number of permutations in the first batch, each batch is twice the previous one
+    :param max_batch_elements: batches are at most this many samples x permutations
+    :return: (p-value, number of permutations), the p-value counts the observed labels so it is never 0
+    """
+
+    min_alpha = alpha if min_alpha is None else min_alpha
+    rng = np.random.default_rng(seed)
+    ranks = stats.rankdata(values)
+    n, n_levels = len(ranks), codes.max() + 1
+    sizes = np.bincount(codes, minlength=n_levels)
+
+    # the h-stat only depends on the labels through sum(rank sum^2 / size), the tie correction is the same for all
+    observed = (np.bincount(codes, weights=ranks, minlength=n_levels) ** 2 / sizes).sum()
+    observed -= 1e-9 * abs(observed)
+
+    num_extreme, num_done, batch = 0, 0, first_batch
+    while num_done < max_permutations:
+        batch = max(1, min(batch, max_permutations - num_done, max_batch_elements // n))
+        permuted = codes[np.argsort(rng.random((batch, n)), axis=1)] + (np.arange(batch) * n_levels)[:, None]
+        rank_sums = np.bincount(permuted.ravel(), weights=np.tile(ranks, batch),
+                                minlength=batch * n_levels).reshape(batch, n_levels)
+        num_extreme += np.count_nonzero((rank_sums ** 2 / sizes).sum(axis=1) >= observed)
+        num_done += batch
+
+        # stop when the confidence interval of the p-value is above alpha or below min_alpha
+        lower = stats.beta.ppf((1 - confidence) / 2, num_extreme, num_done - num_extreme + 1) if num_extreme else 0
+        upper = stats.beta.ppf(1 - (1 - confidence) / 2, num_extreme + 1, num_done - num_extreme)
+        if upper < min_alpha or lower > alpha:
+            break
+        batch *= 2
+
+    return (num_extreme + 1) / (num_done + 1), num_done
+
+
+def spearman_matrix(values):
+    """
+    spearman correlations between all columns of a matrix, each pair from the samples where both are present (as
+    pandas.DataFrame.corr(method='spearman')). the columns are ranked once per pair of missing value patterns and the
+    correlations of each pair of patterns are one matrix product, so without missing values there is a single ranking
+
+    :param values: array (samples x variables), missing values are NaN
+    :return:
+        - rho: array (variables x variables) of correlations
+        - n: array (variables x variables) with the number of samples of each correlation
+    """
+
+    valid = ~np.isnan(values)
+    n = (valid.T.astype(float) @ valid).astype(int)
+    rho = np.full(n.shape, np.nan)
+
+    # variables with the same missing samples are ranked together
+    patterns, pattern_codes = np.unique(valid, axis=1, return_inverse=True)
+    pattern_codes = pattern_codes.ravel()
+    for a in range(patterns.shape[1]):
+        for b in range(a, patterns.shape[1]):
+            rows = patterns[:, a] & patterns[:, b]
+            if rows.sum() < 2:
+                continue
+
+            # the columns of both patterns side by side, the block of pattern b starts after pattern a
+            cols_a, cols_b = np.flatnonzero(pattern_codes == a), np.flatnonzero(pattern_codes == b)
+            cols, start_b = (np.concatenate([cols_a, cols_b]), len(cols_a)) if a != b else (cols_a, 0)
+
+            ranks = stats.rankdata(values[rows][:, cols], axis=0)
+            ranks = ranks - ranks.mean(axis=0)
+            sum_squares = (ranks ** 2).sum(axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                block = np.clip((ranks.T @ ranks) / np.sqrt(np.outer(sum_squares, sum_squares)), -1, 1)
+
+            block = block[:len(cols_a), start_b:]
+            rho[np.ix_(cols_a, cols_b)] = block
+            rho[np.ix_(cols_b, cols_a)] = block.T
+
+    return rho, n
+
+
+def spearman_pvals(rho, n):
+    """
+    two-sided p-values of spearman correlations from the t approximation, t = rho * sqrt((n - 2) / (1 - rho^2)) with
+    n - 2 degrees of freedom (as scipy.stats.spearmanr)
+
+    :param rho: array of correlations
+    :param n: array with the number of samples of each correlation
+    :return: array of p-values, NaN with fewer than 3 samples
+    """
+
+    rho = np.asarray(rho, dtype=float)
+    dof = np.asarray(n, dtype=float) - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = rho * np.sqrt(dof / ((1 - rho) * (1 + rho)))
+        pvals = 2 * stats.t.sf(np.abs(t), dof)
+
+    return np.where(dof > 0, pvals, np.nan)
+
+
+def spearman_cis(rho, n, confidence=0.95):
+    """
+    confidence intervals of spearman correlations from the fisher z transform, with the variance 1.06 / (n - 3) of
+    Fieller, Hartley & Pearson (1957) for spearman's rho
+
+    :param rho: array of correlations
+    :param n: array with the number of samples of each correlation
+    :param confidence: confidence level
+    :return: (array of lower bounds, array of upper bounds), NaN with fewer than 4 samples
+    """
+
+    rho = np.asarray(rho, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.arctanh(np.clip(rho, -1, 1))
+        half_width = stats.norm.ppf(1 - (1 - confidence) / 2) * np.sqrt(1.06 / (n - 3))
+        lower, upper = np.tanh(z - half_width), np.tanh(z + half_width)
+
+    return np.where(n > 3, lower, np.nan), np.where(n > 3, upper, np.nan)
+
+
+def permutation_spearman_pvals(x, values, num_permutations=10000, seed=0, max_batch_elements=2 ** 22):
+    """
+    two-sided permutation p-values of the spearman correlation of x with every column of values, for few samples where
+    the t approximation is poor. the samples are ranked once, and the correlations of a batch of permutations of x
+    with all columns are one matrix product
+
+    :param x: array of the samples, e.g. the scores
+    :param values: array (samples x variables), without missing values
+    :param num_permutations: number of permutations
+    :param seed: seed or seed sequence for the permutations
+    :param max_batch_elements: batches are at most this many samples x permutations
+    :return: array of p-values, one per column, counting the observed x so they are never 0
+    """
+
+    rng = np.random.default_rng(seed)
+    x_ranks = stats.rankdata(x)
+    x_ranks = x_ranks - x_ranks.mean()
+    ranks = stats.rankdata(values, axis=0)
+    ranks = ranks - ranks.mean(axis=0)
+    norms = np.sqrt((x_ranks ** 2).sum() * (ranks ** 2).sum(axis=0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed = np.abs(x_ranks @ ranks / norms) * (1 - 1e-9)
+
+    n = len(x_ranks)
+    batch_size = max(1, max_batch_elements // max(1, n))
+    num_extreme = np.zeros(ranks.shape[1])
+    for start in range(0, num_permutations, batch_size):
+        batch = min(batch_size, num_permutations - start)
+        permuted = x_ranks[np.argsort(rng.random((batch, n)), axis=1)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            num_extreme += (np.abs(permuted @ ranks / norms) >= observed).sum(axis=0)
+
+    return np.where(norms > 0, (num_extreme + 1) / (num_permutations + 1), np.nan)
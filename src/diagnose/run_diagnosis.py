@@ -16,7 +16,14 @@ import pandas as pd
 import diagnose.analysis_var_cat as avcat
 import diagnose.analysis_var_cont as avcont
 import diagnose.analysis_for_dep as dep
+import diagnose.cardinality as cardinality
+import diagnose.aliases as aliases
 import diagnose.make_record as rec
+import diagnose.object_store as store
+import diagnose.bundle as bundle
+import diagnose.html_report as html_report
+import diagnose.plotting as plotting
+import diagnose.multiple_testing as mt
 
 
 def make_sub_directory(output_dir):
@@ -53,6 +60,51 @@ def main():
     parser.add_argument('-m', "--merge_files", help='if there is a separate metadata file, specify its location here')
     parser.add_argument("-n", "--no_sub_dir", help="do not make a subdirectory (not recommended except for reactor)",
                         action="store_true")
+    parser.add_argument("--max_scatter_points", help="plot densities instead of scatter plots for groups with more "
+                                                     "samples than this", type=int, default=10000)
+    parser.add_argument("--vars_per_page", help="maximum number of variables per scatter plot figure", type=int,
+                        default=None)
+    parser.add_argument("--hash_algorithm", help="algorithm used to hash output files for the record",
+                        choices=rec.HASH_ALGORITHMS, default='md5')
+    parser.add_argument("--hash_threads", help="number of threads for hashing files", type=int, default=4)
+    parser.add_argument("--bundle", help="write all tables and images into one indexed file, output.bundle, "
+                                         "see diagnose.bundle to list or extract them", action="store_true")
+    parser.add_argument("--object_store", help="content-addressed store to deduplicate output files across runs",
+                        default=None)
+    parser.add_argument("--store_mode", help="keep hardlinks to the stored files in the output directory, or only "
+                                             "list them in record.json (manifest)",
+                        choices=store.STORE_MODES, default='hardlink')
+    parser.add_argument("--report", help="png files for each group, or one self-contained report.html with "
+                                         "interactive plots instead of them", choices=['png', 'html'], default='png')
+    parser.add_argument("--correction", help="multiple testing correction of the p-values: Benjamini & Hochberg, "
+                                             "Benjamini & Yekutieli, Holm, or hierarchical (within each group, then "
+                                             "across groups)", choices=mt.METHODS, default='fdr_bh')
+    parser.add_argument("--plot_top_k", help="plot only the k most significant variables of each group", type=int,
+                        default=None)
+    parser.add_argument("--max_plots", help="maximum number of figures, the most significant groups are plotted "
+                                            "first", type=int, default=None)
+    parser.add_argument("--max_plot_seconds", help="stop starting new figures after this many seconds of plotting",
+                        type=float, default=None)
+    parser.add_argument("--mc_replicates", help="random tables for the monte carlo exact tests of the contingency "
+                                                "tables with small expected counts (0 to always use the chi-squared "
+                                                "approximation)", type=int, default=10000)
+    parser.add_argument("--kw_permutations", help="maximum number of permutations for permutation p-values of the "
+                                                  "Kruskal-Wallis tests (0 for the chi-squared approximation)",
+                        type=int, default=0)
+    parser.add_argument("--bootstrap_replicates", help="bootstrap replicates for confidence intervals of the median "
+                                                       "of each value in stats_val (0 for no confidence intervals)",
+                        type=int, default=0)
+    parser.add_argument("--spearman_permutations", help="permutations for permutation p-values of the spearman "
+                                                        "correlations of groups with at most 30 samples (0 for the t "
+                                                        "approximation)", type=int, default=0)
+    parser.add_argument("--n_jobs", help="number of processes for the monte carlo, permutation and bootstrap "
+                                         "computations", type=int, default=1)
+    parser.add_argument("--max_table_cells", help="contingency tables with more cells than this only count the "
+                                                  "observed combinations of levels", type=int, default=10 ** 6)
+    parser.add_argument("--min_level_count", help="lump the levels of a categorical variable with fewer samples "
+                                                  "than this into one 'other' level", type=int, default=None)
+    parser.add_argument("--max_plot_levels", help="don't plot variables with more levels than this", type=int,
+                        default=50)
 
     args = parser.parse_args()
     config_file = args.config_file
@@ -61,6 +113,16 @@ def main():
     output_dir = args.output_dir
     merge_files = args.merge_files
     arg_no_sub_dir = args.no_sub_dir
+    hash_threads = args.hash_threads
+    max_scatter_points = args.max_scatter_points
+    vars_per_page = args.vars_per_page
+    use_bundle = args.bundle
+    object_store = args.object_store
+    store_mode = args.store_mode
+    report_format = args.report
+    plot_budget = plotting.PlotBudget(args.plot_top_k, args.max_plots, args.max_plot_seconds)
+    # decisions taken because of the cardinality limits, for the record
+    cardinality_decisions = list()
 
     if part_file in ['none', 'None', 'NA']:
         part_file = None  # ToDo: Are we still doing the part analysis?
@@ -126,6 +188,10 @@ def main():
     print('discarding cont_vars not in data set:', discard_cont_vars)
     cont_vars = [x for x in cont_vars if x not in discard_cont_vars]
 
+    # rare levels of the categorical variables (not the groups) are lumped together, if min_level_count is set
+    data_df = cardinality.lump_rare_levels(data_df, [x for x in cat_vars if x not in groups], args.min_level_count,
+                                           cardinality_decisions)
+
     # make timestamped folder if there is supposed to be a subdirectory, copy config file to it
     if not arg_no_sub_dir:
         output_dir = make_sub_directory(output_dir)
@@ -137,12 +203,24 @@ def main():
 
     saved_files = list()
 
+    # every output file is hashed while it is written, into one bundle file if there is one
+    writer = rec.OutputWriter(args.hash_algorithm)
+    if use_bundle:
+        output_bundle = bundle.BundleWriter(os.path.join(output_dir, "output.bundle"), root=output_dir)
+        writer.bundle = output_bundle
+
+    # the analyses add summaries to the report instead of drawing png files
+    if report_format == 'html':
+        report = html_report.Report("diagnose: " + os.path.basename(str(exp_file)))
+    else:
+        report = None
+
     if exp_file is not None:
         for group_col in groups:
             # categorical variables analysis of variance ----------------------------
             print("\nanalyze categorical variables........")
             out_path_cat = os.path.join(output_dir, "avcat_" + group_col)
-            if not os.path.exists(out_path_cat):
+            if not use_bundle and not os.path.exists(out_path_cat):
                 os.makedirs(out_path_cat, exist_ok=True)
 
             # make cont->cat binned columns to test
@@ -164,43 +242,86 @@ def main():
             cols_to_keep = list(set([sample_id] + [score_col] + groups + cat_cont_vars))
             cat_cont_data_df = cat_cont_data_df[cols_to_keep]
 
-            avcat_files = avcat.run(group_col, cat_cont_vars, cat_cont_data_df, score_col, out_path_cat)
+            # variables that are relabelings of each other within each group give the same results, test only one
+            alias_classes = aliases.find_aliases(cat_cont_data_df, cat_cont_vars, group_col)
+            cat_cont_vars = aliases.representatives(alias_classes)
+            nested = aliases.find_nested(cat_cont_data_df, cat_cont_vars, group_col)
+            print('aliased variables, only the first of each is tested:', [x for x in alias_classes if len(x) > 1])
+            saved_files.append(aliases.save_aliases(alias_classes, nested, group_col, out_path_cat, writer=writer))
+
+            avcat_files = avcat.run(group_col, cat_cont_vars, cat_cont_data_df, score_col, out_path_cat,
+                                    correction=args.correction, kw_permutations=args.kw_permutations,
+                                    bootstrap_replicates=args.bootstrap_replicates, n_jobs=args.n_jobs,
+                                    max_plot_levels=args.max_plot_levels,
+                                    decisions=cardinality_decisions, report=report, budget=plot_budget, writer=writer)
             saved_files.extend(avcat_files)
 
             # categorical variables dependence test ----------------------------
             print("\ndependence test........")
             out_path_dep = out_path_cat + "/dependence"
-            dep_files = dep.run(group_col, cat_vars, data_df, out_path_dep)
+            dep_files = dep.run(group_col, [x for x in cat_vars if x in cat_cont_vars], data_df, out_path_dep,
+                                cont_vars, correction=args.correction, mc_replicates=args.mc_replicates,
+                                n_jobs=args.n_jobs, max_table_cells=args.max_table_cells,
+                                decisions=cardinality_decisions, report=report, writer=writer)
             saved_files.extend(dep_files)
 
             # continuous variables correlation ----------------------------
             print("\nanalyze continuous variables........")
             out_path_cont = os.path.join(output_dir, "avcont_" + group_col)
-            if not os.path.exists(out_path_cont):
+            if not use_bundle and not os.path.exists(out_path_cont):
                 os.makedirs(out_path_cont, exist_ok=True)
 
             cols_to_keep = list(set([sample_id] + [score_col] + groups + cont_vars))
             cont_data_df = data_df[cols_to_keep]
 
-            cont_files = avcont.run(group_col, cont_vars, cont_data_df, score_col, out_path_cont)
+            cont_files = avcont.run(group_col, cont_vars, cont_data_df, score_col, out_path_cont, max_scatter_points,
+                                    vars_per_page, correction=args.correction,
+                                    spearman_permutations=args.spearman_permutations, report=report,
+                                    budget=plot_budget, writer=writer)
             saved_files.extend(cont_files)
 
-            # get files together for summarizing and hashing
-            files = [{'name': x} for x in saved_files]
-
-            # make hash for data sets
-            print("hashing output...")
-            files = rec.make_hashes_for_files(files)
-
-            # make data record
-            print("making product record...")
-            record = rec.make_product_record(output_dir, files, exp_file, merge_files)
-
-            record_path = os.path.join(output_dir, "record.json")
-            with open(record_path, 'w') as json_file:
-                json.dump(record, json_file, indent=2)
-
-            print("finished!")
+        if report_format == 'html':
+            report.write(os.path.join(output_dir, "report.html"), writer=writer)
+
+        # get files together for summarizing and hashing, including plots written along the way
+        saved_paths = set(map(os.path.abspath, saved_files))
+        saved_files.extend([x for x in writer.written_files() if x not in saved_paths])
+        files = [{'name': x} for x in saved_files]
+
+        if use_bundle:
+            writer.bundle = None
+            output_bundle.close()
+            for file in files:
+                file['bundle_entry'] = output_bundle.entry_name(file['name'])
+            files.append({'name': output_bundle.path})
+
+        # make hash for data sets, each file is hashed once (most already were while being written)
+        print("hashing output...")
+        files = rec.make_hashes_for_files(files, n_threads=hash_threads, writer=writer)
+
+        # move files into the content-addressed store, identical files from earlier runs are kept only once
+        if object_store is not None:
+            print("storing output in " + object_store + "...")
+            # entries in the bundle aren't separate files, the bundle itself is stored
+            store.store_files([x for x in files if 'bundle_entry' not in x], object_store, writer.algorithm,
+                              output_dir, store_mode)
+
+        # make data record
+        print("making product record...")
+        record = rec.make_product_record(output_dir, files, exp_file, merge_files)
+        if object_store is not None:
+            record['object_store'] = os.path.abspath(object_store)
+        record['plot_budget'] = {'top_k': plot_budget.top_k, 'max_plots': plot_budget.max_plots,
+                                 'max_seconds': plot_budget.max_seconds, 'num_plots': plot_budget.num_plots,
+                                 'seconds': round(plot_budget.seconds, 3)}
+        record['skipped_plots'] = plot_budget.skipped
+        record['cardinality_decisions'] = cardinality_decisions
+
+        record_path = os.path.join(output_dir, "record.json")
+        with open(record_path, 'w') as json_file:
+            json.dump(record, json_file, indent=2)
+
+        print("finished!")
 
 
 if __name__ == '__main__':
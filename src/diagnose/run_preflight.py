@@ -26,11 +26,41 @@ def main():
     parser.add_argument("path_to_metadata", help="metadata for a proposed experiment")
     parser.add_argument("output_dir", help="output directory")
     parser.add_argument("--ignore_cols", help='columns to ignore when running preflight check', nargs='*', default=None)
+    parser.add_argument("--max_missing", help='maximum number of missing combinations to report', type=int,
+                        default=1000)
+    parser.add_argument("--min_replicates", help='report combinations with fewer replicates than this', type=int,
+                        default=2)
+    parser.add_argument("--state_file", help='keep counts in this file and only process samples appended to the '
+                                             'metadata since the last run', default=None)
+    parser.add_argument("--t_wise", help='sizes of the subsets of variables to check coverage for, e.g. 2 for pairwise',
+                        type=int, nargs='*', default=[2])
+    parser.add_argument("--n_jobs", help='number of processes to use for the coverage analysis', type=int, default=1)
+    parser.add_argument("--suggest_runs", help='propose additional runs to complete t-wise coverage',
+                        action="store_true")
+    parser.add_argument("--completion_t", help='size of the subsets of variables the proposed runs should cover',
+                        type=int, default=2)
+    parser.add_argument("--max_runs", help='maximum number of additional runs to propose', type=int, default=None)
+    parser.add_argument("--effect_sizes", help='estimate power to detect effects of these sizes, e.g. '
+                                               'catvar1=0.5 catvar2=1 (difference between highest and lowest level '
+                                               'in standard deviations of the score)', nargs='*', default=None)
+    parser.add_argument("--n_sim", help='number of simulations for the power estimate', type=int, default=1000)
+    parser.add_argument("--seed", help='seed for the power simulations', type=int, default=0)
 
     args = parser.parse_args()
     path_to_metadata = args.path_to_metadata
     ignore_cols = args.ignore_cols
     output_dir = args.output_dir
+    max_missing = args.max_missing
+    min_replicates = args.min_replicates
+    state_file = args.state_file
+    t_wise = args.t_wise
+    n_jobs = args.n_jobs
+    suggest_runs = args.suggest_runs
+    completion_t = args.completion_t
+    max_runs = args.max_runs
+    effect_sizes = args.effect_sizes
+    n_sim = args.n_sim
+    seed = args.seed
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir, exist_ok=True)
@@ -45,34 +75,98 @@ def main():
 
     results = {}
 
-    # Checking which variables never vary
+    # Fold new samples into the saved state instead of recomputing everything from the full data set
+    state = None
+    if state_file is not None:
+        if os.path.exists(state_file):
+            state = load_preflight_state(state_file)
+            if not state_matches(state, meta_df):
+                print("samples in " + state_file + " don't match the metadata, rebuilding the state")
+                state = None
+        if state is None:
+            state = new_preflight_state(meta_df.columns)
+        print("adding {0:d} new samples to the preflight state".format(len(meta_df) - state['num_rows']))
+        update_preflight_state(state, meta_df.iloc[state['num_rows']:])
+        save_preflight_state(state, state_file)
 
-    var_nums, nonvar = check_varying_categories(meta_df)
+    # Checking which variables never vary
+    if state is not None:
+        var_nums, nonvar = state_varying_categories(state)
+    else:
+        var_nums, nonvar = check_varying_categories(meta_df)
     results.update({"analysis_of_static_categories": [{'static_variables': list(nonvar),
                                                        'num_unique_cat_per_var': var_nums.to_dict()}]})
 
     # Checking how many replicates for variables that do vary
-    replicates = get_num_replicates(meta_df)
+    if state is not None:
+        replicates = state_num_replicates(state)
+    else:
+        replicates = get_num_replicates(meta_df)
 
-    # reformat JSON because it formats incorrectly
-    r = replicates.to_dict()
+    # the full table can be very large, so it goes to its own file and only a summary goes in the JSON
+    replicates_path = write_replicates_table(replicates, os.path.join(output_dir, 'preflight_replicates.tsv'))
+    replicate_summary = summarize_replicates(replicates, min_replicates, max_missing)
+    replicate_summary['replicates_file'] = os.path.basename(replicates_path)
 
-    for k in r.keys():
-        r[", ".join(k)] = r.pop(k)
-
-    results.update({"analysis_of_replicates": [{'num_replicates': r}]})
+    results.update({"analysis_of_replicates": [replicate_summary]})
 
     # Checking Covered vs. missing combinations of variables
-    perc, missing = get_covered_combinations(meta_df)
+    if state is not None:
+        perc, missing, num_possible, num_missing = state_covered_combinations(state, max_missing)
+    else:
+        # the combinations are encoded once for both the counts and the missing combinations
+        combinations = get_unique_combinations(meta_df)
+        num_covered, num_possible = count_covered_combinations(meta_df, combinations)
+        num_missing = num_possible - num_covered
+        perc, missing = get_covered_combinations(meta_df, max_missing, combinations)
     results.update({"analysis_of_combination_coverage": [{'prop_poss_combos_covered': perc,
+                                                          'num_poss_combos': num_possible,
+                                                          'num_missing_combos': num_missing,
                                                           'missing_combos': [list(m) for m in missing]}]})
 
+    # Checking covered vs. missing combinations of levels for each subset of t variables
+    t_wise_results = []
+    for t in t_wise:
+        if 1 <= t <= len(meta_df.columns):
+            if state is not None and t == 2:
+                subsets = state_pairwise_coverage(state, max_missing)
+            else:
+                subsets = get_t_wise_coverage(meta_df, t, max_missing, n_jobs)
+            num_covered = sum(x['num_poss_combos'] - x['num_missing_combos'] for x in subsets)
+            num_possible = sum(x['num_poss_combos'] for x in subsets)
+            t_wise_results.append({'t': t,
+                                   'prop_tuples_covered': num_covered / num_possible,
+                                   'min_prop_combos_covered': min(x['prop_combos_covered'] for x in subsets),
+                                   'subsets': subsets})
+    results.update({"analysis_of_t_wise_coverage": t_wise_results})
+
+    # Propose additional runs to cover the missing combinations of t variables
+    if suggest_runs:
+        new_runs = suggest_design_completion(meta_df, completion_t, max_runs=max_runs)
+        out_path = os.path.join(output_dir, 'preflight_design_completion.tsv')
+        print("saving to: " + out_path)
+        new_runs.to_csv(out_path, sep='\t', index=False)
+        results.update({"design_completion": [{'t': completion_t,
+                                               'num_proposed_runs': len(new_runs),
+                                               'proposed_runs_file': os.path.basename(out_path)}]})
+
+    # Estimate the power of the analysis of variance to detect the given effects with this design
+    if effect_sizes is not None:
+        effect_sizes = {k: float(v) for k, v in (x.split('=', 1) for x in effect_sizes)}
+        power_df = estimate_power(meta_df, effect_sizes, n_sim, n_jobs=n_jobs, seed=seed)
+        results.update({"analysis_of_power": [{'num_simulations': n_sim,
+                                               'alpha': 0.05,
+                                               'power_per_variable': power_df.to_dict(orient='records')}]})
+
     # Only compute Chi-Squared Test for Dependence if there are missing combinations of variables
 
     if perc < 1:
         results.update({"chi2_test_results": "See Heatmaps and tsv files for output from chi-squared test for "
                                              "independence"})
-        df = chi2.chi2_test(meta_df.columns, meta_df, 'all')
+        if state is not None:
+            df = state_chi2_test(state, n_jobs=n_jobs)
+        else:
+            df = chi2.chi2_test(meta_df.columns, meta_df, 'all', n_jobs=n_jobs)
         df = chi2.multiple_testing_correction(df)
         chi2.plot_heatmap(meta_df.columns, df, output_dir, 'all')
         chi2.save_df('all', df, output_dir)
@@ -0,0 +1,62 @@
+"""
+Tests for the aliases.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.aliases import *
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class TestAliases(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for aliases tests
+        """
+        np.random.seed(27705)
+
+        strain = np.random.choice(['s1', 's2', 's3', 's4'], 100)
+        self.data = pd.DataFrame({'strain': strain,
+                                  'strain_id': pd.Series(strain).map({'s1': 4, 's2': 3, 's3': 2, 's4': 1}),
+                                  'species': pd.Series(strain).map({'s1': 'A', 's2': 'A', 's3': 'B', 's4': 'B'}),
+                                  'media': np.random.choice(['m1', 'm2'], 100),
+                                  'group': np.random.choice(['g1', 'g2'], 100)})
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing find_aliases function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_find_aliases(self):
+        """
+        relabelings are found, the first listed variable is the representative
+        """
+        alias_classes = find_aliases(self.data, ['strain', 'media', 'strain_id', 'species'])
+
+        assert alias_classes == [['strain', 'strain_id'], ['media'], ['species']]
+        assert representatives(alias_classes) == ['strain', 'media', 'species']
+
+    def test_find_aliases_group(self):
+        """
+        variables that are only relabelings of each other within each group are aliases for that group column
+        """
+        data = self.data.copy()
+        data['media_per_group'] = np.where(data.group == 'g1', data.media, data.media.map({'m1': 'm2', 'm2': 'm1'}))
+
+        assert ['media', 'media_per_group'] not in find_aliases(data, ['media', 'media_per_group'])
+        assert ['media', 'media_per_group'] in find_aliases(data, ['media', 'media_per_group'], 'group')
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing find_nested function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_find_nested(self):
+        """
+        strain is nested in species, nothing else is nested
+        """
+        data = self.data.copy()
+        data['static'] = 'x'
+
+        assert find_nested(data, ['strain', 'media', 'species', 'static']) == [('strain', 'species')]
+        assert find_nested(data, ['strain', 'media', 'species'], 'group') == [('strain', 'species')]
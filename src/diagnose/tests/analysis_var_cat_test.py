@@ -11,6 +11,7 @@ Tests for the analysis_var_cat.py script
 from diagnose.analysis_var_cat import *
 import numpy as np
 import pandas as pd
+from scipy.stats import kruskal
 import pytest
 
 
@@ -48,6 +49,87 @@ class TestAnalyzeCat(object):
         assert results_df[results_df.variable == 'a'].var_kw_pval_corrected.values[0] < 0.05
         assert results_df[results_df.variable == 'b'].var_kw_pval_corrected.values[0] > 0.05
 
+    def test_analyze_by_var_ranks(self):
+        """
+        the h-stats and p-values from the ranks of each group should match scipy's kruskal, with tied scores and with
+        samples that have no value for a variable
+        """
+        self.data['score'] = np.round(self.data['score'], 1)
+        self.data['d'] = np.random.choice(['x', 'y', 'z'], 100)
+        self.data.loc[[3, 40, 77], 'd'] = np.nan
+        results_df = analyze_by_var('group', 'score', self.cv + ['d'], self.data)
+
+        for row in results_df.itertuples():
+            subset_df = self.data[self.data.group == row.group]
+            expected = kruskal(*[x['score'].values for _, x in subset_df.groupby(row.variable)])
+            assert np.isclose(row.var_kw_hstat, expected[0])
+            assert np.isclose(row.var_kw_pval, expected[1])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing permutation_pvals function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_permutation_pvals(self):
+        """
+        with permutation p-values the related variable should still be significant and the unrelated one not, and
+        the p-values should not depend on the number of processes
+        """
+        results_df = analyze_by_var('group', 'score', self.cv, self.data, kw_permutations=2000, n_jobs=1)
+        results_jobs_df = analyze_by_var('group', 'score', self.cv, self.data, kw_permutations=2000, n_jobs=2)
+
+        assert (results_df.var_kw_pval_method == 'permutation').all()
+        assert results_df[results_df.variable == 'a'].var_kw_pval_corrected.values[0] < 0.05
+        assert results_df[results_df.variable == 'b'].var_kw_pval_corrected.values[0] > 0.05
+        # the unrelated variable stops after the first batch
+        assert results_df[results_df.variable == 'b'].var_kw_num_permutations.values[0] == 100
+        assert np.array_equal(results_df.var_kw_pval.values, results_jobs_df.var_kw_pval.values)
+
+    def test_permutation_pvals_missing(self):
+        """
+        the permutation p-values should leave out the samples without a value, as the h-stat does
+        """
+        self.data.loc[[3, 40, 77], 'b'] = np.nan
+        results_df = analyze_by_var('group', 'score', ['b'], self.data, kw_permutations=2000)
+        expected_df = analyze_by_var('group', 'score', ['b'], self.data.dropna(), kw_permutations=2000)
+
+        assert (results_df.var_kw_pval_method == 'permutation').all()
+        assert np.array_equal(results_df.var_kw_hstat.values, expected_df.var_kw_hstat.values)
+        assert np.array_equal(results_df.var_kw_pval.values, expected_df.var_kw_pval.values)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing dunn_tests function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_dunn_tests(self):
+        """
+        only the significant variable should be tested, and with two values the squared z-statistic of Dunn's test is
+        the Kruskal-Wallis h-stat
+        """
+        results_df = analyze_by_var('group', 'score', self.cv, self.data)
+        posthoc_df = dunn_tests(results_df, 'group', 'score', self.data)
+
+        assert (posthoc_df.variable == 'a').all()
+        assert list(posthoc_df.group) == ['test0', 'test1']
+        hstat = results_df[results_df.variable == 'a'].var_kw_hstat.values
+        assert np.allclose(posthoc_df.z.values ** 2, hstat)
+        assert (posthoc_df.pval_corrected < 0.05).all()
+
+        assert len(dunn_tests(results_df, 'group', 'score', self.data, alpha=0)) == 0
+
+        group_ranks = rank_groups(self.data, 'group', 'score')
+        assert dunn_tests(results_df, 'group', 'score', self.data, group_ranks=group_ranks).equals(posthoc_df)
+
+    def test_dunn_tests_missing(self):
+        """
+        samples without a value for the variable should be left out of its ranks, as in the Kruskal-Wallis test
+        """
+        self.data.loc[[3, 30, 77], 'a'] = np.nan
+        results_df = analyze_by_var('group', 'score', ['a'], self.data)
+        posthoc_df = dunn_tests(results_df, 'group', 'score', self.data)
+        expected_df = dunn_tests(results_df, 'group', 'score', self.data.dropna())
+
+        assert list(posthoc_df.count_1 + posthoc_df.count_2) == [48, 49]
+        assert posthoc_df.equals(expected_df)
+        assert np.allclose(posthoc_df.z.values ** 2, results_df.var_kw_hstat.values)
+
     # ------------------------------------------------------------------------------------------------------------------
     # Testing summarize_results function
     # ------------------------------------------------------------------------------------------------------------------
@@ -68,6 +150,19 @@ class TestAnalyzeCat(object):
 
         assert (np.unique(summarize_df.value.values) == variables).all()
 
+    def test_summarize_results_bootstrap(self):
+        """
+        with bootstrap replicates, stats_val should have confidence intervals around the median of each value
+        """
+        results_df = analyze_by_var('group', 'score', self.cv, self.data)
+        summarize_df, subset_df = summarize_results(self.data, results_df, "group", "score", self.cv,
+                                                    bootstrap_replicates=500)
+
+        assert ((summarize_df.val_median_ci_low <= summarize_df.val_median) &
+                (summarize_df.val_median <= summarize_df.val_median_ci_high)).all()
+        assert not summarize_df.val_median_diff.isna().any()
+        assert (subset_df.val_median_ci_high < 0.5).all()
+
     # ------------------------------------------------------------------------------------------------------------------
     # Testing plot_result_heatmap_stat function
     # ------------------------------------------------------------------------------------------------------------------
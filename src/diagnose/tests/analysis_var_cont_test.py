@@ -8,8 +8,10 @@ Tests for the analysis_var_cont.py script
 :license: All Rights Reserved, see LICENSE for more details
 """
 
-# from diagnose.analysis_var_cont import *
-# import numpy as np
+from diagnose.analysis_var_cont import *
+import diagnose.rank_tests as rt
+import numpy as np
+import pandas as pd
 import pytest
 
 
@@ -19,7 +21,14 @@ class TestAnalyzeCont(object):
         """
         setup for analysis of continuous data tests
         """
-        self.data = 0
+        np.random.seed(27705)
+
+        self.data = pd.DataFrame({'group': np.repeat(['a', 'b'], [40, 12]),
+                                  'score': np.random.normal(size=52),
+                                  'x': np.random.normal(size=52),
+                                  'y': np.random.normal(size=52)})
+        self.data['z'] = self.data['score'] + 0.2 * np.random.normal(size=52)
+        self.data.loc[:4, 'x'] = np.nan
 
     def teardown(self):
         """
@@ -30,12 +39,42 @@ class TestAnalyzeCont(object):
     # ------------------------------------------------------------------------------------------------------------------
     # Testing analyze_by_var function
     # ------------------------------------------------------------------------------------------------------------------
-    @pytest.mark.xfail(run=False, reason="Not Implemented")
     def test_analyze_by_var(self):
         """
-        ToDo: Testing the analyze_by_var function
+        every correlation should have its number of samples, p-value, interval and corrected p-value
         """
-        assert NotImplementedError
+        from scipy.stats import spearmanr
+
+        results_df, depend_df = analyze_by_var('group', 'score', ['x', 'y', 'z'], self.data)
+
+        row = results_df[(results_df.group == 'a') & (results_df.variable == 'x')].iloc[0]
+        subset_df = self.data[self.data.group == 'a'].dropna()
+        assert row['n'] == 35
+        assert np.isclose(row['spearman_pval'], spearmanr(subset_df['score'], subset_df['x'])[1])
+        assert row['spearman_ci_low'] < row['spearman'] < row['spearman_ci_high']
+        for df in [results_df, depend_df]:
+            assert (df['spearman_pval_corrected'] >= df['spearman_pval']).all()
+        assert 'spearman_pval_method' not in results_df.columns
+
+        results_df, _ = analyze_by_var('group', 'score', ['x', 'y', 'z'], self.data, spearman_permutations=2000)
+        assert list(results_df.groupby('group')['spearman_pval_method'].first()) == ['t', 'permutation']
+        assert results_df[results_df.variable == 'z']['spearman_pval'].max() < 0.01
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing permutation_pvals function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_permutation_pvals(self):
+        """
+        a variable with missing values should only leave out its own samples, not those of the other variables
+        """
+        self.data.loc[45:47, 'x'] = np.nan
+        subset_df = self.data[self.data.group == 'b']
+        pvals = permutation_pvals(subset_df, 'score', ['x', 'y', 'z'], 2000)
+
+        complete_df = subset_df.dropna()
+        assert pvals[0] == rt.permutation_spearman_pvals(complete_df['score'].values, complete_df[['x']].values, 2000)
+        assert np.array_equal(pvals[1:], rt.permutation_spearman_pvals(subset_df['score'].values,
+                                                                       subset_df[['y', 'z']].values, 2000))
 
     # ------------------------------------------------------------------------------------------------------------------
     # Testing save_df_stats_var function
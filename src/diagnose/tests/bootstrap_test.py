@@ -0,0 +1,60 @@
+"""
+Tests for the bootstrap.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.bootstrap import *
+import numpy as np
+import pytest
+
+
+class TestBootstrap(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for bootstrap tests
+        """
+        np.random.seed(27705)
+
+        # 2 segments, the first with cells 0 and 1, the second with cells 2, 3 and 4
+        self.segments = np.repeat([0, 1], [120, 180])
+        self.cells = np.r_[np.repeat([0, 1], [40, 80]), np.repeat([2, 3, 4], 60)]
+        self.values = np.random.normal(size=300) + self.cells * 0.5
+        order = np.random.permutation(300)
+        self.segments, self.cells, self.values = self.segments[order], self.cells[order], self.values[order]
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing median_cis function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_medians(self):
+        """
+        the medians and differences from the segment median should match numpy's median
+        """
+        results = median_cis(self.values, self.cells, self.segments, 200)
+
+        for c in range(5):
+            segment = self.segments[self.cells == c][0]
+            median = np.median(self.values[self.cells == c])
+            assert np.isclose(results['median'][c], median)
+            assert np.isclose(results['median_diff'][c], median - np.median(self.values[self.segments == segment]))
+            assert results['median_ci_low'][c] <= median <= results['median_ci_high'][c]
+
+    def test_intervals(self):
+        """
+        the intervals should be close to a bootstrap of each cell on its own, and not depend on the batches being
+        spread over processes
+        """
+        results = median_cis(self.values, self.cells, self.segments, 4000, max_batch_elements=300 * 500)
+
+        rng = np.random.default_rng(0)
+        for c in range(5):
+            x = self.values[self.cells == c]
+            medians = np.median(x[rng.integers(0, len(x), size=(4000, len(x)))], axis=1)
+            assert np.allclose([results['median_ci_low'][c], results['median_ci_high'][c]],
+                               np.quantile(medians, [0.025, 0.975]), atol=0.05)
+
+        results_jobs = median_cis(self.values, self.cells, self.segments, 4000, max_batch_elements=300 * 500, n_jobs=2)
+        for name in results:
+            assert np.array_equal(results[name], results_jobs[name])
@@ -0,0 +1,52 @@
+"""
+Tests for the bundle.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.bundle import *
+import diagnose.make_record as rec
+import pandas as pd
+
+
+class TestBundle(object):
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing BundleWriter and BundleReader
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_write_read(self, tmp_path):
+        """
+        files written with open_output through a writer with a bundle end up as entries that can be read back
+        individually
+        """
+        df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+        bundle_path = str(tmp_path / 'output.bundle')
+
+        with BundleWriter(bundle_path) as writer:
+            output_writer = rec.OutputWriter(bundle=writer)
+            with rec.open_output(str(tmp_path / 'sub' / 'table.tsv'), writer=output_writer) as out_file:
+                df.to_csv(out_file, sep='\t', index=False)
+            writer.add('image.png', b'\x89PNG')
+
+        assert not os.path.exists(str(tmp_path / 'sub'))
+        with BundleReader(bundle_path) as reader:
+            assert reader.list() == [('sub/table.tsv', 12), ('image.png', 4)]
+            pd.testing.assert_frame_equal(pd.read_csv(reader.open('sub/table.tsv'), sep='\t'), df)
+            assert reader.read('image.png') == b'\x89PNG'
+
+    def test_unclosed_bundle(self, tmp_path):
+        """
+        the entries of a bundle that was never closed (e.g. the run crashed) can still be read
+        """
+        bundle_path = str(tmp_path / 'output.bundle')
+        writer = BundleWriter(bundle_path)
+        writer.add('a.tsv', b'first')
+        writer.add('b.tsv', b'second')
+        writer.file.close()
+
+        with BundleReader(bundle_path) as reader:
+            assert reader.read('b.tsv') == b'second'
+            reader.extract(str(tmp_path / 'out'))
+
+        with open(str(tmp_path / 'out' / 'a.tsv'), 'rb') as in_file:
+            assert in_file.read() == b'first'
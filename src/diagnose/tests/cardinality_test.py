@@ -0,0 +1,110 @@
+"""
+Tests for the cardinality.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.cardinality import *
+import diagnose.analysis_for_dep as dep
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2_contingency
+import pytest
+
+
+class TestCardinality(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for cardinality tests
+        """
+        np.random.seed(27705)
+
+        self.data = pd.DataFrame({'well': ['w{0:d}'.format(i) for i in range(60)],
+                                  'a': np.random.choice(['x', 'y', 'z'], 60),
+                                  'b': np.random.choice(['p', 'q', 'r', 's'], 60)})
+        self.data.loc[:2, 'a'] = 'rare'
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing lump_rare_levels function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_lump_rare_levels(self):
+        """
+        levels with too few samples should become other, and the decision should be logged
+        """
+        self.data['plate'] = ['p1'] * 25 + ['p2'] * 25 + ['p3'] * 4 + ['p4'] * 3 + ['p5'] * 3
+        assert lump_rare_levels(self.data, ['plate', 'a']) is self.data
+
+        decisions = list()
+        lumped_df = lump_rare_levels(self.data, ['plate', 'a'], 5, decisions)
+
+        assert lumped_df['plate'].value_counts().to_dict() == {'p1': 25, 'p2': 25, OTHER_LEVEL: 10}
+        assert lumped_df['a'].equals(self.data['a'])
+        assert (self.data['plate'] != OTHER_LEVEL).all()
+        assert [(x['variables'], x['decision']) for x in decisions] == [(['plate'], 'lump_levels')]
+
+    def test_lump_rare_levels_constant(self):
+        """
+        a variable whose levels are all rare should be kept as it is, lumping it would leave a constant
+        """
+        decisions = list()
+        lumped_df = lump_rare_levels(self.data, ['well'], 5, decisions)
+
+        assert lumped_df['well'].equals(self.data['well'])
+        assert [(x['variables'], x['decision']) for x in decisions] == [(['well'], 'skip_lump')]
+
+    def test_lump_rare_levels_other_level(self):
+        """
+        the lumped level shouldn't take the name of a level that is in the data
+        """
+        self.data['plate'] = [OTHER_LEVEL] * 25 + ['p2'] * 25 + ['p3'] * 4 + ['other_1'] * 3 + ['p5'] * 3
+        lumped_df = lump_rare_levels(self.data, ['plate'], 5)
+
+        assert lumped_df['plate'].value_counts().to_dict() == {OTHER_LEVEL: 25, 'p2': 25, 'other_2': 10}
+        assert other_level(['x', 'y']) == OTHER_LEVEL
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing plottable function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_plottable(self):
+        """
+        variables with more than max_levels levels should be left out
+        """
+        decisions = list()
+        assert plottable('avcat', 'all', ['well', 'a', 'b'], self.data, decisions=decisions) == ['a', 'b']
+        assert decisions[0]['decision'] == 'skip_plot'
+
+        assert plottable('avcat', 'all', ['well', 'a', 'b'], self.data, None) == ['well', 'a', 'b']
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing sparse_contingency and sparse_chi2 functions
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_sparse_chi2(self):
+        """
+        the chi^2 statistic from the observed cells should match the one from the full table
+        """
+        codes_a, codes_b = pd.factorize(self.data['a'])[0], pd.factorize(self.data['b'])[0]
+        statistic, dof = sparse_chi2(*sparse_contingency(codes_a, codes_b))
+
+        expected = chi2_contingency(dep.contingency_table(codes_a, codes_b), correction=False)
+        assert np.isclose(statistic, expected[0])
+        assert dof == expected[2]
+
+    def test_sparse_chi2_test(self):
+        """
+        pairs over max_table_cells should be counted sparsely, with the same statistics and effect sizes
+        """
+        dense_df = dep.chi2_test(['a', 'b', 'well'], self.data, 'all')
+        decisions = list()
+        sparse_df = dep.chi2_test(['a', 'b', 'well'], self.data, 'all', max_table_cells=100, decisions=decisions)
+
+        is_sparse = sparse_df.p_value_method == 'chi_squared_sparse'
+        assert list(is_sparse) == [False, True, True]
+        assert len(decisions) == 2
+
+        dense_df = dense_df[is_sparse]
+        sparse_df = sparse_df[is_sparse]
+        assert np.allclose(sparse_df.chi_squared_val, dense_df.chi_squared_val)
+        assert np.array_equal(sparse_df.deg_of_fr, dense_df.deg_of_fr)
+        assert np.allclose(sparse_df[['theils_u_1_2', 'theils_u_2_1']], dense_df[['theils_u_1_2', 'theils_u_2_1']])
@@ -10,6 +10,8 @@ Tests for the chi2_test_for_indep.py script
 
 from builtins import breakpoint
 from diagnose.analysis_for_dep import *
+import diagnose.bundle as bundle
+import diagnose.make_record as rec
 import numpy as np
 import pytest
 
@@ -53,6 +55,108 @@ class TestChi2Indep:
         assert df.p_values[(df.cat_var_1 == 'a') & (df.cat_var_2 == 'b')].values < .05 and \
             df.p_values[(df.cat_var_1 == 'a') & (df.cat_var_2 == 'c')].values > 0.05
 
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing contingency_table, cramers_v and theils_u functions
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_contingency_table(self):
+        """
+        the counts should be the same as pandas' crosstab, with the levels in order of first appearance
+        """
+        codes_1, levels_1 = pd.factorize(self.data['a'])
+        codes_2, levels_2 = pd.factorize(self.data['c'])
+
+        ct = pd.crosstab(self.data['a'], self.data['c']).loc[levels_1, levels_2]
+
+        assert np.array_equal(contingency_table(codes_1, codes_2), ct.values)
+
+    def test_effect_sizes(self):
+        """
+        aliased variables should have an effect size of 1, independent ones close to 0, and Theil's U should be
+        asymmetric for a nested variable
+        """
+        df = chi2_test(self.cv, self.data, 'test')
+        alias = df[(df.cat_var_1 == 'a') & (df.cat_var_2 == 'b')].iloc[0]
+        assert np.isclose(alias.cramers_v, 1)
+        assert np.isclose(alias.theils_u_1_2, 1) and np.isclose(alias.theils_u_2_1, 1)
+
+        independent = np.array([[25, 25], [25, 25]])
+        assert cramers_v(independent) == 0
+        assert np.allclose(theils_u(independent), 0)
+
+        # the row variable determines the column variable, but not the other way around
+        nested = np.array([[10, 0], [10, 0], [0, 10], [0, 10]])
+        u_rows, u_cols = theils_u(nested)
+        assert np.isclose(u_cols, 1) and np.isclose(u_rows, 0.5)
+
+        assert np.isnan(cramers_v(np.array([[5, 5]])))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing random_tables, monte_carlo_pvalue and monte_carlo_tests functions
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_random_tables(self):
+        """
+        the random tables should have the given margins, and the expected counts on average
+        """
+        rng = np.random.default_rng(0)
+        tables = random_tables(np.array([3, 5, 2]), np.array([4, 4, 2]), 2000, rng)
+
+        assert (tables.sum(axis=2) == [3, 5, 2]).all() and (tables.sum(axis=1) == [4, 4, 2]).all()
+        assert np.allclose(tables.mean(axis=0), np.outer([3, 5, 2], [4, 4, 2]) / 10, atol=0.1)
+
+    def test_monte_carlo_pvalue(self):
+        """
+        for a 2x2 table the p-value should be close to fisher's exact test, and the same whatever the order of the
+        levels
+        """
+        from scipy.stats import fisher_exact
+
+        observed = np.array([[8, 2], [1, 5]])
+        pval = monte_carlo_pvalue(observed, 20000)
+
+        assert np.isclose(pval, fisher_exact(observed)[1], atol=0.01)
+        assert pval == monte_carlo_pvalue(observed[::-1, ::-1], 20000)
+
+    def test_monte_carlo_tests(self):
+        """
+        only the tables that fail the expected count rule should get a monte carlo p-value, and the p-values should
+        not depend on the number of processes
+        """
+        assert fails_expected_count_rule(np.array([[2.5, 2.5], [2.5, 2.5]]))
+        assert not fails_expected_count_rule(np.array([[5, 6], [7, 8]]))
+
+        df = chi2_test(self.cv, self.data, 'test')
+        assert (df.p_value_method == 'monte_carlo').all()
+
+        pvals = chi2_test(self.cv, self.data, 'test', 1000, 1).p_values.values
+        assert np.array_equal(chi2_test(self.cv, self.data, 'test', 1000, 2).p_values.values, pvals)
+        assert (chi2_test(self.cv, self.data, 'test', 0).p_value_method == 'chi_squared').all()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing kruskal_test function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_kruskal_test(self):
+        """
+        the h-stat and p-value of each categorical x continuous pair should match scipy's kruskal test, missing
+        continuous values left out
+        """
+        from scipy.stats import kruskal
+
+        data = self.data.assign(x=np.random.normal(size=10) + (self.data['a'] == 'bob') * 5.0,
+                                y=np.random.normal(size=10))
+        data.loc[3, 'y'] = np.nan
+
+        df = kruskal_test(self.cv, ['x', 'y'], data, 'test')
+
+        assert len(df) == 6
+        for _, row in df.iterrows():
+            subset = data[~data[row.cat_var_2].isna()]
+            expected = kruskal(*[x[row.cat_var_2].values for _, x in subset.groupby(row.cat_var_1)])
+            assert np.isclose(row.chi_squared_val, expected[0])
+            assert np.isclose(row.p_values, expected[1])
+            assert np.isclose(row.epsilon_squared, expected[0] / (len(subset) - 1))
+
+        assert df.p_values[(df.cat_var_1 == 'a') & (df.cat_var_2 == 'x')].values < 0.05
+
     # ------------------------------------------------------------------------------------------------------------------
     # Testing multiple_testing_correction function
     # ------------------------------------------------------------------------------------------------------------------
@@ -89,6 +193,62 @@ class TestChi2Indep:
         except:
             assert False
 
+    def test_plot_heatmap_bundle(self, tmp_path):
+        """
+        with a bundle the heatmaps are entries of the bundle, and no directory is made for them
+        """
+        df = multiple_testing_correction(chi2_test(self.cv, self.data, 'test'))
+        with bundle.BundleWriter(str(tmp_path / 'output.bundle'), root=str(tmp_path)) as output_bundle:
+            writer = rec.OutputWriter(bundle=output_bundle)
+            plot_heatmap(self.cv, df, str(tmp_path / 'dependence'), 'test', writer=writer)
+
+        assert not os.path.exists(str(tmp_path / 'dependence'))
+        with bundle.BundleReader(str(tmp_path / 'output.bundle')) as reader:
+            assert len(reader.list()) == 3
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing pair_matrix, cluster_order and save_significant_pairs functions
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_pair_matrix(self):
+        """
+        the matrix should be the same as pivoting the mirrored results
+        """
+        df = multiple_testing_correction(chi2_test(self.cv, self.data, 'test'))
+
+        matrix = pair_matrix(self.cv, df, 'corrected_p_value')
+
+        dta = df[['cat_var_1', 'cat_var_2', 'corrected_p_value']]
+        mirrored = pd.concat([dta, dta.rename(columns={'cat_var_1': 'cat_var_2', 'cat_var_2': 'cat_var_1'})])
+        expected = mirrored.pivot_table(values='corrected_p_value', index='cat_var_1', columns='cat_var_2')
+        pd.testing.assert_frame_equal(matrix, expected.loc[self.cv, self.cv], check_names=False)
+
+    def test_cluster_order(self):
+        """
+        dependent variables should end up next to each other
+        """
+        data = pd.DataFrame({'a': np.random.choice(['x', 'y'], 200), 'b': np.random.choice(['x', 'y'], 200),
+                             'c': np.random.choice(['x', 'y'], 200)})
+        data['d'] = data['a']
+        cv = ['a', 'b', 'c', 'd']
+        df = multiple_testing_correction(chi2_test(cv, data, 'test'))
+
+        order = cluster_order(pair_matrix(cv, df, 'corrected_p_value'))
+
+        assert sorted(order) == cv
+        assert abs(order.index('a') - order.index('d')) == 1
+
+    def test_save_significant_pairs(self, tmp_path):
+        """
+        only the pairs below alpha are saved, most significant first
+        """
+        df = multiple_testing_correction(chi2_test(self.cv, self.data, 'test'))
+
+        output = save_significant_pairs(self.cv, df, str(tmp_path), 'test', alpha=0.05)
+        edges = pd.read_csv(output, sep='\t')
+
+        expected = df[df.corrected_p_value < 0.05].sort_values('corrected_p_value')
+        assert list(zip(edges.source, edges.target)) == list(zip(expected.cat_var_1, expected.cat_var_2))
+
     # ------------------------------------------------------------------------------------------------------------------
     # Testing save_df function
     # ------------------------------------------------------------------------------------------------------------------
@@ -123,6 +283,7 @@ class TestChi2Indep:
 
         try:
             run('test', self.cv, data, './pytest_data/')
+            run('test', self.cv, data.assign(x=np.random.normal(size=10)), './pytest_data/', cont_vars=['x'])
             assert True
 
         except:
@@ -0,0 +1,55 @@
+"""
+Tests for the html_report.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.html_report import *
+import diagnose.plotting as plotting
+import re
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class TestHtmlReport(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for html report tests
+        """
+        np.random.seed(27705)
+
+        self.data = pd.DataFrame({'score': np.random.normal(size=200),
+                                  'a': np.random.choice(['x', 'y'], 200),
+                                  'c': np.random.normal(size=200)})
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing Report class
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_report(self, tmp_path):
+        """
+        summaries added to the report are embedded in the html file as json, and can't close the script element
+        """
+        box_stats = plotting.compute_box_stats(self.data, 'score', ['a'])
+        density = plotting.compute_density(self.data.score.values, self.data.c.values, bins=10)
+        matrix = pd.DataFrame([[np.nan, 0.01], [0.01, np.nan]], index=['a', '</script>'], columns=['a', '</script>'])
+
+        report = Report('test')
+        report.add_box_stats('avcat', 'group', 'g1', 'a', box_stats['a'], 'score', 'p-value: 0.1')
+        report.add_density('avcont', 'group', 'g1', 'c', density, 'score')
+        report.add_matrix('dependence', 'group', 'g1', matrix)
+        out_path = report.write(str(tmp_path / 'report.html'))
+
+        with open(out_path, 'r') as html_file:
+            page = html_file.read()
+        data = json.loads(re.search(r'id="report-data">(.*?)</script>', page, re.S).group(1))
+
+        box, dens, mat = data['panels']
+        assert [x['label'] for x in box['data']['boxes']] == [x['label'] for x in box_stats['a']]
+        assert np.isclose(box['data']['boxes'][0]['med'], box_stats['a'][0]['med'])
+        assert sum(cell[2] for cell in dens['data']['cells']) == 200
+        assert mat['data']['values'] == [[None, 0.01], [0.01, None]]
+        assert mat['data']['rows'] == ['a', '</script>']
@@ -0,0 +1,40 @@
+"""
+Tests for the make_record.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import diagnose.make_record as rec
+import pytest
+
+
+class TestMakeRecord(object):
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing open_output and make_hashes_for_files functions
+    # ------------------------------------------------------------------------------------------------------------------
+    @pytest.mark.parametrize('algorithm', rec.HASH_ALGORITHMS)
+    def test_make_hashes_for_files(self, tmp_path, algorithm):
+        """
+        hashes made while writing should match hashing the file from disk, for files written with or without
+        open_output
+        """
+        writer = rec.OutputWriter(algorithm)
+        written = str(tmp_path / 'written.tsv')
+        with rec.open_output(written, writer=writer) as out_file:
+            out_file.write('a\tb\n1\t2\n')
+        other = str(tmp_path / 'other.png')
+        with open(other, 'wb') as out_file:
+            out_file.write(b'\x89PNG')
+
+        files = rec.make_hashes_for_files([{'name': written}, {'name': other}], writer=writer)
+
+        assert [f['hash_' + algorithm] for f in files] == [rec.make_hash(written, algorithm),
+                                                           rec.make_hash(other, algorithm)]
+
+    def test_unknown_hash_algorithm(self):
+        """
+        unknown algorithms are rejected
+        """
+        with pytest.raises(ValueError):
+            rec.OutputWriter('crc32')
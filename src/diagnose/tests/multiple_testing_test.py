@@ -0,0 +1,84 @@
+"""
+Tests for the multiple_testing.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.multiple_testing import *
+import numpy as np
+import pytest
+import scipy.stats as stats
+import statsmodels.stats.multitest as multitest
+
+
+class TestMultipleTesting(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for multiple testing tests
+        """
+        np.random.seed(27705)
+
+        self.pvals = np.random.uniform(size=40) ** 3
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing adjust and correct functions
+    # ------------------------------------------------------------------------------------------------------------------
+    @pytest.mark.parametrize('method', ['fdr_bh', 'fdr_by', 'holm'])
+    def test_correct(self, method):
+        """
+        the same as statsmodels' multipletests
+        """
+        reject, corrected = correct(self.pvals, alpha=0.05, method=method)
+        expected = multitest.multipletests(self.pvals, alpha=0.05, method=method)
+
+        assert (reject == expected[0]).all()
+        np.testing.assert_array_equal(corrected, expected[1])
+
+    def test_adjust_rows(self):
+        """
+        each row is adjusted on its own, missing p-values are left out
+        """
+        pvals = self.pvals.reshape(4, 10).copy()
+        pvals[1, 3] = np.nan
+
+        adjusted = adjust(pvals)
+
+        for row, adjusted_row in zip(pvals, adjusted):
+            keep = ~np.isnan(row)
+            np.testing.assert_allclose(adjusted_row[keep], multitest.multipletests(row[keep], method='fdr_bh')[1])
+        assert np.isnan(adjusted[1, 3])
+
+    def test_hierarchical(self):
+        """
+        corrected p-values are at least the within group ones, and a group with only large p-values stays
+        non-significant
+        """
+        groups = np.repeat(['a', 'b'], 20)
+        pvals = self.pvals.copy()
+        pvals[20:] = np.random.uniform(0.5, 1, size=20)
+
+        corrected = hierarchical(pvals, groups)
+
+        for group in ['a', 'b']:
+            within = adjust(pvals[groups == group])
+            assert (corrected[groups == group] >= within - 1e-12).all()
+        assert (corrected[20:] > 0.05).all()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing corrected_statistic function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_corrected_statistic(self):
+        """
+        the inverse cdf for each test, the statistic is kept where the p-value didn't change
+        """
+        statistic = np.array([1.0, 2.0, 3.0])
+        pvals = np.array([0.1, 0.2, 0.3])
+        corrected = np.array([0.1, 0.4, 0.5])
+        dof = np.array([1, 2, 3])
+
+        result = corrected_statistic(statistic, pvals, corrected, stats.chi2, df=dof)
+
+        expected = [1.0] + [stats.chi2.ppf(q=q, df=d) for q, d in zip(corrected[1:], dof[1:])]
+        np.testing.assert_allclose(result, expected)
@@ -0,0 +1,54 @@
+"""
+Tests for the object_store.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.object_store import *
+import diagnose.make_record as rec
+import pytest
+
+
+class TestObjectStore(object):
+    def make_run(self, run_dir, contents, mode):
+        """
+        write files, store them and write the record for a fake run
+        """
+        os.makedirs(run_dir)
+        files = list()
+        for name, content in contents.items():
+            with open(os.path.join(run_dir, name), 'w') as out_file:
+                out_file.write(content)
+            files.append({'name': os.path.join(run_dir, name)})
+        files = store_files(rec.make_hashes_for_files(files, 'md5'), self.store_dir, 'md5', run_dir, mode)
+        with open(os.path.join(run_dir, 'record.json'), 'w') as json_file:
+            json.dump({'files': files}, json_file)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing store_files, gc and restore_run functions
+    # ------------------------------------------------------------------------------------------------------------------
+    @pytest.mark.parametrize('mode', STORE_MODES)
+    def test_store_gc_restore(self, tmp_path, mode):
+        """
+        identical files in two runs are stored once, and only the objects of deleted runs are garbage collected
+        """
+        self.store_dir = str(tmp_path / 'store')
+        run_1, run_2 = str(tmp_path / 'out' / 'dd__1'), str(tmp_path / 'out' / 'dd__2')
+        self.make_run(run_1, {'a.tsv': 'same', 'b.tsv': 'first'}, mode)
+        self.make_run(run_2, {'a.tsv': 'same', 'b.tsv': 'second'}, mode)
+
+        assert len(glob.glob(os.path.join(self.store_dir, '*', '??', '*'))) == 3
+        if mode == 'hardlink':
+            assert os.path.samefile(os.path.join(run_1, 'a.tsv'), os.path.join(run_2, 'a.tsv'))
+        else:
+            assert not os.path.exists(os.path.join(run_1, 'a.tsv'))
+
+        shutil.rmtree(run_1)
+        removed = gc(self.store_dir, [str(tmp_path / 'out')])
+
+        assert len(removed) == 1
+        if mode == 'manifest':
+            restore_run(self.store_dir, run_2)
+        with open(os.path.join(run_2, 'b.tsv')) as in_file:
+            assert in_file.read() == 'second'
@@ -0,0 +1,110 @@
+"""
+Tests for the plotting.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.plotting import *
+import matplotlib.cbook as cbook
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class TestPlotting(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for plotting tests
+        """
+        np.random.seed(27705)
+
+        self.data = pd.DataFrame({'score': np.random.standard_cauchy(500),
+                                  'a': np.random.choice(['x', 'y', 'z'], 500),
+                                  'b': np.random.choice(['p', 'q'], 500)})
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing compute_box_stats function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_compute_box_stats(self):
+        """
+        the statistics should match matplotlib's boxplot for each value, and the boxes are ordered by median
+        """
+        box_stats = compute_box_stats(self.data, 'score', ['a', 'b'], max_outliers=5)
+
+        for var in ['a', 'b']:
+            assert [x['med'] for x in box_stats[var]] == sorted([x['med'] for x in box_stats[var]], reverse=True)
+            for stats in box_stats[var]:
+                expected = cbook.boxplot_stats(self.data.score[self.data[var] == stats['label']].values)[0]
+                for key in ['med', 'q1', 'q3', 'whislo', 'whishi']:
+                    assert np.isclose(stats[key], expected[key])
+                assert len(stats['fliers']) == min(5, len(expected['fliers']))
+                assert set(stats['fliers']) <= set(expected['fliers'])
+
+        assert np.isclose(box_stats[None][0]['med'], self.data.score.median())
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing compute_density function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_compute_density(self):
+        """
+        every sample without missing values is counted once
+        """
+        x = self.data.score.values.copy()
+        x[:10] = np.nan
+
+        density = compute_density(x, np.random.normal(size=len(x)), bins=20)
+
+        assert density['counts'].shape == (20, 20)
+        assert density['counts'].sum() == len(x) - 10
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing FigureCache class
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_figure_cache(self):
+        """
+        the same layout gives back the same figure with cleared axes, and all figures are closed on exit, including
+        ones pushed out of the cache
+        """
+        import matplotlib.pyplot as plt
+        num_open = len(plt.get_fignums())
+
+        with FigureCache(max_figures=1) as figures:
+            fig, axes, reused = figures.get('a', nrows=2, sharex=True)
+            axes[0].plot([0, 1], [0, 1])
+            assert not reused
+
+            fig_again, axes_again, reused = figures.get('a', nrows=2, sharex=True)
+            assert reused and fig_again is fig
+            assert len(axes_again[0].lines) == 0
+
+            figures.get('b', nrows=3)
+            assert len(plt.get_fignums()) == num_open + 1
+
+        assert len(plt.get_fignums()) == num_open
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing PlotBudget class
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_plot_budget(self):
+        """
+        variables after the top k and figures after the cap are skipped and listed, groups with the best p-value go
+        first
+        """
+        results_df = pd.DataFrame({'group': ['g1', 'g1', 'g1', 'g2', 'g2'],
+                                   'variable': ['a', 'b', 'c', 'a', 'b'],
+                                   'pval': [0.2, 0.3, 0.4, 0.01, 0.5]})
+        budget = PlotBudget(top_k=2, max_plots=1)
+
+        assert budget.order_groups(results_df, 'pval') == ['g2', 'g1']
+        assert budget.select('avcat', 'group', 'g1', results_df.variable[:3]) == ['a', 'b']
+
+        assert budget.allow('avcat', 'group', 'g2', ['a', 'b'])
+        with budget.timed():
+            pass
+        assert not budget.allow('avcat', 'group', 'g1', ['a', 'b'])
+
+        assert [(x['group'], x['variable'], x['reason']) for x in budget.skipped] == \
+               [('g1', 'c', 'top_k'), ('g1', 'a', 'max_plots'), ('g1', 'b', 'max_plots')]
+        assert budget.num_plots == 1
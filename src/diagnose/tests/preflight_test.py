@@ -0,0 +1,229 @@
+"""
+Tests for the preflight.py script
+
+:copyright: (c) 2020, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.preflight import *
+import diagnose.analysis_for_dep as chi2
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class TestPreflight(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for preflight tests
+        """
+        np.random.seed(27705)
+
+        self.data = pd.DataFrame({'a': ['x', 'x', 'y', 'y', 'y'],
+                                  'b': ['1', '2', '1', '1', '1'],
+                                  'c': ['u', 'u', 'u', 'v', 'u']})
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing encode_combinations and decode_combination functions
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_encode_decode_combinations(self):
+        """
+        codes should follow the order of itertools.product and decode back to the level codes of the row
+        """
+        radices = [3, 2, 4]
+        codes = np.array(list(itertools.product(*[range(r) for r in radices])))
+
+        encoded = encode_combinations(codes, radices)
+
+        assert (encoded == np.arange(len(codes))).all()
+        assert all(decode_combination(e, radices) == tuple(c) for e, c in zip(encoded, codes))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing get_covered_combinations function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_get_covered_combinations(self):
+        """
+        compare against brute force enumeration of all combinations of levels
+        """
+        perc, missing = get_covered_combinations(self.data)
+
+        unique_col_vals = [self.data[col].unique() for col in self.data.columns]
+        rows = self.data.values.tolist()
+        expected = [c for c in itertools.product(*unique_col_vals) if list(c) not in rows]
+
+        assert perc == 1 - len(expected) / 8
+        assert missing == expected
+
+    def test_get_covered_combinations_full(self):
+        """
+        a full factorial design is completely covered
+        """
+        df = pd.DataFrame(list(itertools.product(['a', 'b'], ['c', 'd', 'e'])) * 2)
+
+        assert get_covered_combinations(df) == (1, [])
+
+    def test_get_covered_combinations_capped(self):
+        """
+        a large design still reports the exact coverage but only max_missing combinations
+        """
+        df = pd.DataFrame(np.random.randint(0, 4, size=(200, 12)).astype(str))
+
+        perc, missing = get_covered_combinations(df, max_missing=10)
+
+        assert perc == len(df.drop_duplicates()) / 4 ** 12
+        assert len(missing) == 10
+        assert not set(missing) & set(map(tuple, df.values.tolist()))
+
+    def test_get_covered_combinations_encoded(self):
+        """
+        passing the combinations encoded once gives the same results as encoding them in each call
+        """
+        combinations = get_unique_combinations(self.data)
+
+        assert count_covered_combinations(self.data, combinations) == count_covered_combinations(self.data)
+        assert get_covered_combinations(self.data, 3, combinations) == get_covered_combinations(self.data, 3)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing get_t_wise_coverage function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_get_t_wise_coverage(self):
+        """
+        pairwise coverage should match get_covered_combinations run on each pair of columns
+        """
+        results = get_t_wise_coverage(self.data, t=2)
+
+        assert [r['variables'] for r in results] == [['a', 'b'], ['a', 'c'], ['b', 'c']]
+        for r in results:
+            perc, missing = get_covered_combinations(self.data[r['variables']])
+            assert r['prop_combos_covered'] == perc
+            assert [tuple(m) for m in r['missing_combos']] == missing
+
+    def test_get_t_wise_coverage_parallel(self):
+        """
+        splitting the subsets into chunks over several processes gives the same results
+        """
+        df = pd.DataFrame(np.random.randint(0, 3, size=(50, 8)).astype(str))
+
+        serial = get_t_wise_coverage(df, t=3)
+        parallel = get_t_wise_coverage(df, t=3, n_jobs=2, max_chunk_elements=500)
+
+        assert serial == parallel
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing suggest_design_completion function
+    # ------------------------------------------------------------------------------------------------------------------
+    @pytest.mark.parametrize('t', [2, 3])
+    def test_suggest_design_completion(self, t):
+        """
+        adding the proposed runs to the design should give full t-wise coverage
+        """
+        df = pd.DataFrame(np.random.randint(0, 3, size=(20, 10)).astype(str))
+
+        new_runs = suggest_design_completion(df, t)
+        completed = pd.concat([df, new_runs], ignore_index=True)
+
+        assert list(new_runs.columns) == list(df.columns)
+        assert all(r['prop_combos_covered'] == 1 for r in get_t_wise_coverage(completed, t))
+
+    def test_suggest_design_completion_covered(self):
+        """
+        no runs are proposed for a design that is already covered
+        """
+        df = pd.DataFrame(list(itertools.product(['a', 'b'], ['c', 'd'])))
+
+        assert len(suggest_design_completion(df, 2)) == 0
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing estimate_power function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_estimate_power(self):
+        """
+        a large effect should be detected most of the time, a variable with no effect should rarely be significant,
+        and the estimate should not depend on how the simulations are split over processes
+        """
+        df = pd.DataFrame(list(itertools.product(['a', 'b', 'c'], ['d', 'e'])) * 5, columns=['big', 'none'])
+        df['static'] = 'x'
+
+        power_df = estimate_power(df, {'big': 3}, n_sim=200, batch_size=50)
+        parallel_df = estimate_power(df, {'big': 3}, n_sim=200, batch_size=50, n_jobs=2)
+
+        assert list(power_df.variable) == ['big', 'none']
+        assert power_df.power[0] > 0.9
+        assert power_df.power[1] < 0.2
+        pd.testing.assert_frame_equal(power_df, parallel_df)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing summarize_replicates and write_replicates_table functions
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_summarize_replicates(self):
+        """
+        check the histogram, under-replicated combinations and marginals on a small design
+        """
+        summary = summarize_replicates(get_num_replicates(self.data), min_replicates=2)
+
+        assert summary['num_combos_observed'] == 4
+        assert summary['replicate_count_histogram'] == {'1': 3, '2': 1}
+        assert summary['num_under_replicated_combos'] == 3
+        assert summary['marginals']['a'] == {'x': {'num_samples': 2, 'num_combos': 2, 'min_replicates': 1},
+                                             'y': {'num_samples': 3, 'num_combos': 2, 'min_replicates': 1}}
+
+    def test_write_replicates_table(self, tmp_path):
+        """
+        writing in chunks gives the same table back
+        """
+        replicates = get_num_replicates(self.data)
+
+        out_path = write_replicates_table(replicates, str(tmp_path / 'replicates.tsv'), chunk_size=3)
+
+        pd.testing.assert_frame_equal(pd.read_csv(out_path, sep='\t', dtype={'b': object}), replicates)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing the incremental preflight state
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_incremental_state(self, tmp_path):
+        """
+        adding samples in two batches, with a save and load in between, should give the same results as the full
+        data set
+        """
+        df = pd.DataFrame(np.random.randint(0, 3, size=(40, 4)).astype(str), columns=['a', 'b', 'c', 'd'])
+        df.loc[30:, 'a'] = '9'  # a level that only shows up in the second batch
+        df.loc[[3, 17, 35], 'd'] = np.nan  # missing values in both batches
+
+        state = update_preflight_state(new_preflight_state(df.columns), df.iloc[:30])
+        save_preflight_state(state, str(tmp_path / 'state.json'))
+        state = load_preflight_state(str(tmp_path / 'state.json'))
+        assert state_matches(state, df)
+        update_preflight_state(state, df.iloc[state['num_rows']:])
+
+        assert state_varying_categories(state)[0].equals(check_varying_categories(df)[0])
+        pd.testing.assert_frame_equal(state_num_replicates(state), get_num_replicates(df))
+        perc, missing, num_possible, num_missing = state_covered_combinations(state)
+        assert (perc, missing) == get_covered_combinations(df)
+        assert state_pairwise_coverage(state) == get_t_wise_coverage(df, 2)
+
+        expected = chi2.chi2_test(df.columns, df, 'all')
+        np.testing.assert_allclose(state_chi2_test(state)[['chi_squared_val', 'p_values']].values,
+                                   expected[['chi_squared_val', 'p_values']].values)
+
+        assert not state_matches(state, df.iloc[::-1])
+
+    def test_state_matches(self):
+        """
+        the state should only match data that starts with the same samples, whatever the index
+        """
+        df = pd.DataFrame(np.random.randint(0, 3, size=(40, 3)).astype(str), columns=['a', 'b', 'c'])
+        state = update_preflight_state(new_preflight_state(df.columns), df.iloc[:30])
+
+        assert state_matches(state, df)
+        assert state_matches(new_preflight_state(df.columns), df)
+
+        edited_df = df.copy()
+        edited_df.loc[5, 'b'] = '9'  # an earlier sample changed, the last one is the same
+        assert not state_matches(state, edited_df)
+
+        swapped_df = df.iloc[[1, 0] + list(range(2, 40))]
+        assert not state_matches(state, swapped_df)
+        assert not state_matches(state, swapped_df.reset_index(drop=True))
+        assert not state_matches(state, df.set_index(df.index + 100))
@@ -0,0 +1,160 @@
+"""
+Tests for the rank_tests.py script
+
+:copyright: (c) 2021, GDA
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+from diagnose.rank_tests import *
+import numpy as np
+import pandas as pd
+from scipy.stats import kruskal, rankdata
+import pytest
+
+
+class TestRankTests(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for rank test tests
+        """
+        np.random.seed(27705)
+
+        self.values = np.random.normal(size=(5, 30))
+        self.codes = np.random.randint(0, 3, size=30)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing kruskal_h and kruskal_pval functions
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_kruskal(self):
+        """
+        every row should match scipy's kruskal test
+        """
+        h_stat = kruskal_h(rank_rows(self.values), self.codes, 3)
+        pval = kruskal_pval(h_stat, 3)
+
+        for i, row in enumerate(self.values):
+            expected = kruskal(*[row[self.codes == c] for c in range(3)])
+            assert np.isclose(h_stat[i], expected[0])
+            assert np.isclose(pval[i], expected[1])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing tie_correction and kruskal_h_pairs functions
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_tie_correction(self):
+        """
+        should match scipy's tiecorrect, missing values left out
+        """
+        from scipy.stats import tiecorrect, rankdata
+
+        values = np.round(self.values, 0)
+        values[0, 3] = np.nan
+        ties = tie_correction(rank_rows(values))
+
+        for i, row in enumerate(values):
+            assert np.isclose(ties[i], tiecorrect(rankdata(row[~np.isnan(row)])))
+
+    def test_kruskal_h_pairs(self):
+        """
+        every continuous x categorical pair should match scipy's kruskal test
+        """
+        values = np.round(self.values, 1)
+        values[1, 0] = np.nan
+        codes_list = [self.codes, np.random.randint(0, 4, size=30)]
+        ranks = rank_rows(values)
+        indicator, starts = one_hot(codes_list)
+
+        h_stat, dof, n = kruskal_h_pairs(ranks, indicator, starts, tie_correction(ranks))
+
+        assert h_stat.shape == (5, 2)
+        for i, row in enumerate(values):
+            keep = ~np.isnan(row)
+            assert n[i] == keep.sum()
+            for j, codes in enumerate(codes_list):
+                expected = kruskal(*[row[keep & (codes == c)] for c in np.unique(codes)])
+                assert np.isclose(h_stat[i, j], expected[0])
+                assert dof[i, j] == len(np.unique(codes)) - 1
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing permutation_kruskal_pval function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_permutation_kruskal_pval(self):
+        """
+        the permutation p-value should be close to the exact p-value from all distinct permutations of the labels, and
+        stop early for an obvious case
+        """
+        import itertools
+
+        values = np.round(self.values[0, :9], 1)
+        values[:3] += 1.5
+        codes = np.repeat([0, 1, 2], 3)
+
+        ranks = rankdata(values)
+
+        def statistic(x):
+            return sum(ranks[x == c].sum() ** 2 / 3 for c in range(3))
+        labels = np.array(sorted(set(itertools.permutations(codes))))
+        exact = np.mean([statistic(x) >= statistic(codes) - 1e-9 for x in labels])
+
+        pval, num_permutations = permutation_kruskal_pval(values, codes, 20000, alpha=1, min_alpha=0)
+        assert num_permutations == 20000
+        assert np.isclose(pval, exact, atol=0.01)
+
+        pval, num_permutations = permutation_kruskal_pval(np.random.normal(size=30), self.codes)
+        assert num_permutations == 100 and pval > 0.05
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing spearman_matrix function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_spearman_matrix(self):
+        """
+        the correlations should match pandas, each pair from the samples where both variables are present
+        """
+        values = np.round(self.values.T, 1)
+        values[:3, 1] = np.nan
+        values[5:9, 2] = np.nan
+        values[7, 4] = np.nan
+
+        rho, n = spearman_matrix(values)
+        df = pd.DataFrame(values)
+        assert np.allclose(rho, df.corr(method='spearman').values)
+        assert np.array_equal(n, df.notna().values.T.astype(int) @ df.notna().values)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing spearman_pvals and spearman_cis functions
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_spearman_pvals(self):
+        """
+        the p-values should match scipy's spearmanr, and the intervals should contain the correlation
+        """
+        from scipy.stats import spearmanr
+
+        rho = np.array([spearmanr(self.values[0], x)[0] for x in self.values[1:]])
+        expected = np.array([spearmanr(self.values[0], x)[1] for x in self.values[1:]])
+        assert np.allclose(spearman_pvals(rho, np.full(4, 30)), expected)
+        assert np.isnan(spearman_pvals([0.5], [2])).all()
+
+        lower, upper = spearman_cis(rho, np.full(4, 30))
+        assert (lower < rho).all() and (rho < upper).all()
+        assert np.isnan(spearman_cis([0.5], [3])[0]).all()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Testing permutation_spearman_pvals function
+    # ------------------------------------------------------------------------------------------------------------------
+    def test_permutation_spearman_pvals(self):
+        """
+        the permutation p-values should be close to the exact p-values from all permutations of a few samples
+        """
+        import itertools
+
+        x = self.values[0, :7]
+        values = self.values[1:, :7].T
+        values[:, 0] = x + 0.1 * values[:, 0]
+
+        ranks = rankdata(values, axis=0) - 4
+        observed = np.abs((rankdata(x) - 4) @ ranks)
+        permuted = np.abs(np.array([rankdata(x)[list(p)] - 4 for p in itertools.permutations(range(7))]) @ ranks)
+        exact = (permuted >= observed - 1e-9).mean(axis=0)
+
+        pvals = permutation_spearman_pvals(x, values, 20000)
+        assert np.allclose(pvals, exact, atol=0.01)